@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# add-dc-rights.py 1.1.2
+# add-dc-rights.py 1.1.3
 #
 # Copyright Alan Orth.
 #
@@ -40,6 +40,7 @@ import signal
 import sys
 
 import psycopg2
+import util
 from colorama import Fore
 
 
@@ -108,6 +109,11 @@ def main():
 
         exit(1)
 
+    # get the metadata_field_id for the dc.rights field
+    with conn:
+        with conn.cursor() as cursor:
+            rights_field_id = util.field_name_to_field_id(cursor, "dc.rights")
+
     # open the CSV
     reader = csv.DictReader(args.csv_file)
 
@@ -176,10 +182,9 @@ def main():
                     continue
 
                 # Check if this item already has dc.rights metadata
-                # resource_type_id 2 is for item metadata, metadata_field_id 53 is dc.rights
-                sql = "SELECT text_value FROM metadatavalue WHERE resource_type_id=2 AND resource_id=%s AND metadata_field_id=53"
-                # remember that tuples with one item need a comma after them!
-                cursor.execute(sql, (resource_id,))
+                # resource_type_id 2 is for item metadata
+                sql = "SELECT text_value FROM metadatavalue WHERE resource_type_id=2 AND resource_id=%s AND metadata_field_id=%s"
+                cursor.execute(sql, (resource_id, rights_field_id))
 
                 # if rowcount is greater than 0 there must be existing rights for this item
                 if cursor.rowcount > 0:
@@ -219,10 +224,11 @@ def main():
                 cursor.execute("SELECT nextval('metadatavalue_seq')")
                 metadata_value_id = cursor.fetchone()[0]
 
-                # resource_type_id 2 is for item metadata, metadata_field_id 53 is dc.rights
+                # resource_type_id 2 is for item metadata
                 sql = "INSERT INTO metadatavalue (metadata_value_id, resource_id, metadata_field_id, text_value, place, confidence, resource_type_id) VALUES (%s, %s, %s, %s, %s, %s, %s)"
                 cursor.execute(
-                    sql, (metadata_value_id, resource_id, 53, rights, 1, -1, 2)
+                    sql,
+                    (metadata_value_id, resource_id, rights_field_id, rights, 1, -1, 2),
                 )
 
     if args.debug:
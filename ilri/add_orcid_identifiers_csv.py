@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# add-orcid-identifiers-csv.py v1.1.6
+# add-orcid-identifiers-csv.py v1.2.0
 #
 # Copyright Alan Orth.
 
@@ -72,6 +72,11 @@ def main():
     parser.add_argument(
         "--database-pass", "-p", help="Database password", required=True
     )
+    parser.add_argument(
+        "--change-journal",
+        help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+        default="changed-items.txt",
+    )
     parser.add_argument(
         "--debug",
         "-d",
@@ -111,6 +116,13 @@ def main():
 
     cursor = conn.cursor()
 
+    # get the metadata_field_ids for the author and cg.creator.identifier fields
+    author_field_id = util.field_name_to_field_id(cursor, "dc.contributor.author")
+    orcid_field_id = util.field_name_to_field_id(cursor, "cg.creator.identifier")
+
+    # Items we've changed, so we can update their last_modified dates in batches
+    last_modified = util.LastModifiedBatch()
+
     # open the CSV
     reader = csv.DictReader(args.csv_file)
 
@@ -123,10 +135,8 @@ def main():
         )
 
         # find all item metadata records with this author name
-        # metadata_field_id 3 is author
-        sql = "SELECT dspace_object_id, place FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=3 AND text_value=%s"
-        # remember that tuples with one item need a comma after them!
-        cursor.execute(sql, (author_name,))
+        sql = "SELECT dspace_object_id, place FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
+        cursor.execute(sql, (author_field_id, author_name))
         records_with_author_name = cursor.fetchall()
 
         if len(records_with_author_name) > 0:
@@ -164,11 +174,6 @@ def main():
                 place = record[1]
                 confidence = -1
 
-                # get the metadata_field_id for the cg.creator.identifier field
-                metadata_field_id = util.field_name_to_field_id(
-                    cursor, "cg.creator.identifier"
-                )
-
                 # check if there is an existing cg.creator.identifier with this author's ORCID identifier for this item (without restricting the "place")
                 # note that the SQL here is quoted differently to allow us to use LIKE with % wildcards with our paremeter subsitution
                 sql = "SELECT * from metadatavalue WHERE dspace_object_id=%s AND metadata_field_id=%s AND text_value LIKE '%%' || %s || '%%' AND confidence=%s AND dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn)"
@@ -177,7 +182,7 @@ def main():
                     sql,
                     (
                         dspace_object_id,
-                        metadata_field_id,
+                        orcid_field_id,
                         orcid_identifier,
                         confidence,
                     ),
@@ -210,7 +215,7 @@ def main():
                         (
                             metadata_value_id,
                             dspace_object_id,
-                            metadata_field_id,
+                            orcid_field_id,
                             text_value,
                             place,
                             confidence,
@@ -218,7 +223,7 @@ def main():
                     )
 
                     # Update the last_modified date for each item
-                    util.update_item_last_modified(cursor, dspace_object_id)
+                    last_modified.add(cursor, [dspace_object_id])
                 else:
                     logger.debug(
                         Fore.GREEN
@@ -230,8 +235,13 @@ def main():
 
     # commit the changes
     if not args.dry_run:
+        last_modified.flush(cursor)
+
         conn.commit()
 
+        # Record the items we've changed so they can be reindexed in Discovery
+        util.ChangeJournal(args.change_journal).add(last_modified.updated)
+
     # close the database connection before leaving
     conn.close()
 
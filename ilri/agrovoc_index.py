@@ -0,0 +1,314 @@
+# agrovoc_index.py v0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper class for validating subjects against a local copy of AGROVOC instead
+# of the AGROVOC REST API. AGROVOC publishes a full dump every month, either as
+# N-Triples or RDF/XML, optionally gzipped.
+#
+# The dump is read once, without loading it into memory, and all the preferred
+# and alternative labels of the concepts are saved in an SQLite database with
+# the case-folded label as the key. Both plain SKOS labels and SKOS-XL labels
+# (a label resource with a literal form) are supported. After that, only a new
+# dump needs to be indexed again.
+#
+# See: https://www.fao.org/agrovoc/releases
+#
+
+import gzip
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+
+SKOS = "http://www.w3.org/2004/02/skos/core#"
+SKOSXL = "http://www.w3.org/2008/05/skos-xl#"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XML = "http://www.w3.org/XML/1998/namespace"
+
+# Label predicates and the match type we report for them
+label_types = {
+    f"{SKOS}prefLabel": "prefLabel",
+    f"{SKOS}altLabel": "altLabel",
+}
+skosxl_label_types = {
+    f"{SKOSXL}prefLabel": "prefLabel",
+    f"{SKOSXL}altLabel": "altLabel",
+}
+skosxl_literal_form = f"{SKOSXL}literalForm"
+
+# One triple per line: subject, predicate, and either a URI or a literal with an
+# optional language tag or datatype. Blank nodes are not needed for labels.
+ntriple_pattern = re.compile(
+    r'^<([^>]*)>\s+<([^>]*)>\s+(?:<([^>]*)>|"((?:[^"\\]|\\.)*)"(?:@([A-Za-z0-9-]+)|\^\^<[^>]*>)?)\s*\.\s*$'
+)
+ntriple_escape_pattern = re.compile(r"\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)")
+ntriple_escapes = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+def unescape_ntriple_literal(literal: str) -> str:
+    """Replace the escape sequences in an N-Triples literal.
+
+    :param literal: the literal, without quotes.
+    :returns str
+    """
+
+    def replace(match):
+        escape = match.group(1)
+
+        if escape[0] in "uU":
+            return chr(int(escape[1:], 16))
+
+        return ntriple_escapes.get(escape, escape)
+
+    return ntriple_escape_pattern.sub(replace, literal)
+
+
+class AgrovocIndex:
+    """An index of AGROVOC labels in an SQLite database."""
+
+    def __init__(self, index_filename: str):
+        """Open the index, creating an empty one if needed.
+
+        :param index_filename: path to the SQLite database with the index.
+        """
+
+        self.db = sqlite3.connect(index_filename)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dump (filename TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS labels (label TEXT NOT NULL, concept TEXT NOT NULL, language TEXT NOT NULL, type TEXT NOT NULL, PRIMARY KEY (label, type, language, concept)) WITHOUT ROWID"
+        )
+
+    def is_current(self, dump_filename: str) -> bool:
+        """Check if the index was built from this dump.
+
+        :param dump_filename: path to the AGROVOC dump.
+        :returns bool
+        """
+
+        stat = os.stat(dump_filename)
+
+        return (
+            self.db.execute(
+                "SELECT 1 FROM dump WHERE filename=? AND size=? AND mtime=?",
+                (os.path.basename(dump_filename), stat.st_size, stat.st_mtime),
+            ).fetchone()
+            is not None
+        )
+
+    def build(self, dump_filename: str):
+        """Replace the index with the labels from an AGROVOC dump.
+
+        Files ending in .nt (or .nt.gz) are read as N-Triples, anything else as
+        RDF/XML.
+
+        :param dump_filename: path to the AGROVOC dump.
+        """
+
+        stat = os.stat(dump_filename)
+
+        if dump_filename.endswith(".gz"):
+            f = gzip.open(dump_filename, "rb")
+            name = dump_filename[:-3]
+        else:
+            f = open(dump_filename, "rb")
+            name = dump_filename
+
+        # Only commit when the whole dump is indexed, so an interrupted run
+        # doesn't leave us with half an index
+        with f, self.db:
+            self.db.execute("DELETE FROM labels")
+            self.db.execute("DELETE FROM dump")
+
+            # SKOS-XL labels are resources of their own, so we need to remember
+            # which concept each one belongs to and what its literal form is
+            # until we have seen both
+            self.db.execute(
+                "CREATE TEMPORARY TABLE skosxl_labels (label_uri TEXT NOT NULL, concept TEXT NOT NULL, type TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TEMPORARY TABLE skosxl_literals (label_uri TEXT PRIMARY KEY, literal TEXT NOT NULL, language TEXT NOT NULL)"
+            )
+
+            if name.endswith(".nt"):
+                triples = self.read_ntriples(f)
+            else:
+                triples = self.read_rdfxml(f)
+
+            for subject, predicate, value, language in triples:
+                if predicate in label_types:
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO labels (label, concept, language, type) VALUES (?, ?, ?, ?)",
+                        (value.casefold(), subject, language, label_types[predicate]),
+                    )
+                elif predicate in skosxl_label_types:
+                    self.db.execute(
+                        "INSERT INTO skosxl_labels (label_uri, concept, type) VALUES (?, ?, ?)",
+                        (value, subject, skosxl_label_types[predicate]),
+                    )
+                elif predicate == skosxl_literal_form:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO skosxl_literals (label_uri, literal, language) VALUES (?, ?, ?)",
+                        (subject, value, language),
+                    )
+
+            # Python's lower() and casefold() don't agree with SQLite's, so the
+            # SKOS-XL labels are case folded here rather than in SQL
+            self.db.executemany(
+                "INSERT OR IGNORE INTO labels (label, concept, language, type) VALUES (?, ?, ?, ?)",
+                (
+                    (literal.casefold(), concept, language, type)
+                    for literal, concept, language, type in self.db.cursor().execute(
+                        "SELECT l.literal, x.concept, l.language, x.type FROM skosxl_labels x JOIN skosxl_literals l USING (label_uri)"
+                    )
+                ),
+            )
+
+            self.db.execute("DROP TABLE skosxl_labels")
+            self.db.execute("DROP TABLE skosxl_literals")
+
+            self.db.execute(
+                "INSERT INTO dump (filename, size, mtime) VALUES (?, ?, ?)",
+                (os.path.basename(dump_filename), stat.st_size, stat.st_mtime),
+            )
+
+    @staticmethod
+    def read_ntriples(f):
+        """Yield the triples we are interested in from an N-Triples file.
+
+        :param f: the file, opened in binary mode.
+        :returns iterator of (subject, predicate, value, language) tuples
+        """
+
+        interesting = (
+            label_types.keys() | skosxl_label_types.keys() | {skosxl_literal_form}
+        )
+
+        for line in f:
+            line = line.decode("utf-8")
+
+            # Skip anything that can't be a label, before the expensive regex
+            if (
+                "#prefLabel>" not in line
+                and "#altLabel>" not in line
+                and "#literalForm>" not in line
+            ):
+                continue
+
+            match = ntriple_pattern.match(line)
+            if match is None:
+                continue
+
+            subject, predicate, uri, literal, language = match.groups()
+
+            if predicate not in interesting:
+                continue
+
+            if uri is not None:
+                yield subject, predicate, uri, ""
+            else:
+                yield subject, predicate, unescape_ntriple_literal(literal), (
+                    language or ""
+                ).lower()
+
+    @staticmethod
+    def read_rdfxml(f):
+        """Yield the triples we are interested in from an RDF/XML file.
+
+        Each top-level description is parsed and then thrown away, so memory
+        use doesn't grow with the size of the file.
+
+        :param f: the file, opened in binary mode.
+        :returns iterator of (subject, predicate, value, language) tuples
+        """
+
+        depth = 0
+        root = None
+
+        for event, element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+
+                depth += 1
+                continue
+
+            depth -= 1
+
+            # Wait for the whole description, directly below rdf:RDF
+            if depth != 1:
+                continue
+
+            yield from AgrovocIndex.read_rdfxml_description(element)
+
+            root.clear()
+
+    @staticmethod
+    def read_rdfxml_description(element):
+        """Yield the triples we are interested in from an RDF/XML description.
+
+        Handles SKOS-XL labels that are nested in the concept as well as ones
+        that are described separately.
+
+        :param element: the description element.
+        :returns iterator of (subject, predicate, value, language) tuples
+        """
+
+        subject = element.get(f"{{{RDF}}}about")
+        if subject is None:
+            return
+
+        for child in element:
+            # The tag is the predicate, for example {ns}prefLabel
+            predicate = child.tag.replace("{", "").replace("}", "")
+
+            if predicate in label_types or predicate == skosxl_literal_form:
+                if child.text:
+                    yield subject, predicate, child.text, child.get(
+                        f"{{{XML}}}lang", ""
+                    ).lower()
+            elif predicate in skosxl_label_types:
+                label_uri = child.get(f"{{{RDF}}}resource")
+
+                if label_uri is None:
+                    # The label is nested, so describe it too
+                    for label in child:
+                        label_uri = label.get(f"{{{RDF}}}about")
+
+                        yield from AgrovocIndex.read_rdfxml_description(label)
+
+                if label_uri is not None:
+                    yield subject, predicate, label_uri, ""
+
+    def search(self, subject: str, language: str = None) -> list:
+        """Return the labels that match a subject, ignoring case.
+
+        Preferred labels come before alternative labels.
+
+        :param subject: the subject, for example "livestock".
+        :param language: only return labels in this language, for example "en".
+        :returns list of (concept, language, type) tuples
+        """
+
+        sql = "SELECT concept, language, type FROM labels WHERE label=?"
+        params = [subject.casefold()]
+
+        if language:
+            sql += " AND language=?"
+            params.append(language.lower())
+
+        # "altLabel" sorts before "prefLabel"
+        sql += " ORDER BY type DESC, language, concept"
+
+        return self.db.execute(sql, params).fetchall()
+
+    def close(self):
+        """Close the index."""
+
+        self.db.close()
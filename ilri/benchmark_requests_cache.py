@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# benchmark-requests-cache.py 0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Compare the storage backends for the requests cache shared by the scripts that
+# look things up in external APIs (see util.requests_cache_backend()). We take a
+# sample of the responses in the current cache and replay them against a fresh
+# cache for each backend, with and without compression, and report:
+#
+#   - hit: how long it takes to get a response that is in the cache
+#   - miss: how long it takes to find out a response is not in the cache and
+#     save it after fetching it from the API (not counting the API itself)
+#   - size: how much disk space the cache uses
+#   - prune: how long it takes to remove responses older than --older-than days
+#     like prune_requests_cache.py does
+#
+# Set cache_backend and cache_compress in util.py to use the winner.
+#
+# This script is written for Python 3 and requires several modules that you can
+# install with pip (I recommend setting up a Python virtual environment first):
+#
+#   $ pip install colorama requests-cache
+#
+
+import argparse
+import itertools
+import os
+import random
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import util
+from colorama import Fore
+from requests_cache import SQLiteCache
+from requests_cache.serializers import pickle_serializer
+
+
+def signal_handler(signal, frame):
+    sys.exit(1)
+
+
+def disk_usage(directory: str) -> int:
+    """Return the disk space used by all files in a directory.
+
+    This includes the SQLite WAL files and the extra files some dbm modules
+    create next to the database.
+    """
+
+    total = 0
+
+    for root, dirs, files in os.walk(directory):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+    return total
+
+
+def benchmark(name: str, cache, cache_directory: str, responses: list):
+    """Replay the recorded responses against a cache and print the results.
+
+    :param name: name of the backend to print.
+    :param cache: a requests-cache backend. It is cleared first.
+    :param cache_directory: directory with the cache, to measure its size.
+    :param responses: list of CachedResponse objects.
+    """
+
+    cache.clear()
+
+    miss_times = []
+
+    for response in responses:
+        start = time.perf_counter()
+
+        if cache.get_response(response.cache_key) is None:
+            cache.save_response(response, response.cache_key, response.expires)
+
+        miss_times.append(time.perf_counter() - start)
+
+    # Read the responses in a different order than we wrote them, like the
+    # lookup scripts do
+    keys = [response.cache_key for response in responses]
+    random.Random(0).shuffle(keys)
+
+    hit_times = []
+
+    for key in keys:
+        start = time.perf_counter()
+        cache.get_response(key)
+        hit_times.append(time.perf_counter() - start)
+
+    size = disk_usage(cache_directory)
+
+    start = time.perf_counter()
+    cache.delete(older_than=timedelta(days=args.older_than))
+    prune_time = time.perf_counter() - start
+
+    cache.close()
+
+    hit_times.sort()
+
+    sys.stdout.write(
+        f"{name:<26} {statistics.mean(hit_times) * 1000:>9.3f} {hit_times[int(len(hit_times) * 0.95)] * 1000:>9.3f} {statistics.mean(miss_times) * 1000:>9.3f} {size / 1024 / 1024:>10.1f} {prune_time:>9.2f}\n"
+    )
+
+
+parser = argparse.ArgumentParser(
+    description="Compare the storage backends for the requests cache."
+)
+parser.add_argument(
+    "-b",
+    "--backends",
+    help="Backends to compare (default all).",
+    nargs="+",
+    choices=["sqlite", "filesystem", "dbm"],
+    default=["sqlite", "filesystem", "dbm"],
+)
+parser.add_argument(
+    "-d",
+    "--directory",
+    help="Directory to create the caches in (default a temporary directory that is removed afterwards).",
+)
+parser.add_argument(
+    "-n",
+    "--limit",
+    help="Number of recorded responses to replay (default 1000).",
+    type=int,
+    default=1000,
+)
+parser.add_argument(
+    "--older-than",
+    help="Prune responses older than this many days (default 30).",
+    type=int,
+    default=30,
+)
+args = parser.parse_args()
+
+# set the signal handler for SIGINT (^C)
+signal.signal(signal.SIGINT, signal_handler)
+
+responses = [
+    response
+    for response in itertools.islice(
+        util.requests_session().cache.responses.values(), args.limit
+    )
+    if response is not None
+]
+
+if not responses:
+    sys.stderr.write(f"{Fore.RED}The requests cache is empty.{Fore.RESET}\n")
+
+    sys.exit(1)
+
+sys.stdout.write(
+    f"{Fore.GREEN}Replaying {len(responses)} recorded responses.{Fore.RESET}\n\n"
+)
+
+if args.directory:
+    os.makedirs(args.directory, exist_ok=True)
+    directory = args.directory
+else:
+    directory = tempfile.mkdtemp(prefix="benchmark-requests-cache-")
+
+sys.stdout.write(
+    f"{'backend':<26} {'hit (ms)':>9} {'hit p95':>9} {'miss (ms)':>9} {'size (MiB)':>10} {'prune (s)':>9}\n"
+)
+
+try:
+    # How the cache was stored before we tuned SQLite, for comparison
+    if "sqlite" in args.backends:
+        cache_directory = os.path.join(directory, "sqlite-untuned")
+        os.makedirs(cache_directory, exist_ok=True)
+
+        benchmark(
+            "sqlite (untuned)",
+            SQLiteCache(
+                os.path.join(cache_directory, "requests-cache"),
+                serializer=pickle_serializer,
+            ),
+            cache_directory,
+            responses,
+        )
+
+    for backend in args.backends:
+        for compress in (False, True):
+            # Each cache gets its own directory so we can measure its size
+            cache_directory = os.path.join(
+                directory, f"{backend}-zlib" if compress else backend
+            )
+            os.makedirs(cache_directory, exist_ok=True)
+
+            benchmark(
+                f"{backend} (zlib)" if compress else backend,
+                util.requests_cache_backend(
+                    os.path.join(cache_directory, "requests-cache"), backend, compress
+                ),
+                cache_directory,
+                responses,
+            )
+finally:
+    if not args.directory:
+        shutil.rmtree(directory)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-# check-duplicates.py 0.4.4
+# check-duplicates.py 0.6.0
 #
 # Copyright Alan Orth.
 #
@@ -15,6 +15,16 @@
 #
 #   localhost/database= > CREATE EXTENSION pg_trgm;
 #
+# By default each row in the CSV is checked with its own set of queries. With
+# the --batch option the whole CSV is copied into a temporary table and all of
+# the rows are checked against the database in a single set-based query, which
+# is much faster for large CSVs.
+#
+# With the --snapshot option the CSV is checked against a local snapshot of the
+# item metadata created with create_duplicates_snapshot.py instead, which does
+# not need access to the database (or the pg_trgm extension). Similarity is
+# calculated the same way as pg_trgm.
+#
 # This script is written for Python 3 and requires several modules that you can
 # install with pip (I recommend setting up a Python virtual environment first):
 #
@@ -28,6 +38,7 @@ import signal
 import sys
 from datetime import datetime
 
+import duplicates
 import util
 from colorama import Fore
 from psycopg import sql
@@ -61,6 +72,177 @@ def compare_date_strings(item_date, duplicate_date):
     return abs((date1 - date2).days)
 
 
+# Print a potential duplicate and write it to the output CSV
+def write_potential_duplicate(writer, output_row):
+    sys.stdout.write(f"{Fore.YELLOW}Found potential duplicate:{Fore.RESET}\n")
+    sys.stdout.write(
+        f"{Fore.YELLOW}→ Title:{Fore.RESET} {output_row['Your Title']} ({output_row['Similarity']})\n"
+    )
+    sys.stdout.write(f"{Fore.YELLOW}→ Handle:{Fore.RESET} {output_row['Handle']}\n\n")
+
+    writer.writerow(output_row)
+
+
+# Check all rows in the input CSV at once by copying them into a temporary table
+# and joining it against the item metadata in a single set-based query instead
+# of issuing several queries per row and per potential duplicate.
+def check_duplicates_batch(conn, reader, writer):
+    cursor = conn.cursor()
+
+    # The temporary table only lives until the end of the current transaction
+    cursor.execute(
+        "CREATE TEMPORARY TABLE check_duplicates_input (row_number integer, id text, title text, type text, issued text) ON COMMIT DROP"
+    )
+
+    with cursor.copy(
+        "COPY check_duplicates_input (row_number, id, title, type, issued) FROM STDIN"
+    ) as copy:
+        for row_number, input_row in enumerate(reader):
+            copy.write_row(
+                (
+                    row_number,
+                    input_row[id_column_name],
+                    input_row[criteria1_column_name],
+                    input_row[criteria2_column_name],
+                    input_row[criteria3_column_name],
+                )
+            )
+
+    # Make sure the planner has statistics for the temporary table, otherwise
+    # it might not choose the trigram index for the join.
+    cursor.execute("ANALYZE check_duplicates_input")
+
+    # Candidates are items in the archive with a similar title (using the sim-
+    # ilarity operator so the trigram index can be used) and an exact match on
+    # the type. The date issued falls back to date available, like we do for a
+    # single row. Items without a handle are skipped by the inner join.
+    sql = """
+        SELECT I.id, I.title, M.text_value, round(similarity(I.title, M.text_value)::numeric, 3),
+            I.type, T.text_value, I.issued, COALESCE(D.text_value, A.text_value), H.handle
+        FROM check_duplicates_input I
+        JOIN metadatavalue M ON M.metadata_field_id=%(title_field_id)s AND M.text_value %% I.title
+        JOIN item ON item.uuid = M.dspace_object_id AND item.in_archive AND NOT item.withdrawn
+        JOIN LATERAL (
+            SELECT text_value FROM metadatavalue
+            WHERE dspace_object_id=M.dspace_object_id AND metadata_field_id=%(type_field_id)s AND text_value=I.type
+            LIMIT 1
+        ) T ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT text_value FROM metadatavalue
+            WHERE dspace_object_id=M.dspace_object_id AND metadata_field_id=%(issued_field_id)s
+            LIMIT 1
+        ) D ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT text_value FROM metadatavalue
+            WHERE dspace_object_id=M.dspace_object_id AND metadata_field_id=%(available_field_id)s
+            LIMIT 1
+        ) A ON TRUE
+        JOIN LATERAL (
+            SELECT handle FROM handle WHERE resource_id=M.dspace_object_id LIMIT 1
+        ) H ON TRUE
+        ORDER BY I.row_number
+    """
+
+    # Use a server-side cursor so we can stream the results to the output CSV
+    # instead of loading them all into memory.
+    results_cursor = conn.cursor(name="check_duplicates_batch")
+    results_cursor.execute(
+        sql,
+        {
+            "title_field_id": criteria1_field_id,
+            "type_field_id": criteria2_field_id,
+            "issued_field_id": criteria3_field_id,
+            "available_field_id": util.field_name_to_field_id(
+                cursor, "dcterms.available"
+            ),
+        },
+    )
+
+    for result in results_cursor:
+        (
+            input_id,
+            input_title,
+            duplicate_title,
+            trgm_similarity,
+            input_type,
+            duplicate_type,
+            input_date,
+            duplicate_item_date,
+            handle,
+        ) = result
+
+        # If we don't have either a date issued or available, then we have
+        # bigger problems. Skip!
+        if duplicate_item_date is None:
+            continue
+
+        # Dates are compared here rather than in SQL because we need to handle
+        # the different date formats.
+        if compare_date_strings(input_date, duplicate_item_date) > args.days_threshold:
+            continue
+
+        output_row = {
+            "id": input_id,
+            "Your Title": input_title,
+            "Their Title": duplicate_title,
+            "Similarity": trgm_similarity,
+            "Your Type": input_type,
+            "Their Type": duplicate_type,
+            "Your Date": input_date,
+            "Their Date": duplicate_item_date,
+            "Handle": f"https://hdl.handle.net/{handle}",
+        }
+
+        write_potential_duplicate(writer, output_row)
+
+    results_cursor.close()
+
+
+# Check all rows in the input CSV against a local snapshot of the item metadata
+# using an in-memory trigram index instead of the database.
+def check_duplicates_snapshot(reader, writer):
+    records = duplicates.read_snapshot(args.snapshot)
+    index = duplicates.TrigramIndex(record["title"] for record in records)
+
+    for input_row in reader:
+        results = index.search(
+            input_row[criteria1_column_name], args.similarity_threshold
+        )
+
+        for position, trgm_similarity in results:
+            record = records[position]
+
+            # This means we didn't match on item type
+            if input_row[criteria2_column_name] not in record["types"]:
+                continue
+
+            # If we don't have either a date issued or available, then we
+            # have bigger problems. Skip!
+            if record["issued"] is None:
+                continue
+
+            days_difference = compare_date_strings(
+                input_row[criteria3_column_name], record["issued"]
+            )
+
+            if days_difference > args.days_threshold:
+                continue
+
+            output_row = {
+                "id": input_row[id_column_name],
+                "Your Title": input_row[criteria1_column_name],
+                "Their Title": record["title"],
+                "Similarity": round(trgm_similarity, 3),
+                "Your Type": input_row[criteria2_column_name],
+                "Their Type": input_row[criteria2_column_name],
+                "Your Date": input_row[criteria3_column_name],
+                "Their Date": record["issued"],
+                "Handle": f"https://hdl.handle.net/{record['handle']}",
+            }
+
+            write_potential_duplicate(writer, output_row)
+
+
 parser = argparse.ArgumentParser(description="Find duplicate titles.")
 parser.add_argument(
     "-i",
@@ -69,9 +251,9 @@ parser.add_argument(
     required=True,
     type=argparse.FileType("r", encoding="UTF-8"),
 )
-parser.add_argument("-db", "--database-name", help="Database name", required=True)
-parser.add_argument("-u", "--database-user", help="Database username", required=True)
-parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument("-db", "--database-name", help="Database name")
+parser.add_argument("-u", "--database-user", help="Database username")
+parser.add_argument("-p", "--database-pass", help="Database password")
 parser.add_argument(
     "-d",
     "--debug",
@@ -104,8 +286,28 @@ parser.add_argument(
     help="Similarity threshold, between 0.0 and 1.0 (default 0.7).",
     default=0.7,
 )
+# Batch mode is a way of querying the database, so it can't be used with a
+# snapshot
+mode_group = parser.add_mutually_exclusive_group()
+mode_group.add_argument(
+    "--batch",
+    help="Check all rows in a single set-based query (faster for large CSVs).",
+    action="store_true",
+)
+mode_group.add_argument(
+    "--snapshot",
+    help="Path to a snapshot created with create_duplicates_snapshot.py to check against instead of the database.",
+)
 args = parser.parse_args()
 
+# The database options are only optional when checking against a snapshot
+if not args.snapshot and not (
+    args.database_name and args.database_user and args.database_pass
+):
+    parser.error(
+        "the following arguments are required: -db/--database-name, -u/--database-user, -p/--database-pass"
+    )
+
 # Column names in the CSV
 id_column_name = "id"
 criteria1_column_name = "dc.title"
@@ -144,13 +346,44 @@ if criteria3_column_name not in reader.fieldnames:
 # set the signal handler for SIGINT (^C)
 signal.signal(signal.SIGINT, signal_handler)
 
+# Fields for the output CSV
+fieldnames = [
+    "id",
+    "Your Title",
+    "Their Title",
+    "Similarity",
+    "Your Type",
+    "Their Type",
+    "Your Date",
+    "Their Date",
+    "Handle",
+]
+
+# Write the CSV header
+writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
+writer.writeheader()
+
+# Check against a local snapshot instead of the database
+if args.snapshot:
+    check_duplicates_snapshot(reader, writer)
+
+    # close output file before we exit
+    args.output_file.close()
+
+    # close input file
+    args.input_file.close()
+
+    sys.exit(0)
+
 # connect to database
 conn = util.db_connect(
     args.database_name, args.database_user, args.database_pass, "localhost"
 )
 
-# set the connection to read only since we are not writing anything
-conn.read_only = True
+# set the connection to read only since we are not writing anything (batch mode
+# needs to write the input CSV to a temporary table)
+if not args.batch:
+    conn.read_only = True
 
 cursor = conn.cursor()
 
@@ -181,166 +414,143 @@ with conn:
         )
     )
 
-    # Fields for the output CSV
-    fieldnames = [
-        "id",
-        "Your Title",
-        "Their Title",
-        "Similarity",
-        "Your Type",
-        "Their Type",
-        "Your Date",
-        "Their Date",
-        "Handle",
-    ]
-
-    # Write the CSV header
-    writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for input_row in reader:
-        # Check for items with similarity to criteria one (title). Note that
-        # this is the fastest variation of this query: using the similarity
-        # operator (%, written below twice for escaping) instead of the sim-
-        # larity function, as indexes are bound to operators, not functions!
-        # Also, if I leave off the item query it takes twice as long!
-        sql = "SELECT text_value, dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value %% %s"
-
-        cursor.execute(
-            sql,
-            (
-                criteria1_field_id,
-                input_row[criteria1_column_name],
-            ),
-        )
-
-        # If we have any similarity in criteria one (title), then check type
-        if cursor.rowcount > 0:
-            duplicate_titles = cursor.fetchall()
-
-            # Iterate over duplicate titles to check their types
-            for duplicate_title in duplicate_titles:
-                dspace_object_id = duplicate_title[1]
-
-                # Check type of this duplicate title, also making sure that
-                # the item is in the archive and not withdrawn.
-                sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s AND M.text_value=%s AND I.in_archive='t' AND I.withdrawn='f'"
-
-                cursor.execute(
-                    sql,
-                    (
-                        dspace_object_id,
-                        criteria2_field_id,
-                        input_row[criteria2_column_name],
-                    ),
-                )
-
-                # This means we didn't match on item type, so let's skip to
-                # the next item title.
-                if cursor.rowcount == 0:
-                    continue
-
-                # Get the date of this potential duplicate. (If we are here
-                # then we already confirmed above that the item is both in
-                # the archive and not withdrawn, so we don't need to check
-                # that again).
-                sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s"
-
-                cursor.execute(
-                    sql,
-                    (dspace_object_id, criteria3_field_id),
-                )
-
-                # This means that we successfully extracted the date for the
-                # potential duplicate.
-                if cursor.rowcount > 0:
-                    duplicate_item_date = cursor.fetchone()[0]
-                # issue date is blank, let's try date available
-                elif cursor.rowcount == 0:
-                    date_available_field_id = util.field_name_to_field_id(
-                        cursor, "dcterms.available"
-                    )
-
-                    sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s"
-
-                    cursor.execute(
-                        sql,
-                        (dspace_object_id, date_available_field_id),
-                    )
-
-                    if cursor.rowcount > 0:
-                        duplicate_item_date = cursor.fetchone()[0]
-                # If we don't have either a date issued or available, then we
-                # have bigger problems. Skip!
-                else:
-                    continue
-
-                # Get the number of days between the issue dates
-                days_difference = compare_date_strings(
-                    input_row[criteria3_column_name], duplicate_item_date
-                )
-
-                # Items with a similar title, same type, and issue dates
-                # within a year or so are likely duplicates. Otherwise,
-                # it's possible that items with a similar name could be
-                # like Annual Reports where most metadata is the same
-                # except the date issued.
-                if days_difference <= args.days_threshold:
-                    # Get the item type of the potential duplicate
-                    sql = "SELECT text_value FROM metadatavalue WHERE dspace_object_id=%s AND metadata_field_id=%s"
+    if args.batch:
+        check_duplicates_batch(conn, reader, writer)
+    else:
+        for input_row in reader:
+            # Check for items with similarity to criteria one (title). Note that
+            # this is the fastest variation of this query: using the similarity
+            # operator (%, written below twice for escaping) instead of the sim-
+            # larity function, as indexes are bound to operators, not functions!
+            # Also, if I leave off the item query it takes twice as long!
+            sql = "SELECT text_value, dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value %% %s"
+
+            cursor.execute(
+                sql,
+                (
+                    criteria1_field_id,
+                    input_row[criteria1_column_name],
+                ),
+            )
+
+            # If we have any similarity in criteria one (title), then check type
+            if cursor.rowcount > 0:
+                duplicate_titles = cursor.fetchall()
+
+                # Iterate over duplicate titles to check their types
+                for duplicate_title in duplicate_titles:
+                    dspace_object_id = duplicate_title[1]
+
+                    # Check type of this duplicate title, also making sure that
+                    # the item is in the archive and not withdrawn.
+                    sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s AND M.text_value=%s AND I.in_archive='t' AND I.withdrawn='f'"
 
                     cursor.execute(
                         sql,
                         (
                             dspace_object_id,
                             criteria2_field_id,
+                            input_row[criteria2_column_name],
                         ),
                     )
 
-                    potential_duplicate_item_type = cursor.fetchone()[0]
-
-                    # By now we have items that are similar in title and
-                    # have an exact match for the type and an issue date
-                    # within the threshold. Now we are reasonably sure it's
-                    # a duplicate, so get the handle.
-                    sql = "SELECT handle FROM handle WHERE resource_id=%s"
-                    cursor.execute(sql, (dspace_object_id,))
-                    try:
-                        handle = f"https://hdl.handle.net/{cursor.fetchone()[0]}"
-                    except TypeError:
-                        # If we get here then there is no handle for this
-                        # item's UUID. Could be that the item was deleted?
+                    # This means we didn't match on item type, so let's skip to
+                    # the next item title.
+                    if cursor.rowcount == 0:
                         continue
 
-                    sys.stdout.write(
-                        f"{Fore.YELLOW}Found potential duplicate:{Fore.RESET}\n"
-                    )
+                    # Get the date of this potential duplicate. (If we are here
+                    # then we already confirmed above that the item is both in
+                    # the archive and not withdrawn, so we don't need to check
+                    # that again).
+                    sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s"
 
-                    # https://alexklibisz.com/2022/02/18/optimizing-postgres-trigram-search.html
-                    sql = "SELECT round(similarity(%s, %s)::numeric, 3)"
                     cursor.execute(
-                        sql, (input_row[criteria1_column_name], duplicate_title[0])
+                        sql,
+                        (dspace_object_id, criteria3_field_id),
                     )
-                    trgm_similarity = cursor.fetchone()[0]
 
-                    sys.stdout.write(
-                        f"{Fore.YELLOW}→ Title:{Fore.RESET} {input_row[criteria1_column_name]} ({trgm_similarity})\n"
+                    # This means that we successfully extracted the date for the
+                    # potential duplicate.
+                    if cursor.rowcount > 0:
+                        duplicate_item_date = cursor.fetchone()[0]
+                    # issue date is blank, let's try date available
+                    elif cursor.rowcount == 0:
+                        date_available_field_id = util.field_name_to_field_id(
+                            cursor, "dcterms.available"
+                        )
+
+                        sql = "SELECT text_value FROM metadatavalue M JOIN item I ON M.dspace_object_id = I.uuid WHERE M.dspace_object_id=%s AND M.metadata_field_id=%s"
+
+                        cursor.execute(
+                            sql,
+                            (dspace_object_id, date_available_field_id),
+                        )
+
+                        if cursor.rowcount > 0:
+                            duplicate_item_date = cursor.fetchone()[0]
+                    # If we don't have either a date issued or available, then we
+                    # have bigger problems. Skip!
+                    else:
+                        continue
+
+                    # Get the number of days between the issue dates
+                    days_difference = compare_date_strings(
+                        input_row[criteria3_column_name], duplicate_item_date
                     )
-                    sys.stdout.write(f"{Fore.YELLOW}→ Handle:{Fore.RESET} {handle}\n\n")
-
-                    output_row = {
-                        "id": input_row[id_column_name],
-                        "Your Title": input_row[criteria1_column_name],
-                        "Their Title": duplicate_title[0],
-                        "Similarity": trgm_similarity,
-                        "Your Type": input_row[criteria2_column_name],
-                        "Their Type": potential_duplicate_item_type,
-                        "Your Date": input_row[criteria3_column_name],
-                        "Their Date": duplicate_item_date,
-                        "Handle": handle,
-                    }
-
-                    writer.writerow(output_row)
+
+                    # Items with a similar title, same type, and issue dates
+                    # within a year or so are likely duplicates. Otherwise,
+                    # it's possible that items with a similar name could be
+                    # like Annual Reports where most metadata is the same
+                    # except the date issued.
+                    if days_difference <= args.days_threshold:
+                        # Get the item type of the potential duplicate
+                        sql = "SELECT text_value FROM metadatavalue WHERE dspace_object_id=%s AND metadata_field_id=%s"
+
+                        cursor.execute(
+                            sql,
+                            (
+                                dspace_object_id,
+                                criteria2_field_id,
+                            ),
+                        )
+
+                        potential_duplicate_item_type = cursor.fetchone()[0]
+
+                        # By now we have items that are similar in title and
+                        # have an exact match for the type and an issue date
+                        # within the threshold. Now we are reasonably sure it's
+                        # a duplicate, so get the handle.
+                        sql = "SELECT handle FROM handle WHERE resource_id=%s"
+                        cursor.execute(sql, (dspace_object_id,))
+                        try:
+                            handle = f"https://hdl.handle.net/{cursor.fetchone()[0]}"
+                        except TypeError:
+                            # If we get here then there is no handle for this
+                            # item's UUID. Could be that the item was deleted?
+                            continue
+
+                        # https://alexklibisz.com/2022/02/18/optimizing-postgres-trigram-search.html
+                        sql = "SELECT round(similarity(%s, %s)::numeric, 3)"
+                        cursor.execute(
+                            sql, (input_row[criteria1_column_name], duplicate_title[0])
+                        )
+                        trgm_similarity = cursor.fetchone()[0]
+
+                        output_row = {
+                            "id": input_row[id_column_name],
+                            "Your Title": input_row[criteria1_column_name],
+                            "Their Title": duplicate_title[0],
+                            "Similarity": trgm_similarity,
+                            "Your Type": input_row[criteria2_column_name],
+                            "Their Type": potential_duplicate_item_type,
+                            "Your Date": input_row[criteria3_column_name],
+                            "Their Date": duplicate_item_date,
+                            "Handle": handle,
+                        }
+
+                        write_potential_duplicate(writer, output_row)
 
     # close output file before we exit
     args.output_file.close()
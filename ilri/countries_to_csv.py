@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# countries-to-csv.py v0.0.3
+# countries-to-csv.py v0.2.0
 #
 # Copyright Alan Orth.
 #
@@ -17,44 +17,141 @@
 # DSpace input-forms.xml with xmllint:
 #
 #   $ xmllint --xpath '//value-pairs[@value-pairs-name="countrylist"]/pair/stored-value/node()' dspace/config/input-forms.xml > /tmp/cgspace-countries.txt
+#
+# Countries that don't match an ISO 3166 name exactly are looked up with a
+# fuzzy match (see iso3166_index.py), which also knows historic names from ISO
+# 3166-3 and common aliases like "Ivory Coast". The best candidates and their
+# scores are saved in the CSV, and the best one is used if its score is above
+# the threshold. We don't use pycountry's search_fuzzy() because it is slow and
+# gives strange results.
+#
+# See: https://github.com/flyingcircusio/pycountry/issues/115
 
+import argparse
 import csv
+import signal
 import sys
 
-import pycountry
-
-try:
-    # Quick handling of command line args, no time to implement argparse.
-    input_filename = sys.argv[1]
-    output_filename = sys.argv[2]
-except IndexError:
-    print("Please specify input and output files.")
-
-    exit(1)
-
-with open(input_filename, "r") as countries_in:
-    with open(output_filename, mode="w") as countries_out:
-        # Prepare the CSV
-        fieldnames = ["alpha2", "Name"]
-        csv_writer = csv.DictWriter(countries_out, fieldnames=fieldnames)
-        csv_writer.writeheader()
-
-        for line in countries_in.readlines():
-            print(f"Looking up {line.strip()}...")
-
-            country_result = pycountry.countries.get(name=line.strip())
-
-            # Check if we found an exact match first
-            if country_result is not None:
-                country_alpha2 = country_result.alpha_2
-                country_name = line.strip()
-            else:
-                # Can't find a match so just save the name with no alpha2. Note
-                # that we could try with a fuzzy search before giving up, but I
-                # have had some strange issues with fuzzy search in the past.
-                #
-                # See: https://github.com/flyingcircusio/pycountry/issues/115
-                country_alpha2 = ""
-                country_name = line.strip()
-
-            csv_writer.writerow({"alpha2": country_alpha2, "Name": country_name})
+from iso3166_index import Iso3166Index
+
+
+def signal_handler(signal, frame):
+    sys.exit(1)
+
+
+def resolve_country(country: str) -> dict:
+    """Look up a country, first exactly and then with a fuzzy match.
+
+    :param country: the country, for example "Congo, Dem. Rep.".
+    :returns dict with the CSV columns except Name
+    """
+
+    result = index.country(country)
+
+    # Check if we found an exact match first
+    if result is not None:
+        alpha2, match_type, country_name = result
+
+        return {
+            "alpha2": alpha2,
+            "matched name": country_name,
+            "match type": match_type,
+            "score": 1.0 if alpha2 else "",
+            "candidates": "",
+        }
+
+    results = index.search_country(country, args.candidates, args.min_score)
+
+    row = {
+        "alpha2": "",
+        "matched name": "",
+        "match type": "",
+        "score": results[0][3] if results else "",
+        "candidates": "||".join(
+            f"{alpha2} {country_name} ({score})"
+            for alpha2, country_name, match_type, score in results
+        ),
+    }
+
+    # Only use the best candidate if it is good enough and there is no other
+    # country with the same score
+    if (
+        results
+        and results[0][3] >= args.threshold
+        and (len(results) == 1 or results[1][3] < results[0][3])
+    ):
+        alpha2, country_name, match_type, score = results[0]
+
+        row["alpha2"] = alpha2
+        row["matched name"] = country_name
+        row["match type"] = "fuzzy" if score < 1 else match_type
+
+    return row
+
+
+parser = argparse.ArgumentParser(
+    description="Export a CSV with the ISO 3166-1 Alpha-2 codes of a list of countries."
+)
+parser.add_argument(
+    "input_file",
+    help="File containing countries to look up, one per line.",
+    type=argparse.FileType("r"),
+)
+parser.add_argument(
+    "output_file",
+    help="File to write results to (CSV).",
+    type=argparse.FileType("w"),
+)
+parser.add_argument(
+    "-c",
+    "--candidates",
+    help="Number of fuzzy match candidates to save (default 3).",
+    type=int,
+    default=3,
+)
+parser.add_argument(
+    "-m",
+    "--min-score",
+    help="Lowest score for fuzzy match candidates, from 0 to 1 (default 0.6).",
+    type=float,
+    default=0.6,
+)
+parser.add_argument(
+    "-t",
+    "--threshold",
+    help="Score the best fuzzy match candidate needs to be used, from 0 to 1 (default 0.85).",
+    type=float,
+    default=0.85,
+)
+args = parser.parse_args()
+
+# set the signal handler for SIGINT (^C) so we can exit cleanly
+signal.signal(signal.SIGINT, signal_handler)
+
+# index of country names from ISO 3166-1 and ISO 3166-3
+index = Iso3166Index()
+
+# Prepare the CSV
+fieldnames = ["alpha2", "Name", "matched name", "match type", "score", "candidates"]
+csv_writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
+csv_writer.writeheader()
+
+# Partner submissions repeat the same countries a lot, so only look each one up
+# once
+results = {}
+
+for line in args.input_file:
+    country = line.strip()
+
+    if not country:
+        continue
+
+    if country not in results:
+        print(f"Looking up {country}...")
+
+        results[country] = resolve_country(country)
+
+    csv_writer.writerow({"Name": country, **results[country]})
+
+args.input_file.close()
+args.output_file.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# create-duplicates-snapshot.py 0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Export the titles, types, issue dates, and handles of all items in the archive
+# from the DSpace PostgreSQL database to a compressed snapshot file that can be
+# used with the --snapshot option of check_duplicates.py. This allows checking
+# for duplicates on a machine without access to the database, and the snapshot
+# can be reused for many runs.
+#
+# This script is written for Python 3 and requires several modules that you can
+# install with pip (I recommend setting up a Python virtual environment first):
+#
+#   $ pip install psycopg colorama
+#
+# See: https://www.psycopg.org/psycopg3/docs
+
+import argparse
+import signal
+import sys
+
+import duplicates
+import util
+from colorama import Fore
+
+
+def signal_handler(signal, frame):
+    sys.exit(1)
+
+
+parser = argparse.ArgumentParser(
+    description="Export item metadata to a snapshot for offline duplicate checking."
+)
+parser.add_argument("-db", "--database-name", help="Database name", required=True)
+parser.add_argument("-u", "--database-user", help="Database username", required=True)
+parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "-o",
+    "--output-file",
+    help="Path to output snapshot file (gzipped CSV).",
+    required=True,
+)
+parser.add_argument(
+    "-q",
+    "--quiet",
+    help="Do not print progress messages to the screen.",
+    action="store_true",
+)
+args = parser.parse_args()
+
+# set the signal handler for SIGINT (^C)
+signal.signal(signal.SIGINT, signal_handler)
+
+# connect to database
+conn = util.db_connect(
+    args.database_name, args.database_user, args.database_pass, "localhost"
+)
+
+# set the connection to read only since we are not writing anything
+conn.read_only = True
+
+cursor = conn.cursor()
+
+# Field IDs from the metadatafieldregistry table
+field_ids = {
+    "title": util.field_name_to_field_id(cursor, "dc.title"),
+    "type": util.field_name_to_field_id(cursor, "dcterms.type"),
+    "issued": util.field_name_to_field_id(cursor, "dcterms.issued"),
+    "available": util.field_name_to_field_id(cursor, "dcterms.available"),
+}
+
+# Use a server-side cursor so we don't hold all items in memory
+with conn.cursor(name="duplicates_snapshot") as snapshot_cursor:
+    rows = duplicates.write_snapshot(snapshot_cursor, args.output_file, field_ids)
+
+if not args.quiet:
+    sys.stdout.write(
+        f"{Fore.GREEN}Wrote {rows} titles to {args.output_file}.{Fore.RESET}\n"
+    )
+
+# close database connection before we exit
+conn.close()
+
+sys.exit(0)
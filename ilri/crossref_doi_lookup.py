@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# crossref-doi-lookup.py 0.2.2
+# crossref-doi-lookup.py 0.5.1
 #
 # Copyright Alan Orth.
 #
@@ -13,6 +13,18 @@
 # issue date, license, journal title, item type, authors, funders, etc. This
 # information can be used to improve metadata in other systems.
 #
+# Several DOIs are looked up at the same time (see --concurrency) while keeping
+# to the rate limit that Crossref sends in its response headers. Results are
+# written in the same order as the input file.
+#
+# The registration agency of each DOI prefix is remembered in a small JSON file
+# (see --agency-cache), so we only ask Crossref about the first DOI with each
+# prefix and skip DataCite DOIs, etc without any requests at all.
+#
+# For large jobs you can use a local copy of Crossref's metadata, for example
+# the public data file, with --snapshot. DOIs that are not in the snapshot are
+# looked up in the API as usual.
+#
 # This script is written for Python 3.6+ and requires several modules that you
 # can install with pip (I recommend using a Python virtual environment):
 #
@@ -21,13 +33,16 @@
 
 import argparse
 import csv
+import json
 import logging
+import os
 import signal
 import sys
-from datetime import timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import crossref_snapshot
 import requests
-import requests_cache
 import util
 from colorama import Fore
 
@@ -67,292 +82,365 @@ def fix_crossref_date(crossref_date: list) -> str:
     return issued
 
 
-def resolve_doi(doi: str) -> None:
-    logger.info(Fore.GREEN + f"Looking up DOI: {doi}" + Fore.RESET)
+# Naive construction of "Last, First Initials" for each author, or whatever
+# parts of the name we have.
+def crossref_authors(authors: list) -> str:
+    names = list()
 
-    # First, check if this DOI is registered at Crossref
-    request_url = f"https://api.crossref.org/works/{doi}/agency"
-    request_params = {"mailto": args.email}
+    for author in authors:
+        # Crossref given name is often initials like "S. M." and we don't
+        # want that space!
+        given_name = author.get("given", "").replace(". ", ".")
+        family_name = author.get("family", "")
 
-    try:
-        request = requests.get(request_url, params=request_params)
-    except requests.exceptions.ConnectionError:
-        logger.error(Fore.RED + "Connection error." + Fore.RESET)
+        if family_name and given_name:
+            names.append(f"{family_name}, {given_name}")
+        elif family_name or given_name:
+            names.append(family_name or given_name)
 
-        sys.exit(1)
+    return "||".join(names)
 
-    # HTTP 404 here means the DOI is not registered at Crossref
-    if not request.ok:
-        logger.debug(
-            Fore.YELLOW
-            + f"> DOI not in Crossref (cached: {request.from_cache})"
-            + Fore.RESET
-        )
 
-        return
+# Affiliations of all the authors (not all have)
+def crossref_affiliations(authors: list) -> str:
+    affiliations = list()
 
-    data = request.json()
+    for author in authors:
+        for affiliation in author.get("affiliation", []):
+            if affiliation.get("name") and affiliation["name"] not in affiliations:
+                affiliations.append(affiliation["name"])
 
-    # Only proceed if this DOI registration agency is Crossref
-    match data["message"]["agency"]["label"]:
-        case "DataCite":
-            logger.debug(
-                Fore.YELLOW
-                + f"> Skipping DOI registered to DataCite (cached: {request.from_cache})"
-                + Fore.RESET
-            )
+    return "||".join(affiliations)
 
-            return
-        case "Public":
-            logger.debug(
-                Fore.YELLOW
-                + f'> Skipping DOI registered to "Public" (cached: {request.from_cache})'
-                + Fore.RESET
-            )
 
-            return
-        case "Crossref":
-            pass
+def crossref_funders(funders: list) -> str:
+    return "||".join(dict.fromkeys(funder["name"] for funder in funders))
 
-    # Fetch the metadata for this DOI
-    request_url = f"https://api.crossref.org/works/{doi}"
-    request_params = {"mailto": args.email}
 
-    try:
-        request = requests.get(request_url, params=request_params)
-    except requests.exceptions.ConnectionError:
-        logger.error(Fore.RED + "Connection error." + Fore.RESET)
+# Not all items have licenses, and some have multiple licenses. We will check
+# for licenses in the order we prefer them: am, vor, tdm, and unspecified. These
+# correspond to: accepted manuscript, version of record, text and data mining,
+# and unspecified. I'm curious if there is *ever* a case where we would want the
+# tdm license...? Can these ever be CC if the others are missing?
+def crossref_license(licenses: list) -> str:
+    doi_licenses = {
+        doi_license["content-version"]: doi_license["URL"] for doi_license in licenses
+    }
 
-    if not request.ok:
-        return
+    for content_version in ["am", "vor", "tdm", "unspecified"]:
+        if content_version in doi_licenses:
+            return f"{content_version}: {doi_licenses[content_version]}"
 
-    logger.debug(
-        Fore.YELLOW + f"> DOI in Crossref (cached: {request.from_cache})" + Fore.RESET
-    )
+    return ""
 
-    data = request.json()
 
-    # I don't know why title is an array of strings, but let's just get
-    # the first one.
-    try:
-        title = data["message"]["title"][0]
-    except IndexError:
-        title = ""
+def join_values(values: list) -> str:
+    return "||".join(values)
 
-    # Create an empty list to keep our authors
-    authors = list()
-    affiliations = list()
 
-    try:
-        for author in data["message"]["author"]:
-            # Some authors have no given name in Crossref
-            try:
-                # Crossref given name is often initials like "S. M."
-                # and we don't want that space!
-                author_given_name = author["given"].replace(". ", ".")
-            except KeyError:
-                author_given_name = None
-
-            # Some authors have no family name in Crossref
-            try:
-                author_family_name = author["family"]
-            except KeyError:
-                author_family_name = None
-
-            # Naive construction of "Last, First Initials" when we have
-            # both of them.
-            if author_family_name and author_given_name:
-                authors.append(f"{author_family_name}, {author_given_name}")
-            # Otherwise we need to make do with only the family name
-            elif author_family_name and author_given_name is None:
-                authors.append(author_family_name)
-            # And sometimes we need to make do with only the given name
-            elif author_given_name and author_family_name is None:
-                authors.append(author_given_name)
-
-            # Get any affiliations from the authors (not all have)
-            try:
-                for affiliation in author["affiliation"]:
-                    if affiliation["name"] not in affiliations:
-                        affiliations.append(affiliation["name"])
-            # Not sure what we can except here
-            except:
-                pass
-
-    # Believe it or not some items on Crossref have no author (doesn't
-    # mean the DOI itself won't, though).
+# Columns of the output CSV and where to find them in a Crossref work: the path
+# of keys and indexes to the value, and a function to turn the value into what
+# we want in the CSV. Columns are empty if the path doesn't exist in the work.
+#
+# See: https://github.com/CrossRef/rest-api-doc/blob/master/api_format.md
+crossref_fields = {
+    # I don't know why title is an array of strings, but let's just get the
+    # first one.
+    "title": (["title", 0], str),
+    "abstract": (["abstract"], str),
+    "language": (["language"], str),
+    # Believe it or not some items on Crossref have no author (doesn't mean
+    # the DOI itself won't, though).
     #
     # See: https://api.crossref.org/works/10.1638/2018-0110
-    # See: https://doi.org/10.1638/2018-0110
-    except KeyError:
-        authors = ""
+    "authors": (["author"], crossref_authors),
+    "affiliations": (["author"], crossref_affiliations),
+    "funders": (["funder"], crossref_funders),
+    "doi": (["DOI"], lambda doi: f"https://doi.org/{doi}"),
+    "journal": (["container-title", 0], str),
+    # For journal articles there is often a print ISSN and an electronic ISSN,
+    # and for books and book chapters there is often a print ISBN and an
+    # electronic ISBN.
+    "issn": (["ISSN"], join_values),
+    "isbn": (["ISBN"], join_values),
+    "publisher": (["publisher"], str),
+    "volume": (["volume"], str),
+    "issue": (["issue"], str),
+    "page": (["page"], str),
+    "type": (["type"], str),
+    # It appears that *all* DOIs on Crossref have an "issued" date. This is the
+    # earliest of the print and online publishing dates.
+    "issued": (["issued", "date-parts", 0], fix_crossref_date),
+    # Date on which the work was published in print. Note that there is also a
+    # similar date in ["journal-issue"]["published-print"], but in my experience
+    # it is the same as this one 99% of the time when it is present (that's in
+    # 10,000 DOIs I checked in 2023-02).
+    "published_print": (["published-print", "date-parts", 0], fix_crossref_date),
+    # Date on which the work was published online. Note again that there is
+    # also ["journal-issue"]["published-online"], but in my experience it is
+    # only present ~33% of the time, and is only 50% the same as this one.
+    "published_online": (["published-online", "date-parts", 0], fix_crossref_date),
+    "license": (["license"], crossref_license),
+    # Still not sure if these are useful. We should check against AGROVOC
+    # before importing.
+    "subjects": (["subject"], join_values),
+}
+
+# Top-level fields of the works we need, to request with select. Note that
+# Crossref doesn't allow selecting language.
+crossref_select = sorted(
+    {path[0] for path, transform in crossref_fields.values()} - {"language"}
+)
 
-    # Create an empty list to keep our funders
-    funders = list()
 
-    try:
-        for funder in data["message"]["funder"]:
-            if funder["name"] not in funders:
-                funders.append(funder["name"])
-    except KeyError:
-        pass
+def extract_crossref_fields(work: dict) -> dict:
+    """Extract the columns of the output CSV from a Crossref work.
 
-    # Get the abstract if it exists
-    try:
-        abstract = data["message"]["abstract"]
-    except KeyError:
-        abstract = ""
+    :param work: the message of a Crossref /works response.
+    :returns dict of column → value
+    """
 
-    # Get the language if it exists
-    try:
-        language = data["message"]["language"]
-    except KeyError:
-        language = ""
+    row = dict()
 
-    try:
-        journal = data["message"]["container-title"][0]
-    except IndexError:
-        journal = ""
+    for field, (path, transform) in crossref_fields.items():
+        value = work
 
-    # Create an empty list to hold ISSNs, as there could be more than one
-    issns = list()
+        try:
+            for key in path:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            row[field] = ""
 
-    # Get the ISSN. For journal articles there is often a print ISSN and
-    # an electric ISSN.
-    try:
-        for issn in data["message"]["ISSN"]:
-            issns.append(issn)
-    except KeyError:
-        issns = ""
+            continue
 
-    # Create an empty list to hold ISBNs, as there could be more than one
-    isbns = list()
+        # Some records are incomplete, for example a funder without a name or
+        # a license without a URL, so leave the column empty rather than give
+        # up on the whole DOI
+        try:
+            row[field] = transform(value)
+        except (KeyError, IndexError, TypeError):
+            row[field] = ""
 
-    # Get the ISBN. For books and book chapters there is often a print
-    # ISBN and an electric ISBN.
-    try:
-        for isbn in data["message"]["isbn-type"]:
-            isbns.append(isbn["value"])
-    except KeyError:
-        isbns = ""
+    return row
 
-    try:
-        publisher = data["message"]["publisher"]
-    except KeyError:
-        publisher = ""
 
-    try:
-        volume = data["message"]["volume"]
-    except KeyError:
-        volume = ""
+class AgencyCache:
+    """Registration agencies of DOI prefixes, saved to disk.
 
-    try:
-        issue = data["message"]["issue"]
-    except KeyError:
-        issue = ""
+    The registration agency of a DOI is determined by its prefix, for example
+    all DOIs starting with 10.5281 are registered at DataCite. Once we know the
+    agency of one DOI we know it for all the DOIs with the same prefix, so we
+    don't need to ask Crossref about every DOI.
+    """
 
-    try:
-        page = data["message"]["page"]
-    except KeyError:
-        page = ""
+    def __init__(self, filename: str):
+        """Load the agencies we already know about, if any.
 
-    try:
-        item_type = data["message"]["type"]
-    except KeyError:
-        item_type = ""
+        :param filename: path to the JSON file with the agencies.
+        """
 
-    subjects = list()
+        self.filename = filename
+        self.lock = threading.Lock()
+        # DOI prefix → agency label, for example "10.5281" → "DataCite"
+        self.agencies = {}
+        self.changed = False
+
+        try:
+            with open(self.filename, "r") as f:
+                self.agencies = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def prefix(doi: str) -> str:
+        """Return the prefix of a DOI, for example "10.5281".
+
+        :param doi: the DOI, for example "10.5281/zenodo.1234".
+        :returns str
+        """
+
+        return doi.split("/", 1)[0].lower()
+
+    def get(self, doi: str) -> str | None:
+        """Return the registration agency of a DOI's prefix, if we know it.
+
+        :param doi: the DOI.
+        :returns str or None
+        """
+
+        with self.lock:
+            return self.agencies.get(self.prefix(doi))
+
+    def set(self, doi: str, agency: str):
+        """Remember the registration agency of a DOI's prefix.
+
+        :param doi: the DOI.
+        :param agency: the agency label, for example "Crossref".
+        """
+
+        with self.lock:
+            if self.agencies.get(self.prefix(doi)) != agency:
+                self.agencies[self.prefix(doi)] = agency
+                self.changed = True
+
+    def save(self):
+        """Save the agencies to disk if we learned any new ones."""
+
+        with self.lock:
+            if not self.changed:
+                return
+
+            # Write to a temporary file first so the cache is never left half
+            # written if we are interrupted.
+            with open(f"{self.filename}.tmp", "w") as f:
+                json.dump(self.agencies, f, indent=2, sort_keys=True)
+
+            os.replace(f"{self.filename}.tmp", self.filename)
+
+            self.changed = False
+
+
+def crossref_get(request_url: str, request_params: dict = None):
+    """Get a URL from the Crossref API.
+
+    :param request_url: the URL to get.
+    :param request_params: query parameters to add to the URL, if any.
+    :returns requests.Response, or None if Crossref was still busy or we could
+    not connect after all the retries.
+    """
 
-    # Get the subjects. Still not sure if these are useful. We should
-    # check against AGROVOC before importing.
-    try:
-        for subject in data["message"]["subject"]:
-            subjects.append(subject)
-    except KeyError:
-        subjects = ""
-
-    # It appears that *all* DOIs on Crossref have an "issued" date. This
-    # is the earliest of the print and online publishing dates. For now
-    # I will capture this so I can explore its implications and relation
-    # to other dates with real items in the repository.
-    #
-    # See: https://github.com/CrossRef/rest-api-doc/blob/master/api_format.md
-    issued = fix_crossref_date(data["message"]["issued"]["date-parts"][0])
-
-    # Date on which the work was published in print. Apparently not all
-    # DOIs have this so we need to try/except. Also note that there is
-    # a similar date in ["journal-issue"]["published-print"], but in my
-    # experience it is the same as this one 99% of the time when it is
-    # present (that's in 10,000 DOIs I checked in 2023-02).
     try:
-        published_print = fix_crossref_date(
-            data["message"]["published-print"]["date-parts"][0]
+        request = http.get(request_url, request_params)
+    except requests.exceptions.ConnectionError:
+        logger.error(
+            Fore.RED
+            + f"Giving up on {request_url} after {args.retries + 1} attempts: connection error."
+            + Fore.RESET
         )
-    except KeyError:
-        published_print = ""
-
-    # Date on which the work was published online. Note again that there
-    # is also ["journal-issue"]["published-online"], but in my experience
-    # it is only present ~33% of the time, and is only 50% the same as
-    # published-online. For now I'm not sure what to make of that, so I
-    # will not use it.
-    try:
-        published_online = fix_crossref_date(
-            data["message"]["published-online"]["date-parts"][0]
+
+        return None
+
+    if request.status_code == 429 or request.status_code >= 500:
+        logger.error(
+            Fore.RED
+            + f"Giving up on {request_url} after {args.retries + 1} attempts: HTTP {request.status_code}."
+            + Fore.RESET
         )
-    except KeyError:
-        published_online = ""
-
-    # Not all items have licenses, and some have multiple licenses. We
-    # will check for licenses in the order we prefer them: am, vor, tdm,
-    # and unspecified. These correspond to: accepted manuscript, version
-    # of record, text and data mining, and unspecified. I'm curious if
-    # there is *ever* a case where we would want the tdm license...? Can
-    # these ever be CC if the others are missing?
-    doi_licenses = {}
-    try:
-        for doi_license in data["message"]["license"]:
-            content_version = doi_license["content-version"]
-            doi_licenses[content_version] = doi_license["URL"]
-
-        if "am" in doi_licenses:
-            license_url = f'am: {doi_licenses["am"]}'
-        elif "vor" in doi_licenses:
-            license_url = f'vor: {doi_licenses["vor"]}'
-        elif "tdm" in doi_licenses:
-            license_url = f'tdm: {doi_licenses["tdm"]}'
-        else:
-            license_url = f'unspecified: {doi_licenses["unspecified"]}'
-    except KeyError:
-        license_url = ""
-
-    writer.writerow(
-        {
-            "title": title,
-            "abstract": abstract,
-            "language": language,
-            "authors": "||".join(authors),
-            "affiliations": "||".join(affiliations),
-            "funders": "||".join(funders),
-            "doi": f"https://doi.org/{doi}",
-            "journal": journal,
-            "issn": "||".join(issns),
-            "isbn": "||".join(isbns),
-            "publisher": publisher,
-            "volume": volume,
-            "issue": issue,
-            "page": page,
-            "type": item_type,
-            "issued": issued,
-            "published_print": published_print,
-            "published_online": published_online,
-            "license": license_url,
-            "subjects": "||".join(subjects),
-        }
+
+        return None
+
+    return request
+
+
+def resolve_doi(doi: str) -> dict | None:
+    logger.info(Fore.GREEN + f"Looking up DOI: {doi}" + Fore.RESET)
+
+    # Works in the local snapshot don't need any requests at all
+    work = snapshot_works.get(doi)
+
+    if work is not None:
+        logger.debug(Fore.YELLOW + "> DOI in Crossref snapshot" + Fore.RESET)
+    else:
+        work = fetch_crossref_work(doi)
+
+    if work is None:
+        return None
+
+    row = extract_crossref_fields(work)
+
+    # Use the DOI the way we were given it rather than the way Crossref has it
+    row["doi"] = f"https://doi.org/{doi}"
+
+    return row
+
+
+def fetch_crossref_work(doi: str) -> dict | None:
+    # First, check if this DOI is registered at Crossref. We only need to ask
+    # Crossref if we haven't seen a DOI with the same prefix before.
+    agency = agencies.get(doi)
+
+    if agency is None:
+        request = crossref_get(f"https://api.crossref.org/works/{doi}/agency")
+        if request is None:
+            return None
+
+        # HTTP 404 here means the DOI is not registered at Crossref
+        if not request.ok:
+            logger.debug(
+                Fore.YELLOW
+                + f"> DOI not in Crossref (cached: {request.from_cache})"
+                + Fore.RESET
+            )
+
+            return None
+
+        data = request.json()
+
+        agency = data["message"]["agency"]["label"]
+        agencies.set(doi, agency)
+
+        cached = request.from_cache
+    else:
+        cached = "prefix"
+
+    # Only proceed if this DOI registration agency is Crossref
+    match agency:
+        case "DataCite":
+            logger.debug(
+                Fore.YELLOW
+                + f"> Skipping DOI registered to DataCite (cached: {cached})"
+                + Fore.RESET
+            )
+
+            return None
+        case "Public":
+            logger.debug(
+                Fore.YELLOW
+                + f'> Skipping DOI registered to "Public" (cached: {cached})'
+                + Fore.RESET
+            )
+
+            return None
+        case "Crossref":
+            pass
+
+    # Fetch the metadata for this DOI. Crossref only supports select on the
+    # /works route, so we need to use a filter to get a single DOI.
+    if args.select:
+        request = crossref_get(
+            "https://api.crossref.org/works",
+            {"filter": f"doi:{doi}", "select": ",".join(crossref_select)},
+        )
+    else:
+        request = crossref_get(f"https://api.crossref.org/works/{doi}")
+
+    if request is None or not request.ok:
+        return None
+
+    data = request.json()
+
+    if args.select:
+        try:
+            work = data["message"]["items"][0]
+        except IndexError:
+            return None
+    else:
+        work = data["message"]
+
+    logger.debug(
+        Fore.YELLOW + f"> DOI in Crossref (cached: {request.from_cache})" + Fore.RESET
     )
 
+    return work
+
 
 def signal_handler(signal, frame):
+    # Don't start looking up any more DOIs
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    # Keep the agencies we've learned so far
+    agencies.save()
+
     # close output file before we exit
     args.output_file.close()
 
@@ -388,6 +476,40 @@ parser.add_argument(
     required=True,
     type=argparse.FileType("w", encoding="UTF-8"),
 )
+parser.add_argument(
+    "-c",
+    "--concurrency",
+    help="Number of DOIs to look up at the same time (default 5).",
+    type=int,
+    default=5,
+)
+parser.add_argument(
+    "-r",
+    "--retries",
+    help="Number of times to retry a request if Crossref is busy (default 5).",
+    type=int,
+    default=5,
+)
+parser.add_argument(
+    "--agency-cache",
+    help="Path to file with the registration agencies of DOI prefixes (default doi-agencies.json).",
+    default="doi-agencies.json",
+)
+parser.add_argument(
+    "-s",
+    "--select",
+    help="Only request the fields we need from Crossref. Much smaller responses, but language is not available.",
+    action="store_true",
+)
+parser.add_argument(
+    "--snapshot",
+    help="Path to a directory with a Crossref snapshot (gzipped JSON lines) to use before the API.",
+)
+parser.add_argument(
+    "--snapshot-index",
+    help="Path to the index of the Crossref snapshot (default crossref-snapshot-index.sqlite).",
+    default="crossref-snapshot-index.sqlite",
+)
 args = parser.parse_args()
 
 # The default log level is WARNING, but we want to set it to DEBUG or INFO
@@ -403,46 +525,58 @@ logging.basicConfig(format="[%(levelname)s] %(message)s")
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
-# install a transparent requests cache
-expire_after = timedelta(days=30)
-requests_cache.install_cache(
-    "requests-cache", expire_after=expire_after, allowable_codes=(200, 404)
+# Shared HTTP client with enough connections for all threads. Crossref tells us
+# its rate limit in the response headers, but start with something sensible.
+http = util.HttpClient(
+    mailto=args.email, concurrency=args.concurrency, retries=args.retries
 )
-# prune old cache entries
-requests_cache.delete()
+http.limit_host("api.crossref.org", rate=50)
+
+if args.snapshot:
+    # Index any snapshot files we haven't seen before. This takes a long time
+    # the first time!
+    snapshot = crossref_snapshot.CrossrefSnapshot(
+        args.snapshot,
+        args.snapshot_index,
+        progress=lambda filename: logger.info(
+            Fore.GREEN + f"Indexing snapshot file: {filename}" + Fore.RESET
+        ),
+    )
+else:
+    snapshot = None
+
+agencies = AgencyCache(args.agency_cache)
+executor = ThreadPoolExecutor(max_workers=args.concurrency)
 
 # Write the CSV header before starting
 if args.output_file:
-    fieldnames = [
-        "title",
-        "abstract",
-        "language",
-        "authors",
-        "affiliations",
-        "funders",
-        "doi",
-        "journal",
-        "issn",
-        "isbn",
-        "publisher",
-        "volume",
-        "issue",
-        "page",
-        "type",
-        "issued",
-        "published_print",
-        "published_online",
-        "license",
-        "subjects",
-    ]
+    fieldnames = list(crossref_fields)
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
 # if the user specified an input file, get the DOIs from there
 if args.input_file:
     dois = util.read_dois_from_file(args.input_file)
-    for doi in dois:
-        resolve_doi(doi)
+
+    # Read the works in the snapshot for all the DOIs at once, which is much
+    # faster than reading them one at a time
+    if snapshot is not None:
+        snapshot_works = snapshot.get_many(dois)
+    else:
+        snapshot_works = {}
+
+    # Look up several DOIs at a time, but write the results in the same order
+    # as the input file.
+    for row in executor.map(resolve_doi, dois):
+        if row is not None:
+            writer.writerow(row)
+
+executor.shutdown()
+
+agencies.save()
+
+if snapshot is not None:
+    snapshot.close()
 
 # close output file before we exit
 args.output_file.close()
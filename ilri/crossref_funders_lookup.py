@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# crossref-funders-lookup.py 0.3.1
+# crossref-funders-lookup.py 0.5.0
 #
 # Copyright Alan Orth.
 #
@@ -11,6 +11,9 @@
 # Queries the public Crossref API for funders read from a text file. Text file
 # should have one subject per line.
 #
+# Funders are matched by validation.CrossrefFundersBackend, which is shared with
+# validate_metadata.py.
+#
 # This script is written for Python 3.6+ and requires several modules that you
 # can install with pip (I recommend using a Python virtual environment):
 #
@@ -21,24 +24,27 @@ import argparse
 import csv
 import signal
 import sys
-from datetime import timedelta
 
 import requests
-import requests_cache
+import util
+import validation
 from colorama import Fore
 
 
 # read funders from a text file, one per line
 def read_funders_from_file():
-    # initialize an empty list for funders
+    # initialize an empty list for funders, and a set so we can check if we
+    # have already seen one without searching the list
     funders = []
+    seen = set()
 
     for line in args.input_file:
         # trim any leading or trailing whitespace (including newlines)
         line = line.strip()
 
         # iterate over results and add subjects that aren't already present
-        if line not in funders:
+        if line not in seen:
+            seen.add(line)
             funders.append(line)
 
     # close input file before we exit
@@ -52,93 +58,46 @@ def resolve_funders(funders):
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
-    # enable transparent request cache with two weeks expiry because I don't
-    # know how often Crossref is updated.
-    expire_after = timedelta(days=14)
-    requests_cache.install_cache("requests-cache", expire_after=expire_after)
-
-    # prune old cache entries
-    requests_cache.delete()
-
     for funder in funders:
         if args.debug:
             sys.stderr.write(Fore.GREEN + f"Looking up funder: {funder}\n" + Fore.RESET)
 
-        request_url = "https://api.crossref.org/funders"
-        request_params = {"query": funder}
-
-        if args.email:
-            request_params.update(mailto=args.email)
-
         try:
-            request = requests.get(request_url, params=request_params)
-        except requests.exceptions.ConnectionError:
-            sys.stderr.write(Fore.RED + "Connection error.\n" + Fore.RESET)
-
-        if request.status_code == requests.codes.ok:
-            data = request.json()
-
-            # assume no matches yet
-            matched = False
-
-            # check if there are any results
-            if data["message"]["total-results"] > 0:
-                # iterate over each search result (item)
-                for item in data["message"]["items"]:
-                    if item["name"].lower() == funder.lower() and not matched:
-                        matched = True
-
-                        print(
-                            f"Exact match for {funder} in Crossref (cached: {request.from_cache})"
-                        )
-
-                        writer.writerow(
-                            {
-                                "funder": funder,
-                                "match type": "name",
-                                "matched": "true",
-                            }
-                        )
-
-                        # break out of the items loop because we have a match
-                        break
-
-                    # check the alt-names for each search result
-                    for altname in item["alt-names"]:
-                        if altname.lower() == funder.lower() and not matched:
-                            matched = True
-
-                            print(
-                                f"Alt-name match for {funder} in Crossref (cached: {request.from_cache})"
-                            )
-
-                            writer.writerow(
-                                {
-                                    "funder": funder,
-                                    "match type": "alt-name",
-                                    "matched": "true",
-                                }
-                            )
-
-                            # break out of the alt-name loop because we have a match
-                            break
-
-            if data["message"]["total-results"] == 0 or not matched:
-                if args.debug:
-                    sys.stderr.write(
-                        Fore.YELLOW
-                        + f"No match for {funder} in Crossref (cached: {request.from_cache})\n"
-                        + Fore.RESET
-                    )
-
-                writer.writerow(
-                    {
-                        "funder": funder,
-                        "match type": "",
-                        "matched": "false",
-                    }
+            match = backend.lookup(funder)
+        except requests.exceptions.RequestException as e:
+            sys.stderr.write(f"{Fore.RED}Lookup failed: {e}{Fore.RESET}\n")
+
+            sys.exit(1)
+
+        if match is not None:
+            match_type, funder_id = match
+
+            if match_type == "name":
+                print(f"Exact match for {funder} in Crossref")
+            else:
+                print(f"Alt-name match for {funder} in Crossref")
+
+            writer.writerow(
+                {
+                    "funder": funder,
+                    "match type": match_type,
+                    "matched": "true",
+                }
+            )
+        else:
+            if args.debug:
+                sys.stderr.write(
+                    Fore.YELLOW + f"No match for {funder} in Crossref\n" + Fore.RESET
                 )
 
+            writer.writerow(
+                {
+                    "funder": funder,
+                    "match type": "",
+                    "matched": "false",
+                }
+            )
+
     # close output file before we exit
     args.output_file.close()
 
@@ -183,6 +142,11 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
+# Shared HTTP client so we reuse connections between requests
+http = util.HttpClient(mailto=args.email)
+
+backend = validation.CrossrefFundersBackend(http)
+
 # if the user specified an input file, get the funders from there
 if args.input_file:
     read_funders_from_file()
@@ -0,0 +1,214 @@
+# crossref_snapshot.py v0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper class for looking up DOIs in a local copy of Crossref's metadata, for
+# example the public data file, instead of the Crossref REST API. The snapshot
+# is a directory of gzipped JSON lines files with one work per line, in the same
+# format as the message of a /works/{doi} response.
+#
+# The first time a snapshot is used we read all the files and build an index of
+# DOIs and where to find them in the files in an SQLite database. After that,
+# only files that are new or have changed are indexed.
+#
+# Seeking in a gzipped file means decompressing everything before the offset,
+# so look up many DOIs at once with get_many(), which reads each file only once.
+#
+# See: https://www.crossref.org/learning/public-data-file/
+#
+
+import gzip
+import json
+import os
+import sqlite3
+import threading
+
+# Version of the index schema, so we know when to rebuild an old index
+schema_version = 1
+
+
+class CrossrefSnapshot:
+    """A local snapshot of Crossref works with an index of DOIs.
+
+    Lookups are thread safe.
+    """
+
+    def __init__(self, directory: str, index_filename: str, progress=None):
+        """Open the snapshot, indexing any files that aren't indexed yet.
+
+        :param directory: path to the directory with the snapshot files.
+        :param index_filename: path to the SQLite database with the index.
+        :param progress: optional function to call with the name of each file
+        that is indexed.
+        """
+
+        self.directory = directory
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(index_filename, check_same_thread=False)
+
+        # The index can be rebuilt from the snapshot, so just start again if it
+        # is from an older version of this script
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+            with self.db:
+                for table in ("works", "files"):
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+
+                self.db.execute(f"PRAGMA user_version={schema_version}")
+
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files (file_id INTEGER PRIMARY KEY, filename TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS works (doi TEXT NOT NULL, file_id INTEGER NOT NULL, offset INTEGER NOT NULL, PRIMARY KEY (doi, file_id)) WITHOUT ROWID"
+        )
+
+        self.update_index(progress)
+
+        # file_id → path of the file, so we don't need to ask the database
+        self.files = {
+            file_id: os.path.join(self.directory, filename)
+            for file_id, filename in self.db.execute(
+                "SELECT file_id, filename FROM files"
+            )
+        }
+
+    def update_index(self, progress=None):
+        """Index new or changed files and forget files that were removed.
+
+        :param progress: optional function to call with the name of each file
+        that is indexed.
+        """
+
+        indexed = {
+            filename: (file_id, size, mtime)
+            for file_id, filename, size, mtime in self.db.execute(
+                "SELECT file_id, filename, size, mtime FROM files"
+            )
+        }
+
+        filenames = sorted(
+            filename
+            for filename in os.listdir(self.directory)
+            if filename.endswith(".gz")
+        )
+
+        for filename in indexed.keys() - set(filenames):
+            self.remove_file(indexed[filename][0])
+
+        for filename in filenames:
+            stat = os.stat(os.path.join(self.directory, filename))
+
+            if filename in indexed:
+                file_id, size, mtime = indexed[filename]
+
+                if size == stat.st_size and mtime == stat.st_mtime:
+                    continue
+
+                self.remove_file(file_id)
+
+            if progress:
+                progress(filename)
+
+            self.index_file(filename, stat)
+
+    def remove_file(self, file_id: int):
+        """Remove a file and its works from the index.
+
+        :param file_id: ID of the file in the index.
+        """
+
+        with self.db:
+            self.db.execute("DELETE FROM works WHERE file_id=?", (file_id,))
+            self.db.execute("DELETE FROM files WHERE file_id=?", (file_id,))
+
+    def index_file(self, filename: str, stat: os.stat_result):
+        """Add the DOIs in a file to the index.
+
+        Offsets are positions in the uncompressed file.
+
+        :param filename: name of the file in the snapshot directory.
+        :param stat: result of os.stat() for the file.
+        """
+
+        works = []
+        offset = 0
+
+        with gzip.open(os.path.join(self.directory, filename), "rb") as f:
+            for line in f:
+                if line.strip():
+                    works.append((json.loads(line)["DOI"].lower(), offset))
+
+                offset += len(line)
+
+        # Only commit when the whole file is indexed, so an interrupted run
+        # indexes the file again next time.
+        with self.db:
+            file_id = self.db.execute(
+                "INSERT INTO files (filename, size, mtime) VALUES (?, ?, ?)",
+                (filename, stat.st_size, stat.st_mtime),
+            ).lastrowid
+
+            self.db.executemany(
+                "INSERT OR REPLACE INTO works (doi, file_id, offset) VALUES (?, ?, ?)",
+                ((doi, file_id, offset) for doi, offset in works),
+            )
+
+    def get(self, doi: str) -> dict | None:
+        """Return the Crossref work for a DOI, if it is in the snapshot.
+
+        Use get_many() for more than a few DOIs.
+
+        :param doi: the DOI, for example "10.1016/j.agsy.2021.103290".
+        :returns dict or None
+        """
+
+        return self.get_many([doi]).get(doi)
+
+    def get_many(self, dois: list) -> dict:
+        """Return the Crossref works for the DOIs that are in the snapshot.
+
+        The works are read in the order they are in the files, so each file is
+        only decompressed once however many of the DOIs it has.
+
+        :param dois: list of DOIs.
+        :returns dict of DOI → work, for the DOIs that are in the snapshot
+        """
+
+        # file_id → list of (offset, DOI)
+        locations = {}
+
+        with self.lock:
+            for doi in dois:
+                # A DOI can be in several files, for example when Crossref fixed
+                # something in a later file. We index all of them, so the DOI is
+                # still found when one of the files is removed, and use the one
+                # that was indexed last.
+                result = self.db.execute(
+                    "SELECT file_id, offset FROM works WHERE doi=? ORDER BY file_id DESC LIMIT 1",
+                    (doi.lower(),),
+                ).fetchone()
+
+                if result is not None:
+                    file_id, offset = result
+                    locations.setdefault(file_id, []).append((offset, doi))
+
+        works = {}
+
+        for file_id, offsets in locations.items():
+            with gzip.open(self.files[file_id], "rb") as f:
+                # Seeking forward only decompresses the part we skip
+                for offset, doi in sorted(offsets):
+                    f.seek(offset)
+                    works[doi] = json.loads(f.readline())
+
+        return works
+
+    def close(self):
+        """Close the index."""
+
+        self.db.close()
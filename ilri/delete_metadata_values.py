@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# delete-metadata-values.py 1.2.5
+# delete-metadata-values.py 1.3.0
 #
 # Copyright Alan Orth.
 #
@@ -47,6 +47,16 @@ parser.add_argument(
 parser.add_argument("-db", "--database-name", help="Database name", required=True)
 parser.add_argument("-u", "--database-user", help="Database username", required=True)
 parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "--database-host",
+    help="Database host (default localhost).",
+    default="localhost",
+)
+parser.add_argument(
+    "--change-journal",
+    help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+    default="changed-items.txt",
+)
 parser.add_argument(
     "-d",
     "--debug",
@@ -92,7 +102,7 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # connect to database
 conn = util.db_connect(
-    args.database_name, args.database_user, args.database_pass, "localhost"
+    args.database_name, args.database_user, args.database_pass, args.database_host
 )
 
 if args.dry_run:
@@ -100,52 +110,60 @@ if args.dry_run:
 
 cursor = conn.cursor()
 
-for row in reader:
-    metadata_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
+metadata_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
 
-    # Get item UUIDs for metadata values that will be updated
-    sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-    cursor.execute(sql, (metadata_field_id, row[args.from_field_name]))
-
-    if cursor.rowcount > 0:
-        if args.dry_run:
-            if not args.quiet:
-                print(
-                    Fore.GREEN
-                    + "Would delete {0} occurences of: {1}".format(
-                        cursor.rowcount, row[args.from_field_name]
-                    )
-                    + Fore.RESET
-                )
+# Items we've changed, so we can update their last_modified dates in batches
+last_modified = util.LastModifiedBatch()
 
-            # Since this a dry run we can continue to the next replacement
-            continue
+if args.dry_run:
+    # Get item UUIDs for metadata values that would be deleted
+    sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
+else:
+    # Delete the values and get the item UUIDs we've changed, so we can use
+    # them to update their last_modified dates.
+    sql = "DELETE from metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s RETURNING dspace_object_id"
 
-        # Get the records for items with matching metadata. We will use the
-        # object IDs to update their last_modified dates.
-        matching_records = cursor.fetchall()
+params_seq = ((metadata_field_id, row[args.from_field_name]) for row in reader)
 
-        sql = "DELETE from metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-        cursor.execute(sql, (metadata_field_id, row[args.from_field_name]))
+# The deletions don't depend on each other's results, so we can send them to
+# the database without waiting for each one to finish.
+for params, matching_records in util.execute_pipelined(cursor, sql, params_seq):
+    if len(matching_records) == 0:
+        continue
 
-        if cursor.rowcount > 0 and not args.quiet:
+    if args.dry_run:
+        if not args.quiet:
             print(
                 Fore.GREEN
-                + "Deleted {0} occurences of: {1}".format(
-                    cursor.rowcount, row[args.from_field_name]
+                + "Would delete {0} occurences of: {1}".format(
+                    len(matching_records), params[1]
                 )
                 + Fore.RESET
             )
 
-        # Update the last_modified date for each item we've changed
-        for record in matching_records:
-            util.update_item_last_modified(cursor, record[0])
+        # Since this a dry run we can continue to the next replacement
+        continue
+
+    if not args.quiet:
+        print(
+            Fore.GREEN
+            + "Deleted {0} occurences of: {1}".format(len(matching_records), params[1])
+            + Fore.RESET
+        )
+
+    # Update the last_modified date for each item we've changed
+    last_modified.add(cursor, (record[0] for record in matching_records))
 
 
 # commit the changes when we are done
 if not args.dry_run:
+    last_modified.flush(cursor)
+
     conn.commit()
 
+    # Record the items we've changed so they can be reindexed in Discovery
+    util.ChangeJournal(args.change_journal).add(last_modified.updated)
+
 # close database connection before we exit
 conn.close()
 
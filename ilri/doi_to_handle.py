@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# doi-to-handle.py 0.0.2
+# doi-to-handle.py 0.0.3
 #
 # Copyright Alan Orth.
 #
@@ -25,70 +25,43 @@ import sys
 import util
 
 
-def resolve_doi(dois):
-    # metadata_field_id for metadata values (from metadatafieldregistry and
-    # might differ from site to site).
-    title_metadata_field_id = 64
-    handle_metadata_field_id = 25
-    doi_metadata_field_id = 220
+# Write the title and handle of the item with this DOI to the output CSV, using
+# the results of items_sql.
+def resolve_doi(doi, results):
+    # make sure we found exactly one item, because some DOIs are used multiple
+    # times and I ain't got time for that right now
+    if len(results) == 1:
+        dspace_object_id, titles, handles = results[0]
 
-    print(f"Looking up {doi} in database")
-
-    cursor = conn.cursor()
-
-    with conn.transaction():
-        # make a temporary string we can use with the PostgreSQL regex
-        doi_string = f".*{doi}.*"
-
-        # get the dspace_object_id for the item with this DOI
-        sql = "SELECT dspace_object_id FROM metadatavalue WHERE metadata_field_id=%s AND text_value ~* %s"
-        cursor.execute(
-            sql,
-            (doi_metadata_field_id, doi_string),
-        )
-
-        # make sure rowcount is exactly 1, because some DOIs are used
-        # multiple times and I ain't got time for that right now
-        if cursor.rowcount == 1 and not args.quiet:
-            dspace_object_id = cursor.fetchone()[0]
+        if not args.quiet:
             print(f"Found {doi}, DSpace object: {dspace_object_id}")
-        elif cursor.rowcount > 1 and not args.quiet:
+    elif len(results) > 1:
+        if not args.quiet:
             print(f"Found multiple items for {doi}")
 
-            return
-        else:
-            print(f"Not found: {doi}")
-
-            return
+        return
+    else:
+        print(f"Not found: {doi}")
 
-        # get the title
-        sql = "SELECT text_value FROM metadatavalue WHERE metadata_field_id=%s AND dspace_object_id=%s"
-        cursor.execute(sql, (title_metadata_field_id, dspace_object_id))
+        return
 
-        if cursor.rowcount != 1:
-            print(f"Missing title for {doi}, skipping")
+    if titles is None or len(titles) != 1:
+        print(f"Missing title for {doi}, skipping")
 
-            return
+        return
 
-        title = cursor.fetchone()[0]
+    if handles is None or len(handles) != 1:
+        print(f"Missing handle for {doi}, skipping")
 
-        # get the handle
-        cursor.execute(sql, (handle_metadata_field_id, dspace_object_id))
+        return
 
-        if cursor.rowcount != 1:
-            print(f"Missing handle for {doi}, skipping")
+    row = {
+        "title": titles[0],
+        "handle": handles[0],
+        "doi": doi,
+    }
 
-            return
-
-        handle = cursor.fetchone()[0]
-
-        row = {
-            "title": title,
-            "handle": handle,
-            "doi": doi,
-        }
-
-        writer.writerow(row)
+    writer.writerow(row)
 
 
 def signal_handler(signal, frame):
@@ -126,6 +99,11 @@ parser.add_argument(
     type=argparse.FileType("w"),
 )
 parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "--database-host",
+    help="Database host (default localhost).",
+    default="localhost",
+)
 parser.add_argument(
     "-q",
     "--quiet",
@@ -140,21 +118,58 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # connect to database
 conn = util.db_connect(
-    args.database_name, args.database_user, args.database_pass, "localhost"
+    args.database_name, args.database_user, args.database_pass, args.database_host
 )
 
 # Set this connection to be read only since we are not modifying the database
 conn.read_only = True
 
+# metadata_field_id for metadata values (from metadatafieldregistry and might
+# differ from site to site).
+registry = util.metadata_field_registry(conn.cursor())
+title_metadata_field_id = registry.field_id("dc.title")
+handle_metadata_field_id = registry.field_id("dc.identifier.uri")
+doi_metadata_field_id = registry.field_id("cg.identifier.doi")
+
 # field names for the CSV
 fieldnames = ["title", "handle", "doi"]
 
 writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
 writer.writeheader()
 
+# Get the dspace_object_id, titles, and handles of items with a DOI matching the
+# regular expression.
+items_sql = """
+    SELECT M.dspace_object_id,
+        (SELECT array_agg(text_value) FROM metadatavalue WHERE metadata_field_id=%s AND dspace_object_id=M.dspace_object_id),
+        (SELECT array_agg(text_value) FROM metadatavalue WHERE metadata_field_id=%s AND dspace_object_id=M.dspace_object_id)
+    FROM metadatavalue M WHERE M.metadata_field_id=%s AND M.text_value ~* %s
+"""
+
 dois = util.read_dois_from_file(args.input_file)
-for doi in dois:
-    resolve_doi(doi)
+
+# make a temporary string for each DOI we can use with the PostgreSQL regex
+params_seq = (
+    (
+        title_metadata_field_id,
+        handle_metadata_field_id,
+        doi_metadata_field_id,
+        f".*{doi}.*",
+    )
+    for doi in dois
+)
+
+cursor = conn.cursor()
+
+# The lookups don't depend on each other, so we can send them to the database
+# without waiting for each one to finish.
+for doi, (params, results) in zip(
+    dois, util.execute_pipelined(cursor, items_sql, params_seq)
+):
+    if not args.quiet:
+        print(f"Looking up {doi} in database")
+
+    resolve_doi(doi, results)
 
 # close output file before we exit
 args.output_file.close()
@@ -0,0 +1,452 @@
+# duplicates.py v0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper functions for checking potential duplicates against a local snapshot
+# of DSpace item metadata instead of the live PostgreSQL database. Similarity
+# is calculated the same way as PostgreSQL's pg_trgm extension, and distance
+# the same way as the fuzzystrmatch extension's levenshtein_less_equal().
+#
+# See: https://www.postgresql.org/docs/current/pgtrgm.html
+# See: https://www.postgresql.org/docs/current/fuzzystrmatch.html
+#
+
+import csv
+import gzip
+import math
+import re
+from array import array
+
+# Fields in the snapshot file. Types are joined with "||" like in DSpace CSVs
+# because an item can have several.
+snapshot_fieldnames = ["handle", "title", "type", "issued"]
+
+
+# Titles, types, and issue dates (falling back to date available) of all items
+# that are in the archive and not withdrawn.
+items_sql = """
+    SELECT H.handle, M.text_value,
+        (SELECT string_agg(text_value, '||') FROM metadatavalue WHERE dspace_object_id=I.uuid AND metadata_field_id=%(type)s),
+        COALESCE(
+            (SELECT text_value FROM metadatavalue WHERE dspace_object_id=I.uuid AND metadata_field_id=%(issued)s LIMIT 1),
+            (SELECT text_value FROM metadatavalue WHERE dspace_object_id=I.uuid AND metadata_field_id=%(available)s LIMIT 1)
+        )
+    FROM item I
+    JOIN metadatavalue M ON M.dspace_object_id = I.uuid AND M.metadata_field_id=%(title)s
+    JOIN handle H ON H.resource_id = I.uuid
+    WHERE I.in_archive AND NOT I.withdrawn
+"""
+
+
+def write_snapshot(cursor, filename: str, field_ids: dict) -> int:
+    """Write a snapshot of item metadata for duplicate checking.
+
+    The snapshot is a gzipped CSV with one row per title of every item that is
+    in the archive and not withdrawn. The date issued falls back to the date
+    available if it is missing.
+
+    :param cursor: a psycopg cursor with an active database session. Should be
+    a server-side cursor so that results are streamed instead of held in memory.
+    :param filename: path to the snapshot file.
+    :param field_ids: dict of metadata field IDs with keys "title", "type",
+    "issued", and "available".
+    :returns int number of rows written
+    """
+
+    cursor.execute(items_sql, field_ids)
+
+    rows = 0
+
+    with gzip.open(filename, "wt", encoding="UTF-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(snapshot_fieldnames)
+
+        for handle, title, item_type, issued in cursor:
+            writer.writerow([handle, title, item_type or "", issued or ""])
+            rows += 1
+
+    return rows
+
+
+def read_items(cursor, field_ids: dict) -> list:
+    """Read item metadata for duplicate checking from the database.
+
+    Returns the same records as read_snapshot(), but from the live database.
+
+    :param cursor: a psycopg cursor with an active database session.
+    :param field_ids: dict of metadata field IDs with keys "title", "type",
+    "issued", and "available".
+    :returns list of dicts with keys "handle", "title", "types", and "issued"
+    """
+
+    cursor.execute(items_sql, field_ids)
+
+    records = []
+
+    for handle, title, item_type, issued in cursor:
+        records.append(
+            {
+                "handle": handle,
+                "title": title,
+                "types": set(filter(None, (item_type or "").split("||"))),
+                "issued": issued or None,
+            }
+        )
+
+    return records
+
+
+def read_snapshot(filename: str) -> list:
+    """Read a snapshot written by write_snapshot().
+
+    :param filename: path to the snapshot file.
+    :returns list of dicts with keys "handle", "title", "types", and "issued"
+    """
+
+    records = []
+
+    with gzip.open(filename, "rt", encoding="UTF-8", newline="") as f:
+        reader = csv.DictReader(f)
+
+        for row in reader:
+            records.append(
+                {
+                    "handle": row["handle"],
+                    "title": row["title"],
+                    "types": set(filter(None, row["type"].split("||"))),
+                    "issued": row["issued"] or None,
+                }
+            )
+
+    return records
+
+
+# pg_trgm ignores non-word characters (KEEPONLYALNUM) and folds case
+# (IGNORECASE) in its default build.
+words_pattern = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> set:
+    """Return the set of trigrams in a string like pg_trgm's show_trgm().
+
+    Each word is lowercased and padded with two spaces at the beginning and one
+    space at the end before extracting trigrams.
+
+    :param text: the string to extract trigrams from.
+    :returns set of trigrams
+    """
+
+    result = set()
+
+    for word in words_pattern.findall(text.lower()):
+        padded = f"  {word} "
+
+        for i in range(len(padded) - 2):
+            result.add(padded[i : i + 3])
+
+    return result
+
+
+def similarity(text1: str, text2: str) -> float:
+    """Return the similarity of two strings like pg_trgm's similarity().
+
+    :param text1: the first string.
+    :param text2: the second string.
+    :returns float between 0.0 and 1.0
+    """
+
+    trigrams1 = trigrams(text1)
+    trigrams2 = trigrams(text2)
+
+    if not trigrams1 or not trigrams2:
+        return 0.0
+
+    shared = len(trigrams1 & trigrams2)
+
+    return shared / (len(trigrams1) + len(trigrams2) - shared)
+
+
+class TrigramIndex:
+    """An in-memory trigram inverted index of strings.
+
+    Answers the same queries as pg_trgm's similarity operator (%) with a GIN
+    index: all strings whose similarity to the query is at least the threshold.
+    """
+
+    def __init__(self, texts):
+        """Build the index.
+
+        :param texts: an iterable of strings. Results refer to strings by their
+        position in this iterable.
+        """
+
+        self.texts = []
+        # Number of trigrams in each string, used to filter candidates by size
+        self.sizes = array("I")
+        # Inverted index of trigram → positions of the strings containing it
+        self.postings = {}
+
+        for position, text in enumerate(texts):
+            text_trigrams = trigrams(text)
+
+            self.texts.append(text)
+            self.sizes.append(len(text_trigrams))
+
+            for trigram in text_trigrams:
+                try:
+                    self.postings[trigram].append(position)
+                except KeyError:
+                    self.postings[trigram] = array("I", [position])
+
+    def search(self, query: str, threshold: float) -> list:
+        """Find strings similar to the query.
+
+        Two strings with a and b trigrams sharing s trigrams can only have a
+        similarity of at least t if they share at least t * a trigrams, so we
+        only need to collect candidates from the rarest a - ceil(t * a) + 1
+        trigrams of the query before verifying them.
+
+        :param query: the string to search for.
+        :param threshold: similarity threshold, between 0.0 and 1.0.
+        :returns list of (position, similarity) tuples, most similar first
+        """
+
+        query_trigrams = trigrams(query)
+        query_size = len(query_trigrams)
+
+        if query_size == 0:
+            return []
+
+        # Minimum number of shared trigrams for any match
+        minimum_shared = max(math.ceil(threshold * query_size - 1e-9), 1)
+
+        # Sort the query's trigrams by how many strings they appear in
+        ordered_trigrams = sorted(
+            query_trigrams, key=lambda trigram: len(self.postings.get(trigram, ()))
+        )
+        prefix_length = query_size - minimum_shared + 1
+
+        candidates = set()
+        for trigram in ordered_trigrams[:prefix_length]:
+            candidates.update(self.postings.get(trigram, ()))
+
+        # Similarity can't be more than the ratio of the smaller to the larger
+        # number of trigrams, so skip strings that are too short or too long.
+        minimum_size = threshold * query_size
+        maximum_size = query_size / threshold if threshold > 0 else math.inf
+
+        results = []
+        for position in candidates:
+            size = self.sizes[position]
+
+            if size < minimum_size or size > maximum_size:
+                continue
+
+            shared = len(query_trigrams & trigrams(self.texts[position]))
+            score = shared / (query_size + size - shared)
+
+            if score >= threshold:
+                results.append((position, score))
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+
+        return results
+
+
+def levenshtein_less_equal(text1: str, text2: str, max_distance: int) -> int:
+    """Return the Levenshtein distance between two strings, if it is small.
+
+    Like fuzzystrmatch's levenshtein_less_equal(), this only calculates the
+    part of the matrix within max_distance of the diagonal and stops as soon
+    as the distance must be larger, in which case max_distance + 1 is returned.
+
+    :param text1: the first string.
+    :param text2: the second string.
+    :param max_distance: the maximum distance we care about.
+    :returns int
+    """
+
+    if abs(len(text1) - len(text2)) > max_distance:
+        return max_distance + 1
+
+    # Make sure the second string is the longer one
+    if len(text1) > len(text2):
+        text1, text2 = text2, text1
+
+    too_far = max_distance + 1
+    previous_row = list(range(len(text2) + 1))
+
+    for i, character1 in enumerate(text1, start=1):
+        # Only cells within max_distance of the diagonal can be small enough
+        start = max(1, i - max_distance)
+        end = min(len(text2), i + max_distance)
+
+        current_row = [too_far] * (len(text2) + 1)
+        if start == 1:
+            current_row[0] = i
+
+        row_minimum = current_row[0] if start == 1 else too_far
+
+        for j in range(start, end + 1):
+            cost = 0 if character1 == text2[j - 1] else 1
+            distance = min(
+                previous_row[j] + 1,
+                current_row[j - 1] + 1,
+                previous_row[j - 1] + cost,
+            )
+            current_row[j] = distance
+
+            if distance < row_minimum:
+                row_minimum = distance
+
+        # Every path through this row already costs too much
+        if row_minimum > max_distance:
+            return too_far
+
+        previous_row = current_row
+
+    return min(previous_row[len(text2)], too_far)
+
+
+def qgrams(text: str, q: int = 2) -> set:
+    """Return the q-grams of a string, numbering repeated q-grams.
+
+    Repeated q-grams are numbered ("ab", 0), ("ab", 1), etc so that the size of
+    the intersection of two of these sets is the number of q-grams the strings
+    have in common, counting repeats.
+
+    :param text: the string to extract q-grams from.
+    :param q: the length of the q-grams.
+    :returns set of (q-gram, occurrence) tuples
+    """
+
+    result = set()
+    seen = {}
+
+    for i in range(len(text) - q + 1):
+        qgram = text[i : i + q]
+        occurrence = seen.get(qgram, 0)
+        seen[qgram] = occurrence + 1
+
+        result.add((qgram, occurrence))
+
+    return result
+
+
+class LevenshteinIndex:
+    """An in-memory index of strings for finding those within an edit distance.
+
+    Candidates are found with a length filter and a q-gram count filter, which
+    uses the fact that one edit can destroy at most q of a string's q-grams, so
+    strings within distance k of each other share at least max(|a|, |b|) - q +
+    1 - k * q q-grams. Candidates are then verified with levenshtein_less_equal().
+    """
+
+    q = 2
+
+    def __init__(self, texts):
+        """Build the index.
+
+        :param texts: an iterable of strings. Results refer to strings by their
+        position in this iterable.
+        """
+
+        self.texts = []
+        # Positions of strings by length, for when the q-gram filter can't help
+        self.lengths = {}
+        # Inverted index of q-gram → positions of the strings containing it
+        self.postings = {}
+
+        for position, text in enumerate(texts):
+            self.texts.append(text)
+            self.lengths.setdefault(len(text), array("I")).append(position)
+
+            for qgram in qgrams(text, self.q):
+                try:
+                    self.postings[qgram].append(position)
+                except KeyError:
+                    self.postings[qgram] = array("I", [position])
+
+    def search(self, query: str, max_distance: int) -> list:
+        """Find strings within an edit distance of the query.
+
+        :param query: the string to search for.
+        :param max_distance: the maximum Levenshtein distance.
+        :returns list of (position, distance) tuples, closest first
+        """
+
+        query_qgrams = qgrams(query, self.q)
+
+        # The least number of q-grams any match must share with the query,
+        # since max(|a|, |b|) is at least the length of the query.
+        minimum_shared = len(query) - self.q + 1 - max_distance * self.q
+
+        candidates = set()
+
+        if minimum_shared > 0:
+            # Any match must contain at least one of the query's rarest
+            # len(query_qgrams) - minimum_shared + 1 q-grams.
+            ordered_qgrams = sorted(
+                query_qgrams, key=lambda qgram: len(self.postings.get(qgram, ()))
+            )
+            prefix_length = len(query_qgrams) - minimum_shared + 1
+
+            for qgram in ordered_qgrams[:prefix_length]:
+                candidates.update(self.postings.get(qgram, ()))
+        else:
+            # The query is too short for the q-gram filter, so fall back to
+            # checking every string with a similar length.
+            for length in range(
+                len(query) - max_distance, len(query) + max_distance + 1
+            ):
+                candidates.update(self.lengths.get(length, ()))
+
+        results = []
+        for position in candidates:
+            text = self.texts[position]
+
+            if abs(len(text) - len(query)) > max_distance:
+                continue
+
+            distance = levenshtein_less_equal(query, text, max_distance)
+
+            if distance <= max_distance:
+                results.append((position, distance))
+
+        results.sort(key=lambda result: (result[1], result[0]))
+
+        return results
+
+
+# The index used by worker processes, see init_worker()
+worker_index = None
+
+
+def init_worker(index):
+    """Set the index for a worker process in a process pool.
+
+    Pass this as the initializer of a process pool so each worker only receives
+    the index once instead of once per task. With the "fork" start method the
+    index isn't even copied until a worker modifies it.
+
+    :param index: a LevenshteinIndex or TrigramIndex.
+    """
+
+    global worker_index
+
+    worker_index = index
+
+
+def search_worker(query_and_threshold: tuple) -> list:
+    """Search the worker process's index, see init_worker().
+
+    :param query_and_threshold: tuple of the query and the threshold or max
+    distance to pass to the index's search().
+    :returns list of search results
+    """
+
+    return worker_index.search(*query_and_threshold)
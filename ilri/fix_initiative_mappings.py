@@ -38,7 +38,7 @@ import sys
 from datetime import timedelta
 
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 
@@ -54,7 +54,11 @@ def parse_community(community_id):
         + "?expand=collections"
     )
     try:
-        request = requests.get(request_url, headers={"user-agent": rest_user_agent})
+        request = session.get(
+            request_url,
+            headers={"user-agent": rest_user_agent},
+            expire_after=rest_expire_after,
+        )
     except requests.ConnectionError:
         sys.stderr.write(
             f"{Fore.RED}Could not connect to {args.rest_url}.{Fore.RESET}\n"
@@ -132,19 +136,16 @@ initiative_column_name = "cg.contributor.initiative[en_US]"
 # The prefix for all Initiative collection names
 initiative_column_name_prefix = "CGIAR Initiative on "
 
-# Enable transparent request cache with one day expiry, as we are worried that
-# Initiative names could have changed.
-expire_after = timedelta(days=1)
-requests_cache.install_cache("requests-cache", expire_after=expire_after)
-
-# Prune old cache entries
-requests_cache.delete()
+# Use the transparent request cache. Responses from the REST API and the list
+# of Initiatives are only cached for one day, as we are worried that Initiative
+# names could have changed. The REST API can be on any host so it has no entry
+# in util.cache_expire_after and we set its expiry on each request instead.
+session = util.requests_session()
+rest_expire_after = timedelta(days=1)
 
 # Fetch the controlled vocabulary for Initiatives
 try:
-    request = requests.get(
-        initiatives_list_url, headers={"user-agent": rest_user_agent}
-    )
+    request = session.get(initiatives_list_url, headers={"user-agent": rest_user_agent})
 except requests.ConnectionError:
     sys.stderr.write(
         f"{Fore.RED}Could not connect to REST API: {args.rest_url}.{Fore.RESET}\n"
@@ -158,7 +159,11 @@ if request.status_code == requests.codes.ok:
 # Fetch the metadata for the given community handle
 request_url = rest_base_url + rest_handle_endpoint + str(handle)
 try:
-    request = requests.get(request_url, headers={"user-agent": rest_user_agent})
+    request = session.get(
+        request_url,
+        headers={"user-agent": rest_user_agent},
+        expire_after=rest_expire_after,
+    )
 except requests.ConnectionError:
     sys.stderr.write(
         f"{Fore.RED}Could not connect to REST API: {args.rest_url}.{Fore.RESET}\n"
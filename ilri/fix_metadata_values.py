@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# fix-metadata-values.py v1.2.7
+# fix-metadata-values.py v1.5.0
 #
 # Copyright Alan Orth
 #
@@ -10,8 +10,20 @@
 #
 # Expects a CSV with two columns: one with "bad" metadata values and one with
 # correct values. Basically just a mass search and replace function for DSpace's
-# PostgreSQL database. This script only works on DSpace 6+. Make sure to do a
-# full `index-discovery -b` afterwards.
+# PostgreSQL database. This script only works on DSpace 6+. The items that are
+# changed are added to a change journal (see --change-journal), so afterwards
+# you can reindex just those items in Discovery with reindex_changed_items.py
+# instead of doing a full `index-discovery -b`.
+#
+# With the --bulk option all corrections are loaded into a temporary table and
+# applied with a single UPDATE, which is much faster for large CSVs. Note that
+# each value is only replaced once, so chained corrections (A → B, B → C) are
+# not applied transitively like they might be when processing row by row.
+#
+# Changes are committed every 1,000 rows by default (see --commit-every) and the
+# progress is saved to a journal next to the CSV file. If a run is interrupted,
+# running it again with the same CSV file will skip the rows that were already
+# committed.
 #
 # This script is written for Python 3 and requires several modules that you can
 # install with pip (I recommend setting up a Python virtual environment first):
@@ -23,7 +35,9 @@
 
 import argparse
 import csv
+import itertools
 import logging
+import os
 import signal
 import sys
 
@@ -35,9 +49,177 @@ logger = logging.getLogger(__name__)
 
 
 def signal_handler(signal, frame):
+    # Anything since the last commit is rolled back when we exit, and the next
+    # run will resume from there.
     sys.exit(1)
 
 
+# Check whether a correction should be skipped
+def skip_correction(row) -> bool:
+    if row[args.from_field_name] == row[args.to_field_name]:
+        # sometimes editors send me corrections with identical search/replace patterns
+        logger.debug(
+            Fore.YELLOW
+            + f"Skipping identical search and replace for value: {row[args.from_field_name]}"
+            + Fore.RESET
+        )
+
+        return True
+
+    if "|" in row[args.to_field_name]:
+        # sometimes editors send me corrections with multi-value fields, which are supported in DSpace itself, but not here!
+        logger.debug(
+            Fore.YELLOW
+            + f"Skipping correction with invalid | character: {row[args.to_field_name]}"
+            + Fore.RESET
+        )
+
+        return True
+
+    return False
+
+
+# Apply all corrections at once by loading them into a temporary table and
+# joining it against the metadata values in a single UPDATE, instead of running
+# several statements for each row in the CSV.
+def fix_metadata_values_bulk(conn, rows):
+    cursor = conn.cursor()
+
+    # Corrections in the order they appear in the CSV. If a value appears more
+    # than once we only keep the first correction, which is the one that would
+    # have been applied when processing row by row.
+    corrections = {}
+
+    for row in rows:
+        if skip_correction(row):
+            continue
+
+        corrections.setdefault(row[args.from_field_name], row[args.to_field_name])
+
+    # The temporary table only lives until the end of the current transaction
+    cursor.execute(
+        "CREATE TEMPORARY TABLE fix_metadata_values (from_value text PRIMARY KEY, to_value text NOT NULL) ON COMMIT DROP"
+    )
+
+    with cursor.copy(
+        "COPY fix_metadata_values (from_value, to_value) FROM STDIN"
+    ) as copy:
+        for from_value, to_value in corrections.items():
+            copy.write_row((from_value, to_value))
+
+    cursor.execute("ANALYZE fix_metadata_values")
+
+    if args.dry_run:
+        # We needed to write to the temporary table, but from here on we can
+        # make sure that nothing else is changed.
+        cursor.execute("SET TRANSACTION READ ONLY")
+
+        sql = "SELECT C.from_value, count(*) FROM fix_metadata_values C JOIN metadatavalue M ON M.text_value = C.from_value WHERE M.dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND M.metadata_field_id=%s GROUP BY C.from_value"
+    else:
+        # Replace the values and update the last_modified date of all items
+        # we've changed in one statement, and count the replacements per value
+        # from the rows the UPDATE returns.
+        sql = """
+            WITH updated AS (
+                UPDATE metadatavalue M SET text_value = C.to_value
+                FROM fix_metadata_values C
+                WHERE M.text_value = C.from_value
+                    AND M.dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn)
+                    AND M.metadata_field_id=%s
+                RETURNING M.dspace_object_id, C.from_value
+            ), modified AS (
+                UPDATE item SET last_modified=NOW()
+                WHERE uuid IN (SELECT dspace_object_id FROM updated)
+                RETURNING uuid
+            )
+            SELECT from_value, count(*), array_agg(DISTINCT dspace_object_id) FROM updated GROUP BY from_value
+        """
+
+    cursor.execute(sql, (metadata_field_id,))
+    results = cursor.fetchall()
+    counts = {result[0]: result[1] for result in results}
+
+    # Items we've changed, so they can be reindexed in Discovery
+    changed_items = set()
+
+    if not args.dry_run:
+        for result in results:
+            changed_items.update(result[2])
+
+    if args.quiet:
+        return changed_items
+
+    for from_value in corrections:
+        if from_value not in counts:
+            continue
+
+        if args.dry_run:
+            logger.info(
+                Fore.GREEN
+                + f"(DRY RUN) Fixed {counts[from_value]} occurences of: {from_value}"
+                + Fore.RESET
+            )
+        else:
+            logger.info(
+                Fore.GREEN
+                + f"Fixed {counts[from_value]} occurences of: {from_value}"
+                + Fore.RESET
+            )
+
+    return changed_items
+
+
+# Apply corrections one row at a time, sending the statements for all rows to the
+# database in a pipeline.
+def fix_metadata_values_rows(cursor, rows, last_modified):
+    corrections = (row for row in rows if not skip_correction(row))
+
+    if args.dry_run:
+        # Get item UUIDs for metadata values that would be updated
+        sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
+        params_seq = (
+            (metadata_field_id, row[args.from_field_name]) for row in corrections
+        )
+    else:
+        # Update the values and get the item UUIDs we've changed, so we can use
+        # them to update their last_modified dates.
+        sql = "UPDATE metadatavalue SET text_value=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s RETURNING dspace_object_id"
+        params_seq = (
+            (row[args.to_field_name], metadata_field_id, row[args.from_field_name])
+            for row in corrections
+        )
+
+    # The corrections don't depend on each other's results, so we can send them
+    # to the database without waiting for each one to finish.
+    for params, matching_records in util.execute_pipelined(cursor, sql, params_seq):
+        if len(matching_records) == 0:
+            continue
+
+        # The value we replaced is always the last parameter
+        from_value = params[-1]
+
+        if args.dry_run:
+            if not args.quiet:
+                logger.info(
+                    Fore.GREEN
+                    + f"(DRY RUN) Fixed {len(matching_records)} occurences of: {from_value}"
+                    + Fore.RESET
+                )
+
+            # Since this a dry run we can continue to the next replacement
+            continue
+
+        if not args.quiet:
+            logger.info(
+                Fore.GREEN
+                + f"Fixed {len(matching_records)} occurences of: {from_value}"
+                + Fore.RESET
+            )
+
+        # Update the last_modified date for each item we've changed
+        last_modified.add(cursor, (record[0] for record in matching_records))
+
+
 parser = argparse.ArgumentParser(
     description="Find and replace metadata values in the DSpace SQL database."
 )
@@ -51,6 +233,16 @@ parser.add_argument(
 parser.add_argument("-db", "--database-name", help="Database name", required=True)
 parser.add_argument("-u", "--database-user", help="Database username", required=True)
 parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "--database-host",
+    help="Database host (default localhost).",
+    default="localhost",
+)
+parser.add_argument(
+    "--change-journal",
+    help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+    default="changed-items.txt",
+)
 parser.add_argument(
     "-d",
     "--debug",
@@ -81,6 +273,21 @@ parser.add_argument(
     help="Name of column with values to replace.",
     required=True,
 )
+parser.add_argument(
+    "--commit-every",
+    type=int,
+    help="Commit after this many rows, or 0 to commit once at the end (default 1000).",
+    default=1000,
+)
+parser.add_argument(
+    "--journal-file",
+    help="Path to the progress journal used to resume interrupted runs (default: CSV file name with .progress suffix).",
+)
+parser.add_argument(
+    "--bulk",
+    help="Apply all corrections in a single statement (faster for large CSVs).",
+    action="store_true",
+)
 args = parser.parse_args()
 
 # The default log level is WARNING, but we want to set it to DEBUG or INFO
@@ -116,83 +323,81 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # connect to database
 conn = util.db_connect(
-    args.database_name, args.database_user, args.database_pass, "localhost"
+    args.database_name, args.database_user, args.database_pass, args.database_host
 )
 
-if args.dry_run:
+# In bulk mode we need to write the corrections to a temporary table, so the
+# transaction is set to read only after that.
+if args.dry_run and not args.bulk:
     conn.read_only = True
 
 cursor = conn.cursor()
 
-for row in reader:
-    if row[args.from_field_name] == row[args.to_field_name]:
-        # sometimes editors send me corrections with identical search/replace patterns
-        logger.debug(
-            Fore.YELLOW
-            + f"Skipping identical search and replace for value: {row[args.from_field_name]}"
-            + Fore.RESET
-        )
+metadata_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
 
-        continue
+# Progress journal so an interrupted run can be started again without applying
+# the same corrections twice. We don't need one for dry runs or when reading the
+# CSV from stdin.
+if not args.dry_run and os.path.isfile(args.csv_file.name):
+    journal = util.ProgressJournal(
+        args.journal_file or f"{args.csv_file.name}.progress", args.csv_file.name
+    )
 
-    if "|" in row[args.to_field_name]:
-        # sometimes editors send me corrections with multi-value fields, which are supported in DSpace itself, but not here!
-        logger.debug(
+    if journal.rows > 0:
+        logger.info(
             Fore.YELLOW
-            + f"Skipping correction with invalid | character: {row[args.to_field_name]}"
+            + f"Resuming after {journal.rows} rows that were already committed."
             + Fore.RESET
         )
+else:
+    journal = None
 
-        continue
+# Items we've changed, so they can be reindexed in Discovery
+change_journal = util.ChangeJournal(args.change_journal)
 
-    metadata_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
+# Skip any rows that were committed in a previous run
+rows = itertools.islice(reader, journal.rows if journal else 0, None)
+rows_committed = journal.rows if journal else 0
 
-    # Get item UUIDs for metadata values that will be updated
-    sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-    cursor.execute(sql, (metadata_field_id, row[args.from_field_name]))
+# Commit every few rows rather than at the end to keep the transactions short,
+# both so we don't lose all our work if something goes wrong and so we don't
+# hold locks on the metadatavalue table for hours.
+while batch := list(itertools.islice(rows, args.commit_every or None)):
+    # Items we've changed, so we can update their last_modified dates in batches
+    last_modified = util.LastModifiedBatch()
 
-    if cursor.rowcount > 0:
-        if args.dry_run:
-            if not args.quiet:
-                logger.info(
-                    Fore.GREEN
-                    + f"(DRY RUN) Fixed {cursor.rowcount} occurences of: {row[args.from_field_name]}"
-                    + Fore.RESET
-                )
+    if args.bulk:
+        changed_items = fix_metadata_values_bulk(conn, batch)
+    else:
+        fix_metadata_values_rows(cursor, batch, last_modified)
 
-            # Since this a dry run we can continue to the next replacement
-            continue
+    rows_committed += len(batch)
 
-        # Get the records for items with matching metadata. We will use the
-        # object IDs to update their last_modified dates.
-        matching_records = cursor.fetchall()
-
-        sql = "UPDATE metadatavalue SET text_value=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-        cursor.execute(
-            sql,
-            (
-                row[args.to_field_name],
-                metadata_field_id,
-                row[args.from_field_name],
-            ),
-        )
-
-        if cursor.rowcount > 0 and not args.quiet:
-            logger.info(
-                Fore.GREEN
-                + f"Fixed {cursor.rowcount} occurences of: {row[args.from_field_name]}"
-                + Fore.RESET
-            )
+    if args.dry_run:
+        # Nothing to commit, but start a new transaction for the next batch
+        conn.rollback()
 
-        # Update the last_modified date for each item we've changed
-        for record in matching_records:
-            util.update_item_last_modified(cursor, record[0])
+        continue
 
+    last_modified.flush(cursor)
 
-# commit changes after we are done
-if not args.dry_run:
     conn.commit()
 
+    # Record the items we've changed so they can be reindexed in Discovery. In
+    # bulk mode their last_modified dates are updated in SQL rather than with
+    # last_modified.
+    if args.bulk:
+        change_journal.add(changed_items)
+    else:
+        change_journal.add(last_modified.updated)
+
+    if journal:
+        journal.save(rows_committed)
+
+# We're done, so we don't need to resume next time
+if journal:
+    journal.remove()
+
 # close database connection before we exit
 conn.close()
 
@@ -30,10 +30,9 @@
 import logging
 import os.path
 import re
-from datetime import timedelta
 
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 # Create a local logger instance
@@ -44,7 +43,7 @@ def resolve_bitstreams(handle):
     url = f"{rest_base_url}/{rest_handle_endpoint}/{handle}"
     request_params = {"expand": "bitstreams"}
     request_headers = {"user-agent": rest_user_agent, "Accept": "application/json"}
-    response = requests.get(url, params=request_params, headers=request_headers)
+    response = session.get(url, params=request_params, headers=request_headers)
 
     if response.status_code == 200:
         bitstreams = response.json()["bitstreams"]
@@ -131,12 +130,8 @@ logging.basicConfig(format="%(message)s")
 with open("/tmp/handles.txt", "r") as fd:
     handles = fd.readlines()
 
-# Set up a transparent requests cache to be nice to the REST API
-expire_after = timedelta(days=30)
-requests_cache.install_cache("requests-cache", expire_after=expire_after)
-
-# prune old cache entries
-requests_cache.remove_expired_responses()
+# Use the transparent requests cache to be nice to the REST API
+session = util.requests_session()
 
 for handle in handles:
     # strip the handle because it has a line feed (%0A)
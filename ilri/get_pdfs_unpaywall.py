@@ -17,10 +17,8 @@ import os
 import re
 import signal
 import sys
-from datetime import timedelta
 
 import requests
-import requests_cache
 import util
 from colorama import Fore
 
@@ -48,7 +46,7 @@ def resolve_doi(doi: str) -> None:
     request_params = {"email": args.email}
 
     try:
-        request = requests.get(request_url, params=request_params)
+        request = session.get(request_url, params=request_params)
     except requests.exceptions.ConnectionError:
         logger.error(Fore.RED + "Connection error." + Fore.RESET)
 
@@ -146,12 +144,8 @@ else:
     logger.setLevel(logging.INFO)
     logging.basicConfig(format="[I] %(message)s")
 
-# Install a transparent request cache
-expire_after = timedelta(days=30)
-requests_cache.install_cache(
-    "requests-cache", expire_after=expire_after, allowable_codes=(200, 404)
-)
-requests_cache.delete()
+# Use the transparent request cache
+session = util.requests_session()
 
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
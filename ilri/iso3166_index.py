@@ -0,0 +1,387 @@
+# iso3166_index.py v0.1.0
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper class for looking up countries (ISO 3166-1 and ISO 3166-3) and their
+# subdivisions (ISO 3166-2) by name, shared by iso3166_lookup.py,
+# subdivision_lookup.py, and countries_to_csv.py.
+#
+# Going through all the countries and subdivisions in pycountry is slow, so we
+# do it once and save dicts of normalized names (lower case, without accents)
+# to a JSON file. The file is rebuilt when pycountry is updated, because that
+# is when the ISO 3166 data changes.
+#
+# Countries can also be searched with a fuzzy match for cleaning free text
+# values, using the names from ISO 3166-1 and ISO 3166-3, plus aliases that are
+# not in ISO 3166 but that we see often in partner submissions. The names are
+# compared word by word, regardless of order and punctuation, and ranked by
+# their edit distance to the value.
+#
+
+import json
+import os
+import re
+import unicodedata
+from importlib.metadata import version
+
+import pycountry
+
+# Bump this when the format of the index changes so old files are rebuilt
+index_version = 2
+
+# Country names in the order we prefer them when they are the same
+country_match_types = ["name", "official_name", "common_name"]
+
+# Names we see for countries that are not in ISO 3166, and their alpha-2 code
+country_aliases = {
+    "Belorussia": "BY",
+    "Brunei": "BN",
+    "Byelorussia": "BY",
+    "Cape Verde": "CV",
+    "Congo Brazzaville": "CG",
+    "Congo Kinshasa": "CD",
+    "Czech Republic": "CZ",
+    "Democratic Republic of Congo": "CD",
+    "DR Congo": "CD",
+    "DRC": "CD",
+    "England": "GB",
+    "Great Britain": "GB",
+    "Holland": "NL",
+    "Ivory Coast": "CI",
+    "Lao PDR": "LA",
+    "Macedonia": "MK",
+    "Micronesia": "FM",
+    "Palestine": "PS",
+    "Republic of Congo": "CG",
+    "Russia": "RU",
+    "Swaziland": "SZ",
+    "Turkey": "TR",
+    "UK": "GB",
+    "USA": "US",
+    "Vatican": "VA",
+}
+
+# How many names with the most bigrams in common we compare with the edit
+# distance, which is too slow to compare with all of them
+fuzzy_candidates = 25
+
+# Words that don't help to tell countries apart, and abbreviations
+stopwords = {"the", "of", "and"}
+abbreviations = {
+    "dem": "democratic",
+    "fed": "federal",
+    "is": "islands",
+    "rep": "republic",
+    "st": "saint",
+}
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name for looking it up.
+
+    :param name: the name, for example "Côte d'Ivoire".
+    :returns str
+    """
+
+    name = unicodedata.normalize("NFKD", name.strip())
+
+    return "".join(c for c in name if not unicodedata.combining(c)).lower()
+
+
+def normalize_tokens(name: str) -> str:
+    """Normalize a name for a fuzzy match.
+
+    The words are normalized, abbreviations expanded, and sorted, so that for
+    example "Congo, Dem. Rep." and "Democratic Republic of the Congo" are the
+    same.
+
+    :param name: the name, for example "Congo, Dem. Rep.".
+    :returns str
+    """
+
+    words = (
+        abbreviations.get(word, word)
+        for word in re.findall(r"\w+", normalize_name(name))
+    )
+
+    return " ".join(sorted(word for word in words if word not in stopwords))
+
+
+def bigrams(tokens: str) -> set:
+    """Return the character bigrams of a normalized name.
+
+    :param tokens: a name from normalize_tokens().
+    :returns set
+    """
+
+    padded = f" {tokens} "
+
+    return {padded[i : i + 2] for i in range(len(padded) - 1)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Return the Levenshtein distance between two strings.
+
+    Gives up as soon as the distance is more than limit, because most of the
+    names we compare are nowhere near each other.
+
+    :param a: the first string.
+    :param b: the second string.
+    :param limit: the largest distance we are interested in.
+    :returns int (limit + 1 if the distance is more than limit)
+    """
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+
+        if min(current) > limit:
+            return limit + 1
+
+        previous = current
+
+    return previous[-1]
+
+
+def choose_country_name(country) -> str:
+    """Return the name we use for a country in cg.coverage.country.
+
+    Prefer the common name if it exists, otherwise the shorter of name and
+    official_name, like parse_iso_codes.py does for our list of countries.
+
+    :param country: a pycountry country.
+    :returns str
+    """
+
+    if hasattr(country, "common_name"):
+        return country.common_name
+
+    if not hasattr(country, "official_name"):
+        return country.name
+
+    return min(country.name, country.official_name, key=len)
+
+
+class Iso3166Index:
+    """An index of ISO 3166 country and subdivision names."""
+
+    def __init__(self, cache_filename: str = "iso3166-index.json"):
+        """Load the index, building it first if needed.
+
+        :param cache_filename: path to the JSON file the index is saved in.
+        """
+
+        self.pycountry_version = version("pycountry")
+
+        try:
+            with open(cache_filename) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = None
+
+        if (
+            data is None
+            or data.get("version") != index_version
+            or data["pycountry"] != self.pycountry_version
+        ):
+            data = self.build()
+
+            # Write to a temporary file first so we never leave a broken index
+            with open(f"{cache_filename}.tmp", "w") as f:
+                json.dump(data, f)
+
+            os.replace(f"{cache_filename}.tmp", cache_filename)
+
+        # normalized name → [alpha-2, match type, name for cg.coverage.country]
+        self.countries = data["countries"]
+        # normalized name → list of [code, name, country alpha-2]
+        self.subdivisions = data["subdivisions"]
+
+        # Words of the country names and aliases for the fuzzy match. Aliases
+        # can change without a new version of pycountry, so they are not saved
+        # in the file.
+        self.country_tokens = {}
+
+        for name, result in self.countries.items():
+            self.country_tokens.setdefault(normalize_tokens(name), result)
+
+        # alpha-2 → name for cg.coverage.country
+        self.country_names = {
+            alpha2: country_name
+            for alpha2, match_type, country_name in self.countries.values()
+            if match_type != "historic_name"
+        }
+
+        for alias, alpha2 in country_aliases.items():
+            self.country_tokens.setdefault(
+                normalize_tokens(alias), [alpha2, "alias", self.country_names[alpha2]]
+            )
+
+        self.country_bigrams = {
+            tokens: bigrams(tokens) for tokens in self.country_tokens
+        }
+
+    def build(self) -> dict:
+        """Build the index from pycountry.
+
+        :returns dict
+        """
+
+        countries = {}
+
+        for country in pycountry.countries:
+            for match_type in country_match_types:
+                if not hasattr(country, match_type):
+                    continue
+
+                name = normalize_name(getattr(country, match_type))
+
+                if name not in countries:
+                    countries[name] = [
+                        country.alpha_2,
+                        match_type,
+                        choose_country_name(country),
+                    ]
+
+        # The alpha-2 codes of historic countries from ISO 3166-3 are no longer
+        # used, and some of them now belong to other countries. Their alpha-4
+        # code ends with the alpha-2 code of the country that replaced them, or
+        # with something like HH if they were split up, so use that instead.
+        current_countries = {
+            country.alpha_2: country for country in pycountry.countries
+        }
+
+        for country in pycountry.historic_countries:
+            name = normalize_name(country.name)
+            successor = current_countries.get(country.alpha_4[2:])
+
+            if successor is not None:
+                result = [
+                    successor.alpha_2,
+                    "historic_name",
+                    choose_country_name(successor),
+                ]
+            else:
+                result = ["", "historic_name", ""]
+
+            # Also index the short name of ones like "Zaire, Republic of"
+            countries.setdefault(name, result)
+            countries.setdefault(name.split(",")[0], result)
+
+        # Subdivision names are not unique, for example there are eight called
+        # "Central", so each name has a list of subdivisions
+        subdivisions = {}
+
+        for subdivision in pycountry.subdivisions:
+            subdivisions.setdefault(normalize_name(subdivision.name), []).append(
+                [subdivision.code, subdivision.name, subdivision.country_code]
+            )
+
+        return {
+            "version": index_version,
+            "pycountry": self.pycountry_version,
+            "countries": countries,
+            "subdivisions": subdivisions,
+        }
+
+    def country(self, name: str) -> tuple | None:
+        """Look up a country by its name, official name, or common name.
+
+        :param name: the name, for example "Tanzania".
+        :returns (alpha-2, match type, name) tuple, or None. The alpha-2 code and
+        name are empty for historic countries that were split up.
+        """
+
+        result = self.countries.get(normalize_name(name))
+
+        return tuple(result) if result else None
+
+    def subdivision(self, name: str) -> list:
+        """Look up the subdivisions with a name.
+
+        :param name: the name, for example "Nairobi City".
+        :returns list of (code, name, country alpha-2) tuples
+        """
+
+        return [
+            tuple(result) for result in self.subdivisions.get(normalize_name(name), [])
+        ]
+
+    def search_country(
+        self, name: str, candidates: int = 3, min_score: float = 0.6
+    ) -> list:
+        """Find the countries whose names are closest to a name.
+
+        The score is 1 for names that have the same words, and goes down with
+        the edit distance between the words.
+
+        :param name: the name, for example "Congo, Dem. Rep.".
+        :param candidates: the number of countries to return.
+        :param min_score: the lowest score to return, from 0 to 1.
+        :returns list of (alpha-2, name, match type, score) tuples, best first
+        """
+
+        tokens = normalize_tokens(name)
+
+        if not tokens:
+            return []
+
+        # Exact matches don't need the edit distance
+        if tokens in self.country_tokens:
+            alpha2, match_type, country_name = self.country_tokens[tokens]
+
+            if alpha2:
+                return [(alpha2, country_name, match_type, 1.0)]
+
+        # Only compare the names that have the most bigrams in common (the Dice
+        # coefficient), sorted by the name as well so ties come out the same
+        name_bigrams = bigrams(tokens)
+        similar = sorted(
+            self.country_bigrams.items(),
+            key=lambda item: (
+                -2 * len(name_bigrams & item[1]) / (len(name_bigrams) + len(item[1])),
+                item[0],
+            ),
+        )[:fuzzy_candidates]
+
+        # Only keep the best score for each country
+        best = {}
+
+        for candidate, candidate_bigrams in similar:
+            alpha2, match_type, country_name = self.country_tokens[candidate]
+
+            # Historic countries that were split up have no code to suggest
+            if not alpha2:
+                continue
+
+            longest = max(len(tokens), len(candidate))
+            distance = edit_distance(tokens, candidate, int((1 - min_score) * longest))
+            score = 1 - distance / longest
+
+            if score < min_score:
+                continue
+
+            if alpha2 not in best or score > best[alpha2][3]:
+                best[alpha2] = (alpha2, country_name, match_type, round(score, 3))
+
+        # Sort by the code as well so that ties always come out the same
+        return sorted(best.values(), key=lambda result: (-result[3], result[0]))[
+            :candidates
+        ]
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# iso3166-lookup.py 0.0.1
+# iso3166-lookup.py 0.1.1
 #
 # Copyright Alan Orth.
 #
@@ -10,12 +10,17 @@
 #
 # Queries the ISO 3166 dataset for countries read from a text file. Text file
 # should have one organization per line. Results are saved to a CSV including
-# the country name, whether it matched or not, and the type of match.
+# the country name, whether it matched or not, the type of match, and the ISO
+# 3166-1 alpha-2 code and name we use for the country in cg.coverage.country.
+#
+# The country names are indexed once per pycountry version (see iso3166_index.
+# py), and matching ignores case and accents. Countries are matched by
+# validation.Iso3166Backend, which is shared with validate_metadata.py.
 #
 # This script is written for Python 3.6+ and requires several modules that you
 # can install with pip (I recommend using a Python virtual environment):
 #
-#   $ pip install colorama pycountry requests requests-cache
+#   $ pip install colorama pycountry
 #
 
 import argparse
@@ -23,21 +28,25 @@ import csv
 import signal
 import sys
 
-import pycountry
+import validation
 from colorama import Fore
+from iso3166_index import Iso3166Index
 
 
 # read countries from a text file, one per line
 def read_countries_from_file():
-    # initialize an empty list for countries
+    # initialize an empty list for countries, and a set so we can check if we
+    # have already seen one without searching the list
     countries = []
+    seen = set()
 
     for line in args.input_file:
         # trim any leading or trailing whitespace (including newlines)
         line = line.strip()
 
         # iterate over results and add organization that aren't already present
-        if line not in countries:
+        if line not in seen:
+            seen.add(line)
             countries.append(line)
 
     # close input file before we exit
@@ -47,10 +56,24 @@ def read_countries_from_file():
 
 
 def resolve_countries(countries):
-    fieldnames = ["country", "match type", "matched"]
+    fieldnames = [
+        "country",
+        "match type",
+        "matched",
+        "cg.coverage.iso3166-1-alpha2",
+        "cg.coverage.country",
+    ]
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
+    # how we describe the match types in messages
+    match_type_labels = {
+        "name": "Name",
+        "official_name": "Official name",
+        "common_name": "Common name",
+        "historic_name": "Historic name",
+    }
+
     for country in countries:
         if args.debug:
             sys.stderr.write(
@@ -58,26 +81,20 @@ def resolve_countries(countries):
             )
 
         # check for exact match
-        if country.lower() in country_names:
-            print(f"Name match for {country!r}")
+        match = backend.lookup(country)
 
-            writer.writerow(
-                {"country": country, "match type": "name", "matched": "true"}
-            )
-        elif country.lower() in country_official_names:
-            print(f"Official name match for {country!r}")
+        if match is not None:
+            match_type, alpha2 = match
 
-            writer.writerow(
-                {"country": country, "match type": "official_name", "matched": "true"}
-            )
-        elif country.lower() in country_common_names:
-            print(f"Common name match for {country!r}")
+            print(f"{match_type_labels[match_type]} match for {country!r}")
 
             writer.writerow(
                 {
                     "country": country,
-                    "match type": "common_name",
+                    "match type": match_type,
                     "matched": "true",
+                    "cg.coverage.iso3166-1-alpha2": alpha2,
+                    "cg.coverage.country": index.country_names.get(alpha2, ""),
                 }
             )
         else:
@@ -91,6 +108,8 @@ def resolve_countries(countries):
                     "country": country,
                     "match type": "",
                     "matched": "false",
+                    "cg.coverage.iso3166-1-alpha2": "",
+                    "cg.coverage.country": "",
                 }
             )
 
@@ -133,41 +152,9 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
-# create empty lists to hold country names
-country_names = []
-country_official_names = []
-country_common_names = []
-
-# iterate over countries and append names to the appropriate lists. We can't use
-# a list comprehension here because some countries don't have official_name, etc
-# and they raise an AttributeError. Anyways, it's more efficient to iterate over
-# the list of countries just once.
-for country in pycountry.countries:
-    country_names.append(country.name.lower())
-
-    try:
-        country_official_names.append(country.official_name.lower())
-    except AttributeError:
-        pass
-
-    try:
-        country_common_names.append(country.common_name.lower())
-    except AttributeError:
-        pass
-
-# Add names for historic countries from ISO 3166-3
-for country in pycountry.historic_countries:
-    country_names.append(country.name.lower())
-
-    try:
-        country_official_names.append(country.official_name.lower())
-    except AttributeError:
-        pass
-
-    try:
-        country_common_names.append(country.common_name.lower())
-    except AttributeError:
-        pass
+# index of country names from ISO 3166-1 and ISO 3166-3
+index = Iso3166Index()
+backend = validation.Iso3166Backend(index)
 
 read_countries_from_file()
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-# move-metadata-values.py 0.1.1
+# move-metadata-values.py 0.3.0
 #
 # Copyright Alan Orth.
 #
@@ -15,17 +15,14 @@
 # This script is written for Python 3 and requires several modules that you can
 # install with pip (I recommend setting up a Python virtual environment first):
 #
-#   $ pip install psycopg2 colorama
+#   $ pip install psycopg colorama
 #
-# See: http://initd.org/psycopg
-# See: http://initd.org/psycopg/docs/usage.html#with-statement
-# See: http://initd.org/psycopg/docs/faq.html#best-practices
+# See: https://www.psycopg.org/psycopg3/docs
 
 import argparse
 import signal
 import sys
 
-import psycopg2
 import util
 from colorama import Fore
 
@@ -47,6 +44,16 @@ parser.add_argument(
 parser.add_argument("-db", "--database-name", help="Database name", required=True)
 parser.add_argument("-u", "--database-user", help="Database username", required=True)
 parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "--database-host",
+    help="Database host (default localhost).",
+    default="localhost",
+)
+parser.add_argument(
+    "--change-journal",
+    help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+    default="changed-items.txt",
+)
 parser.add_argument(
     "-d",
     "--debug",
@@ -85,69 +92,71 @@ args = parser.parse_args()
 signal.signal(signal.SIGINT, signal_handler)
 
 # connect to database
-try:
-    conn = psycopg2.connect(
-        f"dbname={args.database_name} user={args.database_user} password={args.database_pass} host='localhost'"
-    )
+conn = util.db_connect(
+    args.database_name, args.database_user, args.database_pass, args.database_host
+)
 
-    if args.debug:
-        sys.stderr.write(f"{Fore.GREEN}Connected to database.{Fore.RESET}\n")
-except psycopg2.OperationalError:
-    sys.stderr.write(f"{Fore.RED}Could not connect to database.{Fore.RESET}\n")
+if args.dry_run:
+    conn.read_only = True
 
-    sys.exit(1)
+cursor = conn.cursor()
+
+# get the metadata_field_ids for the from and to fields
+from_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
+to_field_id = util.field_name_to_field_id(cursor, args.to_field_name)
+
+# Items we've changed, so we can update their last_modified dates in batches
+last_modified = util.LastModifiedBatch()
+
+# trim any leading or trailing newlines (note we don't want to strip any white-
+# space from the string that might be in the metadatavalue itself). We only want
+# to move metadatavalues as they are, not clean them up.
+lines = (line.strip("\n") for line in args.input_file)
+
+if args.dry_run:
+    # Get item UUIDs for metadata values that would be moved
+    sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
+    params_seq = ((from_field_id, line) for line in lines)
+else:
+    # Move the values and get the item UUIDs we've changed, so we can use them
+    # to update their last_modified dates.
+    sql = "UPDATE metadatavalue SET metadata_field_id=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s RETURNING dspace_object_id"
+    params_seq = ((to_field_id, from_field_id, line) for line in lines)
+
+# The moves don't depend on each other's results, so we can send them to the
+# database without waiting for each one to finish.
+for params, matching_records in util.execute_pipelined(cursor, sql, params_seq):
+    if len(matching_records) == 0:
+        continue
+
+    # The line is always the last parameter
+    line = params[-1]
+
+    if args.dry_run:
+        if not args.quiet:
+            print(
+                f"{Fore.GREEN}Would move {len(matching_records)} occurences of: {line}{Fore.RESET}"
+            )
+
+        # Since this a dry run we can continue to the next line
+        continue
+
+    if not args.quiet:
+        print(
+            f"{Fore.GREEN}Moved {len(matching_records)} occurences of: {line}{Fore.RESET}"
+        )
+
+    # Update the last_modified date for each item we've changed
+    last_modified.add(cursor, (record[0] for record in matching_records))
+
+# commit the changes when we are done
+if not args.dry_run:
+    last_modified.flush(cursor)
+
+    conn.commit()
 
-for line in args.input_file:
-    # trim any leading or trailing newlines (note we don't want to strip any
-    # whitespace from the string that might be in the metadatavalue itself). We
-    # only want to move metadatavalues as they are, not clean them up.
-    line = line.strip("\n")
-
-    with conn:
-        # cursor will be closed after this block exits
-        # see: http://initd.org/psycopg/docs/usage.html#with-statement
-        with conn.cursor() as cursor:
-            from_field_id = util.field_name_to_field_id(cursor, args.from_field_name)
-
-            to_field_id = util.field_name_to_field_id(cursor, args.to_field_name)
-
-            # Get item UUIDs for metadata values that will be updated
-            sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-            cursor.execute(sql, (from_field_id, line))
-
-            if cursor.rowcount > 0:
-                if args.dry_run:
-                    if not args.quiet:
-                        print(
-                            f"{Fore.GREEN}Would move {cursor.rowcount} occurences of: {line}{Fore.RESET}"
-                        )
-
-                    # Since this a dry run we can continue to the next line
-                    continue
-
-                # Get the records for items with matching metadata. We will use the
-                # object IDs to update their last_modified dates.
-                matching_records = cursor.fetchall()
-
-                sql = "UPDATE metadatavalue SET metadata_field_id=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value=%s"
-                cursor.execute(
-                    sql,
-                    (
-                        to_field_id,
-                        from_field_id,
-                        line,
-                    ),
-                )
-
-                if cursor.rowcount > 0:
-                    if not args.quiet:
-                        print(
-                            f"{Fore.GREEN}Moved {cursor.rowcount} occurences of: {line}{Fore.RESET}"
-                        )
-
-                # Update the last_modified date for each item we've changed
-                for record in matching_records:
-                    util.update_item_last_modified(cursor, record[0])
+    # Record the items we've changed so they can be reindexed in Discovery
+    util.ChangeJournal(args.change_journal).add(last_modified.updated)
 
 # close database connection before we exit
 conn.close()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# orcid-authority-to-item.py 1.1.1
+# orcid-authority-to-item.py 2.0.0
 #
 # Copyright Alan Orth.
 #
@@ -22,20 +22,23 @@
 # Map ORCID identifiers from DSpace's Solr authority core by creating new cg.creator.id
 # fields in each matching item.
 #
+# The names for all the ORCID identifiers are resolved first, then the missing
+# cg.creator.id fields are added to all items in one statement. Items that al-
+# ready have a cg.creator.id with the same value in the same place are skipped,
+# so it is safe to run the script again.
+#
 # This script is written for Python 3 and requires several modules that you can
 # install with pip (I recommend setting up a Python virtual environment first):
 #
-#   $ pip install colorama psycopg2-binary requests requests-cache
+#   $ pip install colorama psycopg requests requests-cache
 #
 
 import argparse
 import signal
 import sys
-from datetime import timedelta
 
-import psycopg2
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 
@@ -44,6 +47,11 @@ def main():
     parser = argparse.ArgumentParser(
         description="Map ORCID identifiers from the DSpace Solr authority core to cg.creator.id fields in each item."
     )
+    parser.add_argument(
+        "--change-journal",
+        help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+        default="changed-items.txt",
+    )
     parser.add_argument(
         "-d",
         "--debug",
@@ -57,6 +65,12 @@ def main():
     parser.add_argument(
         "-p", "--database-pass", help="Database password", required=True
     )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        help="Only print changes that would be made.",
+        action="store_true",
+    )
     parser.add_argument(
         "-s",
         "--solr-url",
@@ -74,33 +88,33 @@ def main():
 
 # query DSpace's authority Solr core for authority IDs with ORCID identifiers
 def read_identifiers_from_solr(args):
-    # simple query from the 'authority' collection 2000 rows at a time (default is 1000)
-    solr_query_params = {"q": "orcid_id:*", "wt": "json", "rows": 2000}
-
-    solr_url = args.solr_url + "/authority/select"
-
-    res = requests.get(solr_url, params=solr_query_params)
-
-    if args.debug:
-        numFound = res.json()["response"]["numFound"]
-        sys.stderr.write(
-            Fore.GREEN
-            + "Total number of Solr records with ORCID iDs: {0}\n".format(
-                str(numFound) + Fore.RESET
-            )
-        )
-
     # initialize an empty dictionary for authorities
     # format will be: {'d7ef744b-bbd4-4171-b449-00e37e1b776f': '0000-0002-3476-272X', ...}
     authorities = {}
 
-    docs = res.json()["response"]["docs"]
+    # page through all the records in the 'authority' core, only fetching the
+    # fields we need
+    docs = util.solr_documents(
+        args.solr_url, "authority", "orcid_id:*", ["id", "orcid_id"]
+    )
+
     # iterate over results and add ORCID iDs that aren't already in the list
     # for example, we had 1600 ORCID iDs in Solr, but only 600 are unique
+    num_found = 0
     for doc in docs:
+        num_found += 1
+
         if doc["id"] not in authorities:
             authorities.update({doc["id"]: doc["orcid_id"]})
 
+    if args.debug:
+        sys.stderr.write(
+            Fore.GREEN
+            + "Total number of Solr records with ORCID iDs: {0}\n".format(
+                str(num_found) + Fore.RESET
+            )
+        )
+
     add_orcid_identifiers(args, authorities)
 
 
@@ -120,22 +134,17 @@ def resolve_orcid_identifier(args, orcid):
             + Fore.RESET
         )
 
-    # enable transparent request cache with thirty-day expiry
-    expire_after = timedelta(days=30)
-
-    # cache HTTP 200 and 404 responses, because ORCID uses HTTP 404 when an identifier doesn't exist
-    requests_cache.install_cache(
-        "requests-cache", expire_after=expire_after, allowable_codes=(200, 404)
-    )
-
     # build request URL for current ORCID ID
     request_url = orcid_api_base_url + orcid.strip() + orcid_api_endpoint
 
-    # ORCID's API defaults to some custom format, so tell it to give us JSON
-    request = requests.get(request_url, headers={"Accept": "application/json"})
+    # ORCID's API defaults to some custom format, so tell it to give us JSON.
+    # Responses are cached, including HTTP 404 because ORCID uses it when an
+    # identifier doesn't exist.
+    request = util.requests_session().get(
+        request_url, headers={"Accept": "application/json"}
+    )
 
-    # prune old cache entries
-    requests_cache.delete()
+    line = None
 
     # Check the request status
     if request.status_code == requests.codes.ok:
@@ -188,119 +197,107 @@ def resolve_orcid_identifier(args, orcid):
 
 
 def add_orcid_identifiers(args, authorities):
+    # resolve the names for each ORCID identifier only once, since many
+    # authorities share the same identifier
+    names = {}
+    # the cg.creator.id value for each authority
+    creators = []
+
+    for authority_id, orcid in authorities.items():
+        if orcid not in names:
+            names[orcid] = resolve_orcid_identifier(args, orcid)
+
+        if names[orcid] is None:
+            if args.debug:
+                sys.stderr.write(
+                    Fore.YELLOW
+                    + "Skipping authority ID {0} because ORCID iD {1} has no name.\n".format(
+                        authority_id, orcid
+                    )
+                    + Fore.RESET
+                )
+
+            continue
+
+        creators.append((authority_id, "{0}: {1}".format(names[orcid], orcid)))
+
     # connect to database
-    try:
-        conn_string = "dbname={0} user={1} password={2} host=localhost".format(
-            args.database_name, args.database_user, args.database_pass
-        )
-        conn = psycopg2.connect(conn_string)
+    conn = util.db_connect(
+        args.database_name, args.database_user, args.database_pass, "localhost"
+    )
 
-        if args.debug:
-            sys.stderr.write(Fore.GREEN + "Connected to the database.\n" + Fore.RESET)
-    except psycopg2.OperationalError:
-        sys.stderr.write(Fore.RED + "Unable to connect to the database.\n" + Fore.RESET)
-        exit(1)
+    if args.debug:
+        sys.stderr.write(Fore.GREEN + "Connected to the database.\n" + Fore.RESET)
 
-    # iterate over all authorities
-    for authority_id in authorities:
-        # save orcid for current authority a little more cleanly
-        orcid = authorities[authority_id]
+    cursor = conn.cursor()
 
-        # get name associated with this orcid identifier
-        name = resolve_orcid_identifier(args, orcid)
-        creator = "{0}: {1}".format(name, orcid)
+    # get the metadata_field_ids for the author and cg.creator.id fields
+    author_field_id = util.field_name_to_field_id(cursor, "dc.contributor.author")
+    metadata_field_id = util.field_name_to_field_id(cursor, "cg.creator.id")
 
-        if args.debug:
-            sys.stderr.write(
-                Fore.GREEN
-                + "Processing authority ID {0} with ORCID iD: {1}\n".format(
-                    authority_id, orcid
+    # load the authorities and their cg.creator.id values into a temporary table
+    # so we can join them with the metadata in the database
+    cursor.execute(
+        "CREATE TEMPORARY TABLE authority_creators (authority TEXT PRIMARY KEY, text_value TEXT NOT NULL) ON COMMIT DROP"
+    )
+
+    with cursor.copy(
+        "COPY authority_creators (authority, text_value) FROM STDIN"
+    ) as copy:
+        for creator in creators:
+            copy.write_row(creator)
+
+    # add a cg.creator.id in the same place as each author with one of the
+    # authorities, unless the item already has the same cg.creator.id there.
+    # metadatavalue IDs come from a PostgreSQL sequence that increments when
+    # you call it.
+    sql = """INSERT INTO metadatavalue (metadata_value_id, dspace_object_id, metadata_field_id, text_value, place, confidence)
+             SELECT nextval('metadatavalue_seq'), m.dspace_object_id, %(metadata_field_id)s, a.text_value, m.place, -1
+             FROM metadatavalue m
+             JOIN authority_creators a ON a.authority = m.authority
+             WHERE m.metadata_field_id = %(author_field_id)s
+             AND m.dspace_object_id IN (SELECT uuid FROM item)
+             AND NOT EXISTS (
+                 SELECT 1 FROM metadatavalue e
+                 WHERE e.dspace_object_id = m.dspace_object_id
+                 AND e.metadata_field_id = %(metadata_field_id)s
+                 AND e.text_value = a.text_value
+                 AND e.place = m.place
+                 AND e.confidence = -1
+             )
+             RETURNING dspace_object_id, text_value"""
+    cursor.execute(
+        sql,
+        {"author_field_id": author_field_id, "metadata_field_id": metadata_field_id},
+    )
+
+    # Items we've changed, so we can update their last_modified dates
+    last_modified = util.LastModifiedBatch()
+
+    for dspace_object_id, text_value in cursor.fetchall():
+        if args.dry_run:
+            print(
+                "(DRY RUN) Adding ORCID identifier to item {0}: {1}".format(
+                    dspace_object_id, text_value
+                )
+            )
+        else:
+            print(
+                "Adding ORCID identifier to item {0}: {1}".format(
+                    dspace_object_id, text_value
                 )
-                + Fore.RESET
             )
 
-        with conn:
-            # cursor will be closed after this block exits
-            # see: http://initd.org/psycopg/docs/usage.html#with-statement
-            with conn.cursor() as cursor:
-                # find all metadata records with this authority id
-                # resource_type_id 2 is item metadata, metadata_field_id 3 is author
-                sql = "SELECT resource_id, place FROM metadatavalue WHERE resource_type_id=2 AND metadata_field_id=3 AND authority=%s"
-                # remember that tuples with one item need a comma after them!
-                cursor.execute(sql, (authority_id,))
-                records_with_authority = cursor.fetchall()
-
-                if len(records_with_authority) >= 0:
-                    if args.debug:
-                        sys.stderr.write(
-                            Fore.GREEN
-                            + "Checking {0} items for authority ID {1}.\n".format(
-                                len(records_with_authority), authority_id
-                            )
-                            + Fore.RESET
-                        )
+        last_modified.add(cursor, [dspace_object_id])
 
-                    # iterate over results for current authority_id to add cg.creator.id metadata
-                    for record in records_with_authority:
-                        resource_id = record[0]
-                        # author name and orcid identifier
-                        text_value = creator
-                        place = record[1]
-                        confidence = -1
-
-                        # get the metadata_field_id for cg.creator.id field
-                        sql = "SELECT metadata_field_id FROM metadatafieldregistry WHERE metadata_schema_id=2 AND element='creator' AND qualifier='id'"
-                        cursor.execute(sql)
-                        metadata_field_id = cursor.fetchall()[0]
-
-                        # first, check if there is an existing cg.creator.id here (perhaps the script crashed before?)
-                        # resource_type_id 2 is item metadata
-                        sql = "SELECT * from metadatavalue WHERE resource_id=%s AND metadata_field_id=%s AND text_value=%s AND place=%s AND confidence=%s AND resource_type_id=2"
-                        cursor.execute(
-                            sql,
-                            (
-                                resource_id,
-                                metadata_field_id,
-                                text_value,
-                                place,
-                                confidence,
-                            ),
-                        )
-                        records_with_orcid = cursor.fetchall()
-
-                        if len(records_with_orcid) == 0:
-                            print(
-                                "Adding ORCID identifier to item {0}: {1}".format(
-                                    resource_id, creator
-                                )
-                            )
-
-                            # metadatavalue IDs come from a PostgreSQL sequence that increments when you call it
-                            cursor.execute("SELECT nextval('metadatavalue_seq')")
-                            metadata_value_id = cursor.fetchone()[0]
-
-                            sql = "INSERT INTO metadatavalue (metadata_value_id, resource_id, metadata_field_id, text_value, place, confidence, resource_type_id) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-                            cursor.execute(
-                                sql,
-                                (
-                                    metadata_value_id,
-                                    resource_id,
-                                    metadata_field_id,
-                                    text_value,
-                                    place,
-                                    confidence,
-                                    2,
-                                ),
-                            )
-                        else:
-                            if args.debug:
-                                sys.stderr.write(
-                                    Fore.GREEN
-                                    + "Item {0} already has an ORCID identifier for {1}.\n".format(
-                                        resource_id, creator
-                                    )
-                                    + Fore.RESET
-                                )
+    if args.dry_run:
+        conn.rollback()
+    else:
+        last_modified.flush(cursor)
+        conn.commit()
+
+        # Record the items we've changed so they can be reindexed in Discovery
+        util.ChangeJournal(args.change_journal).add(last_modified.updated)
 
     if args.debug:
         sys.stderr.write(Fore.GREEN + "Disconnecting from database.\n" + Fore.RESET)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# prune-requests-cache.py 0.0.2
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Remove expired responses from the requests cache shared by all the scripts
+# that look things up in external APIs (see util.requests_session()). The
+# scripts don't prune the cache when they start because it gets slow as the
+# cache grows, so run this once in a while, for example from cron.
+#
+# This script is written for Python 3 and requires several modules that you can
+# install with pip (I recommend setting up a Python virtual environment first):
+#
+#   $ pip install colorama requests-cache
+#
+
+import argparse
+import signal
+import sys
+from datetime import timedelta
+
+import util
+from colorama import Fore
+
+
+def signal_handler(signal, frame):
+    sys.exit(1)
+
+
+parser = argparse.ArgumentParser(
+    description="Remove expired responses from the requests cache."
+)
+parser.add_argument(
+    "--older-than",
+    help="Also remove responses older than this many days, even if they have not expired.",
+    type=int,
+)
+parser.add_argument(
+    "-q",
+    "--quiet",
+    help="Do not print progress messages to the screen.",
+    action="store_true",
+)
+args = parser.parse_args()
+
+if args.older_than is not None and args.older_than < 0:
+    parser.error("argument --older-than: must not be negative")
+
+# set the signal handler for SIGINT (^C)
+signal.signal(signal.SIGINT, signal_handler)
+
+cache = util.requests_session().cache
+
+responses_before = len(cache.responses)
+
+# requests-cache ignores older_than=timedelta(0), but every response is older
+# than zero days
+if args.older_than == 0:
+    cache.clear()
+elif args.older_than is not None:
+    cache.delete(expired=True, older_than=timedelta(days=args.older_than))
+else:
+    cache.delete(expired=True)
+
+if not args.quiet:
+    sys.stdout.write(
+        f"{Fore.GREEN}Removed {responses_before - len(cache.responses)} of {responses_before} cached responses.{Fore.RESET}\n"
+    )
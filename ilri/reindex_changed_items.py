@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# reindex-changed-items.py 0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Split the journal of items that were changed by the scripts that write to the
+# DSpace database directly (fix_metadata_values.py, delete_metadata_values.py,
+# etc) into chunks of item UUIDs that can be reindexed in Discovery one by one
+# instead of doing a full `index-discovery -b`. For example:
+#
+#   $ ./reindex_changed_items.py -j changed-items.txt -o ~/reindex-2024-01-31 --clear
+#   $ for chunk in ~/reindex-2024-01-31/*.txt; do
+#       xargs -n1 ~/dspace/bin/dspace index-discovery -i < "$chunk"
+#     done
+#
+# Each chunk can be run separately, for example to spread the reindexing over
+# a few nights or run a few chunks in parallel.
+#
+# The output directory must be new or empty, so chunks from an earlier run are
+# never overwritten or mixed up with the new ones. Only use --clear when the
+# chunks are written somewhere they will be kept until they are reindexed (not
+# /tmp if the server could reboot first), because the journal no longer has the
+# items after that.
+#
+# This script is written for Python 3 and requires several modules that you can
+# install with pip (I recommend setting up a Python virtual environment first):
+#
+#   $ pip install colorama
+#
+
+import argparse
+import os
+import signal
+import sys
+
+import util
+from colorama import Fore
+
+
+def signal_handler(signal, frame):
+    sys.exit(1)
+
+
+parser = argparse.ArgumentParser(
+    description="Split the journal of changed items into chunks for reindexing in Discovery."
+)
+parser.add_argument(
+    "-j",
+    "--change-journal",
+    help="Path to the journal of changed items (default changed-items.txt).",
+    default="changed-items.txt",
+)
+parser.add_argument(
+    "-o",
+    "--output-directory",
+    help="Directory to write the chunks to, which must be new or empty.",
+    required=True,
+)
+parser.add_argument(
+    "-s",
+    "--chunk-size",
+    help="Number of items per chunk (default 500).",
+    type=int,
+    default=500,
+)
+parser.add_argument(
+    "--clear",
+    help="Clear the journal after writing the chunks. Make sure you keep the chunks until they are reindexed!",
+    action="store_true",
+)
+parser.add_argument(
+    "-q",
+    "--quiet",
+    help="Do not print progress messages to the screen.",
+    action="store_true",
+)
+args = parser.parse_args()
+
+# set the signal handler for SIGINT (^C)
+signal.signal(signal.SIGINT, signal_handler)
+
+change_journal = util.ChangeJournal(args.change_journal)
+items = list(change_journal.items)
+
+if not items:
+    if not args.quiet:
+        sys.stdout.write(
+            f"{Fore.YELLOW}No changed items in {args.change_journal}.{Fore.RESET}\n"
+        )
+
+    sys.exit(0)
+
+# Don't overwrite the chunks of an earlier run that might not be reindexed yet,
+# or leave them around to be reindexed along with the new ones
+if os.path.isdir(args.output_directory) and os.listdir(args.output_directory):
+    sys.stderr.write(
+        f"{Fore.RED}Output directory {args.output_directory} is not empty.{Fore.RESET}\n"
+    )
+
+    sys.exit(1)
+
+os.makedirs(args.output_directory, exist_ok=True)
+
+for chunk_number, start in enumerate(range(0, len(items), args.chunk_size), 1):
+    filename = os.path.join(
+        args.output_directory, f"changed-items-{chunk_number:04d}.txt"
+    )
+
+    with open(filename, "w") as f:
+        for item in items[start : start + args.chunk_size]:
+            f.write(f"{item}\n")
+
+    if not args.quiet:
+        sys.stdout.write(f"{Fore.GREEN}Wrote {filename}{Fore.RESET}\n")
+
+# The chunks are written, so the items don't need to be in the journal anymore
+if args.clear:
+    change_journal.clear()
+
+if not args.quiet:
+    sys.stdout.write(
+        f"{Fore.GREEN}Wrote {len(items)} items to {chunk_number} chunks.{Fore.RESET}\n"
+    )
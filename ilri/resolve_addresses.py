@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# resolve-addresses.py 0.4.1
+# resolve-addresses.py 0.5.0
 #
 # Copyright Alan Orth.
 #
@@ -24,10 +24,9 @@ import csv
 import ipaddress
 import signal
 import sys
-from datetime import timedelta
 
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 
@@ -73,14 +72,6 @@ def resolve_addresses(addresses):
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
-    # enable transparent request cache with thirty-day expiry
-    expire_after = timedelta(days=30)
-    # cache HTTP 200 responses
-    requests_cache.install_cache("requests-cache", expire_after=expire_after)
-
-    # prune old cache entries
-    requests_cache.delete()
-
     # iterate through our addresses
     for address in addresses:
         print(f"Looking up {address} in IPAPI")
@@ -88,7 +79,7 @@ def resolve_addresses(addresses):
         # build IPAPI request URL for current address
         request_url = f"https://ipapi.co/{address}/json"
 
-        request = requests.get(request_url)
+        request = http.get(request_url)
 
         if args.debug and request.from_cache:
             sys.stderr.write(Fore.GREEN + "Request in cache.\n" + Fore.RESET)
@@ -117,7 +108,7 @@ def resolve_addresses(addresses):
                 request_headers = {"Key": args.abuseipdb_api_key}
                 request_params = {"ipAddress": address, "maxAgeInDays": 90}
 
-                request = requests.get(
+                request = http.get(
                     request_url, headers=request_headers, params=request_params
                 )
 
@@ -193,6 +184,9 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
+# Shared HTTP client so we reuse connections between requests
+http = util.HttpClient()
+
 read_addresses_from_file()
 
 exit()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# resolve-addresses-geoip2.py 0.0.2
+# resolve-addresses-geoip2.py 0.1.0
 #
 # Copyright Alan Orth.
 #
@@ -28,11 +28,10 @@ import csv
 import ipaddress
 import signal
 import sys
-from datetime import timedelta
 
 import geoip2.database
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 
@@ -93,18 +92,6 @@ def resolve_addresses(addresses):
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
-    # enable transparent request cache with thirty-day expiry
-    expire_after = timedelta(days=30)
-    # cache HTTP 200 responses
-    requests_cache.install_cache(
-        "requests-cache",
-        expire_after=expire_after,
-        allowable_codes=(200, 404),
-    )
-
-    # prune old cache entries
-    requests_cache.delete()
-
     # iterate through our addresses
     for address in addresses:
         print(f"Looking up {address} in GeoIP2")
@@ -151,7 +138,7 @@ def resolve_addresses(addresses):
             request_url = f"https://api.greynoise.io/v3/community/{address}"
             request_headers = {"Accept": "application/json"}
 
-            request = requests.get(request_url, headers=request_headers)
+            request = http.get(request_url, headers=request_headers)
 
             if args.debug and request.from_cache:
                 sys.stderr.write(Fore.GREEN + "→ Request in cache.\n" + Fore.RESET)
@@ -178,7 +165,7 @@ def resolve_addresses(addresses):
             request_headers = {"Key": args.abuseipdb_api_key}
             request_params = {"ipAddress": address, "maxAgeInDays": 90}
 
-            request = requests.get(
+            request = http.get(
                 request_url, headers=request_headers, params=request_params
             )
 
@@ -241,6 +228,9 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
+# Shared HTTP client so we reuse connections between requests
+http = util.HttpClient()
+
 read_addresses_from_file()
 
 exit()
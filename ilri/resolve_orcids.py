@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# resolve-orcids.py 1.2.3
+# resolve-orcids.py 1.4.1
 #
 # Copyright Alan Orth.
 #
@@ -12,6 +12,11 @@
 # read from a text file or DSpace authority Solr core. Text file should have
 # one ORCID identifier per line (comments and invalid lines are skipped).
 #
+# Several identifiers are looked up at the same time (see --concurrency) while
+# keeping to ORCID's rate limit for the public API. Names are written to the
+# output file as soon as they are resolved, or in the order of the identifiers
+# with --ordered.
+#
 # This script is written for Python 3 and requires several modules that you can
 # install with pip (I recommend setting up a Python virtual environment first):
 #
@@ -23,10 +28,10 @@ import logging
 import re
 import signal
 import sys
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 # Create a local logger instance
@@ -35,22 +40,25 @@ logger = logging.getLogger(__name__)
 
 # read ORCID identifiers from a text file, one per line
 def read_identifiers_from_file():
-    # initialize an empty list for ORCID iDs
+    # initialize an empty list for ORCID iDs, and a set so we can check if we
+    # have already seen one without searching the list
     orcids = []
+    seen = set()
+
+    # regular expression for matching exactly one ORCID identifier on a line
+    pattern = re.compile(r"^[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}$")
 
     for line in args.input_file:
         # trim any leading or trailing whitespace (including newlines)
         line = line.strip()
 
-        # regular expression for matching exactly one ORCID identifier on a line
-        pattern = re.compile(r"^[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}$")
-
         # skip the line if it doesn't match the pattern
         if not pattern.match(line):
             continue
 
-        # iterate over results and add ORCID iDs that aren't already in the list
-        if line not in orcids:
+        # iterate over results and add ORCID iDs that we haven't seen yet
+        if line not in seen:
+            seen.add(line)
             orcids.append(line)
 
     # close input file before we exit
@@ -61,28 +69,25 @@ def read_identifiers_from_file():
 
 # query DSpace's authority Solr core for ORCID identifiers
 def read_identifiers_from_solr():
-    # simple query from the 'authority' collection 2000 rows at a time (default is 1000)
-    solr_query_params = {"q": "orcid_id:*", "wt": "json", "rows": 2000}
-
-    solr_url = args.solr_url + "/authority/select"
-
-    res = requests.get(solr_url, params=solr_query_params)
+    # initialize an empty list for ORCID iDs, and a set so we can check if we
+    # have already seen one without searching the list
+    orcids = []
+    seen = set()
 
-    numFound = res.json()["response"]["numFound"]
-    logger.debug(
-        Fore.GREEN
-        + f"Total number of Solr records with ORCID iDs: {numFound}"
-        + Fore.RESET
+    # page through all the records in the 'authority' core, only fetching the
+    # fields we need
+    docs = util.solr_documents(
+        args.solr_url, "authority", "orcid_id:*", ["id", "orcid_id"]
     )
 
-    # initialize an empty list for ORCID iDs
-    orcids = []
-
-    docs = res.json()["response"]["docs"]
-    # iterate over results and add ORCID iDs that aren't already in the list
+    # iterate over results and add ORCID iDs that we haven't seen yet
     # for example, we had 1600 ORCID iDs in Solr, but only 600 are unique
+    num_found = 0
     for doc in docs:
-        if doc["orcid_id"] not in orcids:
+        num_found += 1
+
+        if doc["orcid_id"] not in seen:
+            seen.add(doc["orcid_id"])
             orcids.append(doc["orcid_id"])
 
             # if the user requested --extract-only, write the current ORCID iD to output_file
@@ -90,6 +95,12 @@ def read_identifiers_from_solr():
                 line = doc["orcid_id"] + "\n"
                 args.output_file.write(line)
 
+    logger.debug(
+        Fore.GREEN
+        + f"Total number of Solr records with ORCID iDs: {num_found}"
+        + Fore.RESET
+    )
+
     # exit now if the user requested --extract-only
     if args.extract_only:
         orcids_extracted = str(len(orcids))
@@ -105,9 +116,8 @@ def read_identifiers_from_solr():
     resolve_orcid_identifiers(orcids)
 
 
-# Query ORCID's public API for names associated with identifiers. Prefers to use
-# the "credit-name" field if it is present, otherwise will default to using the
-# "given-names" and "family-name" fields.
+# Query ORCID's public API for names associated with identifiers, several at a
+# time, and write them to the output file as they come in.
 def resolve_orcid_identifiers(orcids):
     unique_orcids = str(len(orcids))
     logger.debug(
@@ -116,132 +126,165 @@ def resolve_orcid_identifiers(orcids):
         + Fore.RESET
     )
 
+    if args.ordered:
+        # map() returns results in the same order as the identifiers
+        lines = executor.map(resolve_orcid_identifier, orcids)
+    else:
+        futures = [executor.submit(resolve_orcid_identifier, orcid) for orcid in orcids]
+        lines = (future.result() for future in as_completed(futures))
+
+    try:
+        for line in lines:
+            if line is None:
+                continue
+
+            if not args.quiet:
+                logger.info(line)
+
+            # write formatted name and ORCID identifier to output file, and
+            # flush it so the results are there even if we get interrupted
+            args.output_file.write(f"{line}\n")
+            args.output_file.flush()
+    except requests.exceptions.RequestException as e:
+        logger.error(Fore.RED + f"Request failed: {e}" + Fore.RESET)
+        # don't start looking up any more identifiers
+        executor.shutdown(wait=False, cancel_futures=True)
+        # close output file before we exit
+        args.output_file.close()
+        sys.exit(1)
+
+    executor.shutdown()
+
+    # close output file before we exit
+    args.output_file.close()
+
+
+# Query ORCID's public API for the name associated with one identifier. Prefers
+# to use the "credit-name" field if it is present, otherwise will default to
+# using the "given-names" and "family-name" fields. Returns a line with the name
+# and identifier, or None if the identifier has no usable name.
+def resolve_orcid_identifier(orcid):
+    logger.debug(
+        Fore.GREEN
+        + f"Looking up the names associated with ORCID iD: {orcid}"
+        + Fore.RESET
+    )
+
     # ORCID API endpoint, see: https://pub.orcid.org
     orcid_api_base_url = "https://pub.orcid.org/v2.1/"
     orcid_api_endpoint = "/person"
 
-    # enable transparent request cache with thirty-day expiry
-    expire_after = timedelta(days=30)
-    # cache HTTP 200 and 404 responses, because ORCID uses HTTP 404 when an identifier doesn't exist
-    requests_cache.install_cache(
-        "requests-cache", expire_after=expire_after, allowable_codes=(200, 404)
-    )
+    # build request URL for current ORCID ID
+    request_url = orcid_api_base_url + orcid.strip() + orcid_api_endpoint
 
-    # prune old cache entries
-    requests_cache.delete()
+    # ORCID's API defaults to some custom format, so tell it to give us JSON
+    request = http.get(request_url, headers={"Accept": "application/json"})
 
-    # iterate through our ORCID iDs and fetch their names from the ORCID API
-    for orcid in orcids:
+    # HTTP 404 means that the API url or identifier was not found. If the
+    # API URL is correct, let's assume that the identifier was not found.
+    if request.status_code == 404:
         logger.debug(
-            Fore.GREEN
-            + f"Looking up the names associated with ORCID iD: {orcid}"
+            Fore.YELLOW
+            + f"Skipping missing identifier {orcid} (API request returned HTTP 404)."
+            + Fore.RESET
+        )
+
+        return None
+    # HTTP 409 means that the identifier is locked for some reason
+    # See: https://members.orcid.org/api/resources/error-codes
+    elif request.status_code == 409:
+        logger.debug(
+            Fore.YELLOW
+            + f"Skipping locked identifier {orcid} (API request returned HTTP 409)."
+            + Fore.RESET
+        )
+
+        return None
+
+    # anything else besides HTTP 200 is an error
+    request.raise_for_status()
+
+    # The API sometimes returns JSON without the elements we expect, which
+    # should only skip this identifier rather than stop the whole run
+    try:
+        line = get_name(orcid, request.json())
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(
+            Fore.RED
+            + f"Skipping identifier {orcid} with unexpected API response: {e!r}"
+            + Fore.RESET
+        )
+
+        return None
+
+    if line is None:
+        return None
+
+    return "{0}: {1}".format(line, orcid)
+
+
+# Get the name from the JSON of an ORCID /person request. Returns None if the
+# identifier has no usable name.
+def get_name(orcid, data):
+    # make sure name element is not null
+    if not data["name"]:
+        logger.debug(
+            Fore.YELLOW
+            + f"Skipping identifier {orcid} with null name element."
             + Fore.RESET
         )
 
-        # build request URL for current ORCID ID
-        request_url = orcid_api_base_url + orcid.strip() + orcid_api_endpoint
-
-        # ORCID's API defaults to some custom format, so tell it to give us JSON
-        request = requests.get(request_url, headers={"Accept": "application/json"})
-
-        # Check the request status
-        if request.status_code == requests.codes.ok:
-            # read response JSON into data
-            data = request.json()
-
-            # make sure name element is not null
-            if data["name"]:
-                # prefer to use credit-name if present and not blank
-                if (
-                    data["name"]["credit-name"]
-                    and data["name"]["credit-name"]["value"] != ""
-                ):
-                    line = data["name"]["credit-name"]["value"]
-                # otherwise try to use given-names and or family-name
-                else:
-                    # make sure given-names is present and not deactivated
-                    if (
-                        data["name"]["given-names"]
-                        and data["name"]["given-names"]["value"]
-                        != "Given Names Deactivated"
-                    ):
-                        line = data["name"]["given-names"]["value"]
-                    else:
-                        logger.debug(
-                            Fore.YELLOW
-                            + "Ignoring null or deactivated given-names element."
-                            + Fore.RESET
-                        )
-                    # make sure family-name is present and not deactivated
-                    if (
-                        data["name"]["family-name"]
-                        and data["name"]["family-name"]["value"]
-                        != "Family Name Deactivated"
-                    ):
-                        line = f'{line} {data["name"]["family-name"]["value"]}'
-                    else:
-                        logger.debug(
-                            Fore.YELLOW
-                            + "Ignoring null or deactivated family-name element."
-                            + Fore.RESET
-                        )
-                # check if line has something (a credit-name, given-names, and or family-name)
-                if line and line != "":
-                    line = "{0}: {1}".format(line.strip(), orcid)
-                else:
-                    logger.debug(
-                        Fore.RED
-                        + "Skipping identifier with no valid name elements."
-                        + Fore.RESET
-                    )
-
-                    continue
-
-                if not args.quiet:
-                    logger.info(line)
-
-                # write formatted name and ORCID identifier to output file
-                args.output_file.write(f"{line}\n")
-
-                # clear line for next iteration
-                line = None
-            else:
-                logger.debug(
-                    Fore.YELLOW
-                    + "Skipping identifier with null name element."
-                    + Fore.RESET
-                )
-        # HTTP 404 means that the API url or identifier was not found. If the
-        # API URL is correct, let's assume that the identifier was not found.
-        elif request.status_code == 404:
+        return None
+
+    line = None
+
+    # prefer to use credit-name if present and not blank
+    if data["name"]["credit-name"] and data["name"]["credit-name"]["value"] != "":
+        line = data["name"]["credit-name"]["value"]
+    # otherwise try to use given-names and or family-name
+    else:
+        # make sure given-names is present and not deactivated
+        if (
+            data["name"]["given-names"]
+            and data["name"]["given-names"]["value"] != "Given Names Deactivated"
+        ):
+            line = data["name"]["given-names"]["value"]
+        else:
             logger.debug(
                 Fore.YELLOW
-                + "Skipping missing identifier (API request returned HTTP 404)."
+                + "Ignoring null or deactivated given-names element."
                 + Fore.RESET
             )
-
-            continue
-        # HTTP 409 means that the identifier is locked for some reason
-        # See: https://members.orcid.org/api/resources/error-codes
-        elif request.status_code == 409:
+        # make sure family-name is present and not deactivated
+        if (
+            data["name"]["family-name"]
+            and data["name"]["family-name"]["value"] != "Family Name Deactivated"
+        ):
+            line = f'{line or ""} {data["name"]["family-name"]["value"]}'
+        else:
             logger.debug(
                 Fore.YELLOW
-                + "Skipping locked identifier (API request returned HTTP 409)."
+                + "Ignoring null or deactivated family-name element."
                 + Fore.RESET
             )
 
-            continue
-        else:
-            logger.error(Fore.RED + "Request failed." + Fore.RESET)
-            # close output file before we exit
-            args.output_file.close()
-            sys.exit(1)
+    # check if line has something (a credit-name, given-names, and or family-name)
+    if not line or line.strip() == "":
+        logger.debug(
+            Fore.RED
+            + f"Skipping identifier {orcid} with no valid name elements."
+            + Fore.RESET
+        )
 
-    # close output file before we exit
-    args.output_file.close()
+        return None
+
+    return line.strip()
 
 
 def signal_handler(signal, frame):
+    # don't start looking up any more identifiers
+    executor.shutdown(wait=False, cancel_futures=True)
+
     # close output file before we exit
     args.output_file.close()
 
@@ -251,6 +294,13 @@ def signal_handler(signal, frame):
 parser = argparse.ArgumentParser(
     description='Query the public ORCID API for names associated with a list of ORCID identifiers, either from a text file or a DSpace authority Solr core. Optional "extract only" mode will simply fetch the ORCID identifiers from Solr and write them to the output file without resolving their names from ORCID\'s API.'
 )
+parser.add_argument(
+    "-c",
+    "--concurrency",
+    help="Number of ORCID identifiers to look up at the same time (default 10).",
+    type=int,
+    default=10,
+)
 parser.add_argument(
     "-d",
     "--debug",
@@ -270,6 +320,11 @@ parser.add_argument(
     required=True,
     type=argparse.FileType("w", encoding="UTF-8"),
 )
+parser.add_argument(
+    "--ordered",
+    help="Write names in the same order as the ORCID identifiers instead of as soon as they are resolved.",
+    action="store_true",
+)
 parser.add_argument(
     "-q",
     "--quiet",
@@ -303,6 +358,15 @@ logging.basicConfig(format="[%(levelname)s] %(message)s")
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
+# Shared HTTP client so we reuse connections between requests. ORCID allows 24
+# requests per second on the public API.
+#
+# See: https://info.orcid.org/ufaqs/what-are-the-api-limits/
+http = util.HttpClient(concurrency=args.concurrency)
+http.limit_host("pub.orcid.org", rate=24)
+
+executor = ThreadPoolExecutor(max_workers=args.concurrency)
+
 # if the user specified an input file, get the ORCID identifiers from there
 if args.input_file:
     read_identifiers_from_file()
@@ -0,0 +1,509 @@
+# ror_index.py v0.1.0
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper class for matching organizations against a local index of the
+# Research Organization Registry (ROR) data dump. The dump is a large JSON file
+# (or a zip file with the JSON inside) with one record per organization, in
+# either the v1 or v2 schema.
+#
+# The dump is read once, one record at a time, and the names, aliases, labels,
+# and acronyms of each organization are saved in an SQLite database. Lookups
+# are exact matches on the case-folded label first, and then optionally fuzzy
+# matches: labels are normalized (accents and punctuation removed, stopwords
+# dropped), candidates are the labels that share the most words, and scored by
+# how many character trigrams they have in common with the organization.
+#
+# The index remembers which version of the dump it has. When there is a new
+# release, only the records that were added, changed, withdrawn, or removed are
+# updated, which is much faster than indexing the whole dump again.
+#
+# See: https://ror.readme.io/docs/data-dump
+#
+
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import unicodedata
+import zipfile
+
+# Version of the index schema, so we know when to rebuild an old index
+schema_version = 2
+
+# Size of the memory map for the index, in bytes
+mmap_size = 256 * 1024 * 1024
+
+# Match types in the order we prefer them
+match_types = ["name", "alias", "acronym", "label"]
+
+# Words that don't help to tell organizations apart
+stopwords = {
+    "and",
+    "at",
+    "da",
+    "de",
+    "del",
+    "der",
+    "des",
+    "di",
+    "du",
+    "e",
+    "et",
+    "for",
+    "in",
+    "la",
+    "le",
+    "of",
+    "on",
+    "the",
+    "und",
+    "y",
+}
+
+
+def normalize_label(label: str) -> str:
+    """Normalize a label for fuzzy matching.
+
+    Removes accents and punctuation, case folds, and drops stopwords, so that
+    "Université de Montréal" and "Universite Montreal" are the same.
+
+    :param label: the label.
+    :returns str
+    """
+
+    label = unicodedata.normalize("NFKD", label)
+    label = "".join(c for c in label if not unicodedata.combining(c)).casefold()
+
+    words = re.findall(r"\w+", label)
+
+    return " ".join(word for word in words if word not in stopwords)
+
+
+def trigrams(normalized: str) -> set:
+    """Return the character trigrams of a normalized label.
+
+    :param normalized: a label from normalize_label().
+    :returns set
+    """
+
+    padded = f"  {normalized} "
+
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_score(a: set, b: set) -> float:
+    """Return how similar two sets of trigrams are, from 0 to 1.
+
+    :param a: set of trigrams.
+    :param b: set of trigrams.
+    :returns float
+    """
+
+    if not a or not b:
+        return 0.0
+
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def read_json_array(f, chunk_size: int = 1024 * 1024):
+    """Yield the items of a JSON array one at a time.
+
+    Only one item and a chunk of the file are in memory at any time.
+
+    :param f: the file, opened in text mode.
+    :param chunk_size: number of characters to read at a time.
+    :returns iterator
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+
+    while True:
+        chunk = f.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+
+        while True:
+            # Skip whitespace and the punctuation between items
+            while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+                if buffer[position] == "[":
+                    started = True
+
+                position += 1
+
+            if position == len(buffer) or not started:
+                break
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item continues in the next chunk
+                if not chunk:
+                    raise
+
+                break
+
+            yield item
+
+            position = end
+
+        if not chunk:
+            return
+
+
+def read_ror_dump(dump_filename: str):
+    """Yield the records in a ROR data dump.
+
+    :param dump_filename: path to the dump, either the JSON file or the zip
+    file it comes in.
+    :returns iterator of dicts
+    """
+
+    if zipfile.is_zipfile(dump_filename):
+        with zipfile.ZipFile(dump_filename) as z:
+            members = [name for name in z.namelist() if name.endswith(".json")]
+
+            # Recent dumps have the records in both schemas, so prefer v2
+            members.sort(key=lambda name: "schema_v2" not in name)
+
+            with io.TextIOWrapper(z.open(members[0]), encoding="UTF-8") as f:
+                yield from read_json_array(f)
+    else:
+        with open(dump_filename, encoding="UTF-8") as f:
+            yield from read_json_array(f)
+
+
+def ror_record_labels(record: dict):
+    """Yield the labels of a ROR record and their match types.
+
+    Handles records in both the v1 and v2 schemas.
+
+    :param record: the ROR record.
+    :returns iterator of (label, match type) tuples
+    """
+
+    # v2 has a list of names with their types
+    if "names" in record:
+        for name in record["names"]:
+            if "ror_display" in name["types"]:
+                yield name["value"], "name"
+            if "alias" in name["types"]:
+                yield name["value"], "alias"
+            if "acronym" in name["types"]:
+                yield name["value"], "acronym"
+            if "label" in name["types"]:
+                yield name["value"], "label"
+    else:
+        yield record["name"], "name"
+
+        for alias in record.get("aliases", []):
+            yield alias, "alias"
+        for acronym in record.get("acronyms", []):
+            yield acronym, "acronym"
+        for label in record.get("labels", []):
+            yield label["label"], "label"
+
+
+def ror_record_name(record: dict) -> str:
+    """Return the display name of a ROR record.
+
+    :param record: the ROR record.
+    :returns str
+    """
+
+    for label, match_type in ror_record_labels(record):
+        if match_type == "name":
+            return label
+
+    return ""
+
+
+def ror_dump_version(dump_filename: str) -> str:
+    """Return the version of a ROR data dump from its file name.
+
+    Dumps are named like "v1.40-2024-02-21-ror-data.zip". If the file was
+    renamed then we use its name, size, and modification time instead.
+
+    :param dump_filename: path to the dump.
+    :returns str
+    """
+
+    filename = os.path.basename(dump_filename)
+
+    match = re.match(r"v\d+(\.\d+)*-\d{4}-\d{2}-\d{2}", filename)
+    if match:
+        return match.group(0)
+
+    stat = os.stat(dump_filename)
+
+    return f"{filename} {stat.st_size} {stat.st_mtime}"
+
+
+def ror_record_hash(record: dict) -> str:
+    """Return a hash of a ROR record, to see if it changed between dumps.
+
+    :param record: the ROR record.
+    :returns str
+    """
+
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode("UTF-8")).hexdigest()
+
+
+class RorIndex:
+    """An index of ROR organizations in an SQLite database."""
+
+    def __init__(self, index_filename: str):
+        """Open the index, creating an empty one if needed.
+
+        :param index_filename: path to the SQLite database with the index.
+        """
+
+        self.db = sqlite3.connect(index_filename)
+
+        # Reading the index through a memory map is faster than read() calls
+        self.db.execute(f"PRAGMA mmap_size={mmap_size}")
+
+        # The index can be rebuilt from the dump, so just start again if it is
+        # from an older version of this script
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+            with self.db:
+                for table in ("dump", "words", "labels", "organizations"):
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+
+                self.db.execute(f"PRAGMA user_version={schema_version}")
+
+        self.db.execute("CREATE TABLE IF NOT EXISTS dump (version TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS organizations (ror_id TEXT PRIMARY KEY, name TEXT NOT NULL, status TEXT NOT NULL, hash TEXT NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS labels (label_id INTEGER PRIMARY KEY, ror_id TEXT NOT NULL, type TEXT NOT NULL, label TEXT NOT NULL, normalized TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS labels_label ON labels (label)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS labels_normalized ON labels (normalized)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS labels_ror_id ON labels (ror_id)")
+        # Words of the normalized labels, to find candidates for fuzzy matching
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS words (word TEXT NOT NULL, label_id INTEGER NOT NULL, PRIMARY KEY (word, label_id)) WITHOUT ROWID"
+        )
+        # So we can remove the words of organizations that changed
+        self.db.execute("CREATE INDEX IF NOT EXISTS words_label_id ON words (label_id)")
+
+    @property
+    def version(self) -> str | None:
+        """The version of the dump in the index, or None if it is empty."""
+
+        result = self.db.execute("SELECT version FROM dump").fetchone()
+
+        return result[0] if result else None
+
+    def update(self, dump_filename: str) -> dict:
+        """Update the index to a ROR data dump.
+
+        Only records that are new or have changed since the dump that is in
+        the index are indexed. Records that were withdrawn or are no longer in
+        the dump can't be matched anymore.
+
+        :param dump_filename: path to the dump (JSON or zip).
+        :returns dict with the number of records added, changed, withdrawn,
+        and removed.
+        """
+
+        counts = {"added": 0, "changed": 0, "withdrawn": 0, "removed": 0}
+
+        # ror_id → hash of the records we have now
+        hashes = dict(self.db.execute("SELECT ror_id, hash FROM organizations"))
+
+        # Only commit when the whole dump is indexed, so an interrupted run
+        # doesn't leave us with half an index
+        with self.db:
+            for record in read_ror_dump(dump_filename):
+                ror_id = record["id"]
+                record_hash = ror_record_hash(record)
+
+                old_hash = hashes.pop(ror_id, None)
+
+                if old_hash == record_hash:
+                    continue
+
+                if old_hash is not None:
+                    self.remove_record(ror_id)
+
+                if record.get("status") == "withdrawn":
+                    counts["withdrawn"] += 1
+                elif old_hash is None:
+                    counts["added"] += 1
+                else:
+                    counts["changed"] += 1
+
+                self.add_record(record, record_hash)
+
+            # Anything left wasn't in the new dump at all
+            for ror_id in hashes:
+                self.remove_record(ror_id)
+
+                counts["removed"] += 1
+
+            self.db.execute("DELETE FROM dump")
+            self.db.execute(
+                "INSERT INTO dump (version) VALUES (?)",
+                (ror_dump_version(dump_filename),),
+            )
+
+        return counts
+
+    def remove_record(self, ror_id: str):
+        """Remove an organization and its labels from the index.
+
+        :param ror_id: the ROR id of the organization.
+        """
+
+        self.db.execute(
+            "DELETE FROM words WHERE label_id IN (SELECT label_id FROM labels WHERE ror_id=?)",
+            (ror_id,),
+        )
+        self.db.execute("DELETE FROM labels WHERE ror_id=?", (ror_id,))
+        self.db.execute("DELETE FROM organizations WHERE ror_id=?", (ror_id,))
+
+    def add_record(self, record: dict, record_hash: str):
+        """Add an organization and its labels to the index.
+
+        Withdrawn organizations are added without their labels, so we know
+        about them but they don't match anything.
+
+        :param record: the ROR record.
+        :param record_hash: the hash of the record from ror_record_hash().
+        """
+
+        ror_id = record["id"]
+        status = record.get("status", "active")
+
+        self.db.execute(
+            "INSERT INTO organizations (ror_id, name, status, hash) VALUES (?, ?, ?, ?)",
+            (ror_id, ror_record_name(record), status, record_hash),
+        )
+
+        if status == "withdrawn":
+            return
+
+        for label, match_type in ror_record_labels(record):
+            normalized = normalize_label(label)
+
+            label_id = self.db.execute(
+                "INSERT INTO labels (ror_id, type, label, normalized) VALUES (?, ?, ?, ?)",
+                (ror_id, match_type, label.casefold(), normalized),
+            ).lastrowid
+
+            self.db.executemany(
+                "INSERT OR IGNORE INTO words (word, label_id) VALUES (?, ?)",
+                ((word, label_id) for word in set(normalized.split())),
+            )
+
+    def get(self, ror_id: str) -> tuple | None:
+        """Return the name and status of an organization.
+
+        :param ror_id: the ROR id, for example "https://ror.org/01jxjwb74".
+        :returns (name, status) tuple, or None
+        """
+
+        return self.db.execute(
+            "SELECT name, status FROM organizations WHERE ror_id=?", (ror_id,)
+        ).fetchone()
+
+    def search(self, organization: str) -> tuple | None:
+        """Find an exact match for an organization, ignoring case.
+
+        :param organization: the organization, for example "ILRI".
+        :returns (ROR id, match type) tuple, or None
+        """
+
+        matches = self.db.execute(
+            "SELECT ror_id, type FROM labels WHERE label=?",
+            (organization.casefold(),),
+        ).fetchall()
+
+        if not matches:
+            return None
+
+        return min(matches, key=lambda match: match_types.index(match[1]))
+
+    def fuzzy_search(
+        self, organization: str, threshold: float = 0.8, candidates: int = 5000
+    ) -> tuple | None:
+        """Find the most similar label for an organization.
+
+        :param organization: the organization.
+        :param threshold: minimum score for a match, from 0 to 1.
+        :param candidates: maximum number of labels to score.
+        :returns (ROR id, match type, score) tuple, or None
+        """
+
+        normalized = normalize_label(organization)
+
+        if not normalized:
+            return None
+
+        # Labels that are the same after normalizing are a perfect match
+        matches = self.db.execute(
+            "SELECT ror_id, type FROM labels WHERE normalized=?", (normalized,)
+        ).fetchall()
+
+        if matches:
+            ror_id, match_type = min(
+                matches, key=lambda match: match_types.index(match[1])
+            )
+
+            return ror_id, match_type, 1.0
+
+        # Otherwise score the labels that share the most words with ours. A
+        # word like "university" is shared with lots of labels, but those only
+        # fill up the candidates after the ones that share more words.
+        words = sorted(set(normalized.split()))
+        placeholders = ", ".join("?" * len(words))
+
+        organization_trigrams = trigrams(normalized)
+        best = None
+
+        for ror_id, match_type, label in self.db.execute(
+            f"""
+            SELECT L.ror_id, L.type, L.normalized
+            FROM (
+                SELECT label_id, COUNT(*) AS shared FROM words
+                WHERE word IN ({placeholders})
+                GROUP BY label_id
+                ORDER BY shared DESC, label_id
+                LIMIT ?
+            ) W
+            JOIN labels L USING (label_id)
+            """,
+            (*words, candidates),
+        ):
+            score = trigram_score(organization_trigrams, trigrams(label))
+
+            if score < threshold:
+                continue
+
+            # Break ties by the match type and then the ROR ID, so the result
+            # doesn't depend on the order of the rows
+            key = (-score, match_types.index(match_type), ror_id)
+
+            if best is None or key < best[0]:
+                best = (key, (ror_id, match_type, score))
+
+        return best[1] if best else None
+
+    def close(self):
+        """Close the index."""
+
+        self.db.close()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# ror-lookup.py 0.1.1
+# ror-lookup.py 0.3.1
 #
 # Copyright Alan Orth.
 #
@@ -12,6 +12,15 @@
 # from a text file. Text file should have one organization per line. Results
 # are saved to a CSV including the organization and whether it matched or not.
 #
+# The ROR data dump is indexed the first time it is used (see ror_index.py), so
+# after that lookups don't need to read the dump at all. When there is a new
+# release of the dump, only the records that changed are updated.
+#
+# Organizations that do not match a name, alias, acronym, or label exactly can
+# optionally be matched fuzzily (see --fuzzy), in which case the CSV includes
+# the score. Exact matches are made by validation.RorBackend, which is shared
+# with validate_metadata.py.
+#
 # This script is written for Python 3.6+ and requires several modules that you
 # can install with pip (I recommend using a Python virtual environment):
 #
@@ -20,12 +29,13 @@
 
 import argparse
 import csv
-import json
 import logging
 import signal
 import sys
 
+import validation
 from colorama import Fore
+from ror_index import RorIndex, ror_dump_version
 
 # Create a local logger instance
 logger = logging.getLogger(__name__)
@@ -35,15 +45,18 @@ logging.basicConfig(format="[%(levelname)s] %(message)s")
 
 # read organizations from a text file, one per line
 def read_organizations_from_file():
-    # initialize an empty list for organization
+    # initialize an empty list for organization, and a set so we can check if
+    # we have already seen one without searching the list
     organizations = []
+    seen = set()
 
     for line in args.input_file:
         # trim any leading or trailing whitespace (including newlines)
         line = line.strip()
 
         # iterate over results and add organization that aren't already present
-        if line not in organizations:
+        if line not in seen:
+            seen.add(line)
             organizations.append(line)
 
     # close input file before we exit
@@ -53,7 +66,7 @@ def read_organizations_from_file():
 
 
 def resolve_organizations(organizations):
-    fieldnames = ["organization", "match type", "matched"]
+    fieldnames = ["organization", "match type", "matched", "ror id", "score"]
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
@@ -61,52 +74,48 @@ def resolve_organizations(organizations):
         logger.debug(f"Looking up the organization: {organization}")
 
         # check for exact match
-        if organization.lower() in ror_names:
-            logger.info(
-                f"{Fore.GREEN}Name match for {organization!r} in ROR{Fore.RESET}"
-            )
+        match = backend.lookup(organization)
+
+        if match is not None:
+            match_type, ror_id = match
+            score = 1.0
 
-            writer.writerow(
-                {
-                    "organization": organization,
-                    "match type": "name",
-                    "matched": "true",
-                }
-            )
-        elif organization.lower() in ror_aliases:
             logger.info(
-                f"{Fore.GREEN}Alias match for {organization!r} in ROR{Fore.RESET}"
+                f"{Fore.GREEN}{match_type.capitalize()} match for {organization!r} in ROR{Fore.RESET}"
             )
+        elif args.fuzzy:
+            match = index.fuzzy_search(organization, args.fuzzy_threshold)
 
-            writer.writerow(
-                {
-                    "organization": organization,
-                    "match type": "alias",
-                    "matched": "true",
-                }
-            )
-        elif organization.lower() in ror_acronyms:
-            logger.info(
-                f"{Fore.GREEN}Acronym match for {organization!r} in ROR{Fore.RESET}"
+            if match is not None:
+                ror_id, match_type, score = match
+                match_type = f"fuzzy {match_type}"
+
+                logger.info(
+                    f"{Fore.YELLOW}Fuzzy {match_type.split()[1]} match for {organization!r} in ROR: {ror_id} ({score:.2f}){Fore.RESET}"
+                )
+
+        if match is None:
+            logger.debug(
+                f"{Fore.YELLOW}No match for {organization!r} in ROR{Fore.RESET}"
             )
 
             writer.writerow(
                 {
                     "organization": organization,
-                    "match type": "acronym",
-                    "matched": "true",
+                    "match type": "",
+                    "matched": "false",
+                    "ror id": "",
+                    "score": "",
                 }
             )
         else:
-            logger.debug(
-                f"{Fore.YELLOW}No match for {organization!r} in ROR{Fore.RESET}"
-            )
-
             writer.writerow(
                 {
                     "organization": organization,
-                    "match type": "",
-                    "matched": "false",
+                    "match type": match_type,
+                    "matched": "true",
+                    "ror id": ror_id,
+                    "score": f"{score:.2f}",
                 }
             )
 
@@ -130,6 +139,18 @@ parser.add_argument(
     help="Set log level to DEBUG.",
     action="store_true",
 )
+parser.add_argument(
+    "-f",
+    "--fuzzy",
+    help="Match organizations fuzzily if there is no exact match.",
+    action="store_true",
+)
+parser.add_argument(
+    "--fuzzy-threshold",
+    help="Minimum score for a fuzzy match, from 0 to 1 (default 0.8).",
+    type=float,
+    default=0.8,
+)
 parser.add_argument(
     "-i",
     "--input-file",
@@ -140,9 +161,12 @@ parser.add_argument(
 parser.add_argument(
     "-r",
     "--ror-json",
-    help="ror.json file containing organizations to look up. See: https://doi.org/10.6084/m9.figshare.c.4596503.v5",
-    required=True,
-    type=argparse.FileType("r"),
+    help="ROR data dump (JSON or zip) containing organizations to look up, only needed the first time or when there is a new release. See: https://doi.org/10.5281/zenodo.6347574",
+)
+parser.add_argument(
+    "--index",
+    help="Path to the index of the ROR data dump (default ror-index.sqlite).",
+    default="ror-index.sqlite",
 )
 parser.add_argument(
     "-o",
@@ -162,32 +186,31 @@ if args.debug:
 else:
     logger.setLevel(logging.INFO)
 
-# if the user specified an input file, get the organizations from there
-if args.input_file and args.ror_json:
-    ror = json.load(args.ror_json)
-
-    # list comprehension instead of a for loop to extract all names
-    ror_names = [org["name"].lower() for org in ror]
-
-    # nested list comprehension to extract aliases, think of it like:
-    #     ror_aliases_all = []
-    #     for org in ror:
-    #         for alias in org['aliases']:
-    #             ror_aliases_all.append(alias)
-    #
-    # See: https://stackoverflow.com/questions/18072759/list-comprehension-on-a-nested-list
-    ror_aliases_all = [alias.lower() for org in ror for alias in org["aliases"]]
-    # dedupe the list by converting it to a dict and back to a list (dicts can't
-    # have any duplicate items)
-    ror_aliases = list(dict.fromkeys(ror_aliases_all))
-    # delete the list of all aliases
-    del ror_aliases_all
-
-    # same for acronyms
-    ror_acronyms_all = [acronym.lower() for org in ror for acronym in org["acronyms"]]
-    ror_acronyms = list(dict.fromkeys(ror_acronyms_all))
-    del ror_acronyms_all
+index = RorIndex(args.index)
+
+if not args.ror_json and index.version is None:
+    sys.stderr.write(
+        f"{Fore.RED}No ROR data in {args.index}, use --ror-json to add it.{Fore.RESET}\n"
+    )
+
+    sys.exit(1)
+
+# Update the index if this is a different version of the ROR data dump
+if args.ror_json and index.version != ror_dump_version(args.ror_json):
+    logger.info(
+        f"{Fore.GREEN}Updating ROR index from {index.version or 'nothing'} to {ror_dump_version(args.ror_json)}...{Fore.RESET}"
+    )
+
+    counts = index.update(args.ror_json)
 
+    logger.info(
+        f"{Fore.GREEN}Added {counts['added']}, changed {counts['changed']}, withdrew {counts['withdrawn']}, and removed {counts['removed']} organizations.{Fore.RESET}"
+    )
+
+backend = validation.RorBackend(index)
+
+# if the user specified an input file, get the organizations from there
+if args.input_file:
     read_organizations_from_file()
 
 exit()
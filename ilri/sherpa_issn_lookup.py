@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# sherpa-issn-lookup.py 0.0.1
+# sherpa-issn-lookup.py 0.1.0
 #
 # Copyright Alan Orth.
 #
@@ -23,10 +23,9 @@ import argparse
 import csv
 import signal
 import sys
-from datetime import timedelta
 
 import requests
-import requests_cache
+import util
 from colorama import Fore
 
 
@@ -54,13 +53,6 @@ def resolve_issns(issns):
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
-    # enable transparent request cache with two weeks expiry
-    expire_after = timedelta(days=14)
-    requests_cache.install_cache("requests-cache", expire_after=expire_after)
-
-    # prune old cache entries
-    requests_cache.delete()
-
     for issn in issns:
         if args.debug:
             sys.stderr.write(Fore.GREEN + f"Looking up ISSN: {issn}\n" + Fore.RESET)
@@ -74,12 +66,14 @@ def resolve_issns(issns):
         }
 
         try:
-            request = requests.get(request_url, params=request_params)
+            request = http.get(request_url, params=request_params)
 
             data = request.json()
         except requests.exceptions.ConnectionError:
             sys.stderr.write(Fore.RED + "Connection error.\n" + Fore.RESET)
 
+            sys.exit(1)
+
         # CrossRef responds 404 if a journal isn't found, so we check for an
         # HTTP 2xx response here
         if request.status_code == requests.codes.ok and len(data["items"]) == 1:
@@ -142,6 +136,9 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
+# Shared HTTP client so we reuse connections between requests
+http = util.HttpClient()
+
 # if the user specified an input file, get the ISSNs from there
 if args.input_file:
     read_issns_from_file()
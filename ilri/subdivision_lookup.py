@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# subdivision-lookup.py 0.0.1
+# subdivision-lookup.py 0.1.1
 #
 # Copyright Alan Orth.
 #
@@ -10,7 +10,14 @@
 #
 # Queries the pycountry ISO 3166-2 dataset for subdivisions read from a text
 # file. Text file should have one subdivision per line. Results are saved to
-# a CSV including the subdivision and whether it matched or not.
+# a CSV including the subdivision, whether it matched or not, its ISO 3166-2
+# code, and the ISO 3166-1 alpha-2 code of its country. Some names are used by
+# subdivisions in several countries, in which case all of them are included,
+# separated by "||".
+#
+# The subdivision names are indexed once per pycountry version (see iso3166_
+# index.py), and matching ignores case and accents. Subdivisions are matched by
+# validation.Iso3166SubdivisionBackend, which is shared with validate_metadata.py.
 #
 # This script is written for Python 3.6+ and requires several modules that you
 # can install with pip (I recommend using a Python virtual environment):
@@ -23,21 +30,25 @@ import csv
 import signal
 import sys
 
-import pycountry
+import validation
 from colorama import Fore
+from iso3166_index import Iso3166Index
 
 
 # read subdivisions from a text file, one per line
 def read_subdivisions_from_file():
-    # initialize an empty list for subdivisions
+    # initialize an empty list for subdivisions, and a set so we can check if
+    # we have already seen one without searching the list
     subdivisions = []
+    seen = set()
 
     for line in args.input_file:
         # trim any leading or trailing whitespace (including newlines)
         line = line.strip()
 
         # iterate over results and add subdivisions that aren't already present
-        if line not in subdivisions:
+        if line not in seen:
+            seen.add(line)
             subdivisions.append(line)
 
     # close input file before we exit
@@ -47,7 +58,7 @@ def read_subdivisions_from_file():
 
 
 def resolve_subdivisions(subdivisions):
-    fieldnames = ["subdivision", "matched"]
+    fieldnames = ["subdivision", "matched", "code", "cg.coverage.iso3166-1-alpha2"]
     writer = csv.DictWriter(args.output_file, fieldnames=fieldnames)
     writer.writeheader()
 
@@ -58,13 +69,22 @@ def resolve_subdivisions(subdivisions):
             )
 
         # check for exact match
-        if subdivision.lower() in subdivision_names:
+        match = backend.lookup(subdivision)
+
+        if match is not None:
+            match_type, codes = match
+
             print(f"Match for {subdivision!r}")
 
+            # ISO 3166-2 codes start with the alpha-2 code of the country
             writer.writerow(
                 {
                     "subdivision": subdivision,
                     "matched": "true",
+                    "code": codes,
+                    "cg.coverage.iso3166-1-alpha2": "||".join(
+                        dict.fromkeys(code.split("-")[0] for code in codes.split("||"))
+                    ),
                 }
             )
         else:
@@ -77,6 +97,8 @@ def resolve_subdivisions(subdivisions):
                 {
                     "subdivision": subdivision,
                     "matched": "false",
+                    "code": "",
+                    "cg.coverage.iso3166-1-alpha2": "",
                 }
             )
 
@@ -119,8 +141,8 @@ args = parser.parse_args()
 # set the signal handler for SIGINT (^C) so we can exit cleanly
 signal.signal(signal.SIGINT, signal_handler)
 
-# list comprehension instead of a for loop to extract all subdivision names
-subdivision_names = [subdivision.name.lower() for subdivision in pycountry.subdivisions]
+# index of subdivision names from ISO 3166-2
+backend = validation.Iso3166SubdivisionBackend(Iso3166Index())
 
 read_subdivisions_from_file()
 
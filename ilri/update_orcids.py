@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# update-orcids.py v0.1.5
+# update-orcids.py v0.2.0
 #
 # Copyright Alan Orth.
 #
@@ -41,6 +41,33 @@ def signal_handler(signal, frame):
     sys.exit(1)
 
 
+# Read lines with ORCID identifiers from the input file
+def read_orcid_identifiers(input_file):
+    orcid_identifier_pattern = re.compile(
+        r"[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}"
+    )
+
+    # Use read().splitlines() so we don't get newlines after each line, though I'm
+    # not sure if we should also be stripping?
+    for line in input_file.read().splitlines():
+        # extract the ORCID identifier from the current line
+        orcid_identifier_match = orcid_identifier_pattern.search(line)
+
+        # sanity check to make sure we extracted the ORCID identifier
+        if orcid_identifier_match is None:
+            if args.debug:
+                sys.stderr.write(
+                    Fore.YELLOW
+                    + f'Skipping invalid ORCID identifier in "{line}".\n'
+                    + Fore.RESET
+                )
+            continue
+
+        # we only expect one ORCID identifier, so if it matches it will be group "0"
+        # see: https://docs.python.org/3/library/re.html
+        yield line, orcid_identifier_match.group(0)
+
+
 parser = argparse.ArgumentParser(
     description="Update ORCID records in the DSpace PostgreSQL database."
 )
@@ -54,6 +81,16 @@ parser.add_argument(
 parser.add_argument("-db", "--database-name", help="Database name", required=True)
 parser.add_argument("-u", "--database-user", help="Database username", required=True)
 parser.add_argument("-p", "--database-pass", help="Database password", required=True)
+parser.add_argument(
+    "--database-host",
+    help="Database host (default localhost).",
+    default="localhost",
+)
+parser.add_argument(
+    "--change-journal",
+    help="Path to the journal of changed items to reindex in Discovery (default changed-items.txt).",
+    default="changed-items.txt",
+)
 parser.add_argument(
     "-d",
     "--debug",
@@ -88,7 +125,7 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # connect to database
 conn = util.db_connect(
-    args.database_name, args.database_user, args.database_pass, "localhost"
+    args.database_name, args.database_user, args.database_pass, args.database_host
 )
 
 if args.dry_run:
@@ -96,75 +133,62 @@ if args.dry_run:
 
 cursor = conn.cursor()
 
-# Use read().splitlines() so we don't get newlines after each line, though I'm
-# not sure if we should also be stripping?
-for line in args.input_file.read().splitlines():
-    # extract the ORCID identifier from the current line
-    orcid_identifier_pattern = re.compile(
-        r"[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}"
-    )
-    orcid_identifier_match = orcid_identifier_pattern.search(line)
-
-    # sanity check to make sure we extracted the ORCID identifier
-    if orcid_identifier_match is None:
-        if args.debug:
-            sys.stderr.write(
-                Fore.YELLOW
-                + f'Skipping invalid ORCID identifier in "{line}".\n'
-                + Fore.RESET
-            )
-        continue
-
-    # we only expect one ORCID identifier, so if it matches it will be group "0"
-    # see: https://docs.python.org/3/library/re.html
-    orcid_identifier = orcid_identifier_match.group(0)
+metadata_field_id = util.field_name_to_field_id(cursor, "cg.creator.identifier")
 
-    metadata_field_id = util.field_name_to_field_id(cursor, "cg.creator.identifier")
+# Items we've changed, so we can update their last_modified dates in batches
+last_modified = util.LastModifiedBatch()
 
-    # note that the SQL here is quoted differently to allow us to use
-    # LIKE with % wildcards with our paremeter subsitution
-    sql = "SELECT text_value, dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value LIKE '%%' || %s || '%%' AND text_value!=%s"
-    cursor.execute(sql, (metadata_field_id, orcid_identifier, line))
+# note that the SQL here is quoted differently to allow us to use LIKE with %
+# wildcards with our paremeter subsitution
+if args.dry_run:
+    sql = "SELECT dspace_object_id FROM metadatavalue WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value LIKE '%%' || %s || '%%' AND text_value!=%s"
+    params_seq = (
+        (metadata_field_id, orcid_identifier, line)
+        for line, orcid_identifier in read_orcid_identifiers(args.input_file)
+    )
+else:
+    # Update the values and get the item UUIDs we've changed, so we can use
+    # them to update their last_modified dates.
+    sql = "UPDATE metadatavalue SET text_value=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value LIKE '%%' || %s || '%%' AND text_value!=%s RETURNING dspace_object_id"
+    params_seq = (
+        (line, metadata_field_id, orcid_identifier, line)
+        for line, orcid_identifier in read_orcid_identifiers(args.input_file)
+    )
 
-    # Get the records for items with matching metadata. We will use the
-    # object IDs to update their last_modified dates.
-    matching_records = cursor.fetchall()
+# The updates don't depend on each other's results, so we can send them to the
+# database without waiting for each one to finish.
+for params, matching_records in util.execute_pipelined(cursor, sql, params_seq):
+    # The line is always the last parameter
+    line = params[-1]
 
     if args.dry_run:
-        if cursor.rowcount > 0 and not args.quiet:
+        if len(matching_records) > 0 and not args.quiet:
             logger.info(
                 Fore.GREEN
-                + f"(DRY RUN) Fixed {cursor.rowcount} occurences of: {line}"
+                + f"(DRY RUN) Fixed {len(matching_records)} occurences of: {line}"
                 + Fore.RESET
             )
     else:
-        sql = "UPDATE metadatavalue SET text_value=%s WHERE dspace_object_id IN (SELECT uuid FROM item WHERE in_archive AND NOT withdrawn) AND metadata_field_id=%s AND text_value LIKE '%%' || %s || '%%' AND text_value!=%s"
-        cursor.execute(
-            sql,
-            (
-                line,
-                metadata_field_id,
-                orcid_identifier,
-                line,
-            ),
-        )
-
-        if cursor.rowcount > 0 and not args.quiet:
+        if len(matching_records) > 0 and not args.quiet:
             logger.info(
                 Fore.GREEN
-                + f"Fixed {cursor.rowcount} occurences of: {line}"
+                + f"Fixed {len(matching_records)} occurences of: {line}"
                 + Fore.RESET
             )
 
         # Update the last_modified date for each item we've changed
-        for record in matching_records:
-            util.update_item_last_modified(cursor, record[1])
+        last_modified.add(cursor, (record[0] for record in matching_records))
 
 
 # commit changes when we're done
 if not args.dry_run:
+    last_modified.flush(cursor)
+
     conn.commit()
 
+    # Record the items we've changed so they can be reindexed in Discovery
+    util.ChangeJournal(args.change_journal).add(last_modified.updated)
+
 # close database connection before we exit
 conn.close()
 
@@ -1,4 +1,4 @@
-# util.py v0.0.6
+# util.py v0.1.0
 #
 # Copyright Alan Orth.
 #
@@ -9,63 +9,224 @@
 # Various helper functions for CGSpace DSpace Python scripts.
 #
 
+import dbm
 import gzip
+import hashlib
+import json
 import os
 import re
 import shutil
 import sys
+import threading
+import time
+import weakref
+import zlib
 from datetime import timedelta
+from urllib.parse import urlparse
 
 import psycopg
+import requests
 from colorama import Fore
-from requests_cache import CachedSession
-
-session = CachedSession(
-    "requests-cache", expire_after=timedelta(days=30), allowable_codes=(200, 404)
+from requests_cache import BaseCache, BaseStorage, CachedSession, FileCache, SQLiteCache
+from requests_cache.serializers import (
+    SerializerPipeline,
+    Stage,
+    pickle_serializer,
+    utf8_serializer,
 )
-# prune old cache entries
-session.cache.delete(expired=True)
+
+# How long to cache the responses from each API. Patterns are matched in order
+# against the URL without the protocol, and match anything that comes after.
+# Anything else is cached for thirty days. DSpace REST APIs can be on any host,
+# so scripts that need a shorter expiry for them pass expire_after themselves.
+#
+# See: https://requests-cache.readthedocs.io/en/stable/user_guide/expiration.html
+cache_expire_after = {
+    # AGROVOC only makes new releases monthly so this should be safe
+    "agrovoc.uniroma2.it": timedelta(days=30),
+    "pub.orcid.org": timedelta(days=30),
+    "api.crossref.org/works": timedelta(days=30),
+    # I don't know how often Crossref funders and journals are updated
+    "api.crossref.org": timedelta(days=14),
+    "v2.sherpa.ac.uk": timedelta(days=14),
+    "api.unpaywall.org": timedelta(days=30),
+    "ipapi.co": timedelta(days=30),
+    "api.abuseipdb.com": timedelta(days=30),
+    # GreyNoise classifications change quickly
+    "api.greynoise.io": timedelta(days=1),
+    # We are worried that Initiative names could change
+    "ilri.github.io/cgspace-submission-guidelines": timedelta(days=1),
+}
+
+# APIs whose HTTP 404 responses we cache, because they use them to tell us that
+# something doesn't exist, for example an ORCID identifier or an IP address they
+# know nothing about. Patterns are matched like cache_expire_after. For other
+# APIs a 404 is more likely to be a mistake on either side, so we try again.
+cache_not_found = [
+    "pub.orcid.org",
+    "api.crossref.org/works",
+    "api.unpaywall.org",
+    "api.greynoise.io",
+    "api.abuseipdb.com",
+]
+
+# The requests cache session shared by all scripts, see requests_session()
+# Where the requests cache is stored:
+#
+#   - "sqlite": an SQLite database using write-ahead logging, so lookups from
+#     several threads don't block each other, and memory-mapped reads
+#   - "filesystem": a directory with one file per response
+#   - "dbm": a compact key-value store using Python's dbm module
+#
+# Compressing responses makes the cache much smaller because most of what the
+# APIs send us is JSON. Use benchmark_requests_cache.py to compare them with a
+# copy of your cache. Note that changing these starts a new, empty cache.
+cache_backend = "sqlite"
+cache_compress = False
+# Size of the memory map for the SQLite backend, in bytes
+cache_sqlite_mmap_size = 256 * 1024 * 1024
+
+cached_session = None
+cached_session_lock = threading.Lock()
+
+
+class MetadataFieldRegistry:
+    """The DSpace metadata schema and field registries.
+
+    Loads every metadata field from the metadatafieldregistry and metadata-
+    schemaregistry tables in one query so that field names and IDs can be
+    looked up without querying the database each time.
+    """
+
+    def __init__(self, cursor):
+        """Load the registry.
+
+        :param cursor: a psycopg cursor with an active database session.
+        """
+
+        sql = "SELECT F.metadata_field_id, S.short_id, F.element, F.qualifier FROM metadatafieldregistry F JOIN metadataschemaregistry S ON F.metadata_schema_id = S.metadata_schema_id"
+        cursor.execute(sql)
+
+        # Metadata field names like "dcterms.title" → metadata_field_id
+        self.field_ids = {}
+        # metadata_field_id → metadata field names
+        self.field_names = {}
+        # Schemas, so we can tell a missing schema from a missing field
+        self.schemas = set()
+
+        for metadata_field_id, schema, element, qualifier in cursor.fetchall():
+            if qualifier:
+                metadata_field = f"{schema}.{element}.{qualifier}"
+            else:
+                metadata_field = f"{schema}.{element}"
+
+            self.field_ids[metadata_field] = metadata_field_id
+            self.field_names[metadata_field_id] = metadata_field
+            self.schemas.add(schema)
+
+        # Schemas without any fields aren't returned by the join above
+        cursor.execute("SELECT short_id FROM metadataschemaregistry")
+        self.schemas.update(row[0] for row in cursor.fetchall())
+
+    def field_id(self, metadata_field: str) -> int:
+        """Return the metadata_field_id for a given metadata field.
+
+        Exits with an error if the schema or metadata field doesn't exist.
+
+        :param metadata_field: the metadata field, for example "dcterms.title".
+        :returns int
+        """
+
+        try:
+            return self.field_ids[metadata_field]
+        except KeyError:
+            pass
+
+        schema = metadata_field.split(".")[0]
+
+        if schema not in self.schemas:
+            sys.stderr.write(
+                Fore.RED
+                + f'Metadata schema "{schema}" does not exist in the registry.\n'
+                + Fore.RESET
+            )
+        else:
+            sys.stderr.write(
+                Fore.RED
+                + f'Metadata field "{metadata_field}" does not exist in the registry.\n'
+                + Fore.RESET
+            )
+
+        sys.exit(1)
+
+    def field_name(self, metadata_field_id: int) -> str:
+        """Return the metadata field name for a given metadata_field_id.
+
+        Exits with an error if the metadata field doesn't exist.
+
+        :param metadata_field_id: the metadata_field_id, for example 64.
+        :returns str
+        """
+
+        try:
+            return self.field_names[metadata_field_id]
+        except KeyError:
+            sys.stderr.write(
+                Fore.RED
+                + f"Metadata field ID {metadata_field_id} does not exist in the registry.\n"
+                + Fore.RESET
+            )
+
+            sys.exit(1)
+
+
+# Registries loaded for each database connection, see metadata_field_registry()
+metadata_field_registries = weakref.WeakKeyDictionary()
+
+
+def metadata_field_registry(cursor) -> MetadataFieldRegistry:
+    """Return the metadata field registry for a cursor's database connection.
+
+    The registry is loaded the first time this is called for a connection and
+    reused after that.
+
+    :param cursor: a psycopg cursor with an active database session.
+    :returns MetadataFieldRegistry
+    """
+
+    try:
+        return metadata_field_registries[cursor.connection]
+    except KeyError:
+        registry = MetadataFieldRegistry(cursor)
+        metadata_field_registries[cursor.connection] = registry
+
+        return registry
 
 
 def field_name_to_field_id(cursor, metadata_field: str):
     """Return the metadata_field_id for a given metadata field.
 
-    TODO: handle case where schema doesn't exist
-    TODO: handle case where metadata field doesn't exist
+    Exits with an error if the schema or metadata field doesn't exist.
 
     :param cursor: a psycopg cursor with an active database session.
     :param metadata_field: the metadata field, for example "dcterms.title".
     :returns int
     """
 
-    if len(metadata_field.split(".")) == 3:
-        schema, element, qualifier = metadata_field.split(".")
-    elif len(metadata_field.split(".")) == 2:
-        schema, element = metadata_field.split(".")
-        qualifier = None
+    return metadata_field_registry(cursor).field_id(metadata_field)
 
-    # First we need to get the schema ID
-    sql = "SELECT metadata_schema_id FROM metadataschemaregistry WHERE short_id=%s;"
-    # Syntax looks weird here, but the second argument must always be a sequence
-    # See: https://www.psycopg.org/docs/usage.html
-    cursor.execute(sql, [schema])
 
-    if cursor.rowcount > 0:
-        metadata_schema_id = cursor.fetchone()[0]
+def field_id_to_field_name(cursor, metadata_field_id: int):
+    """Return the metadata field name for a given metadata_field_id.
 
-        # Now we can get the metadata field ID, paying attention to whether the
-        # field has a qualifier or not.
-        if qualifier:
-            sql = "SELECT metadata_field_id FROM metadatafieldregistry WHERE metadata_schema_id=%s AND element=%s AND qualifier=%s;"
-            cursor.execute(sql, [metadata_schema_id, element, qualifier])
-        else:
-            sql = "SELECT metadata_field_id FROM metadatafieldregistry WHERE metadata_schema_id=%s AND element=%s"
-            cursor.execute(sql, [metadata_schema_id, element])
+    Exits with an error if the metadata field doesn't exist.
 
-        if cursor.rowcount > 0:
-            metadata_field_id = cursor.fetchone()[0]
+    :param cursor: a psycopg cursor with an active database session.
+    :param metadata_field_id: the metadata_field_id, for example 64.
+    :returns str
+    """
 
-    return metadata_field_id
+    return metadata_field_registry(cursor).field_name(metadata_field_id)
 
 
 def update_item_last_modified(cursor, dspace_object_id: str):
@@ -81,6 +242,267 @@ def update_item_last_modified(cursor, dspace_object_id: str):
     cursor.execute(sql, [dspace_object_id])
 
 
+def update_items_last_modified(cursor, dspace_object_ids):
+    """Update several items' last_modified timestamps in one statement.
+
+    :param cursor: a psycopg cursor with an active database session.
+    :param dspace_object_ids: a list of dspace_object_ids of the items to update.
+    """
+
+    sql = "UPDATE item SET last_modified=NOW() WHERE uuid = ANY(%s::uuid[]);"
+    cursor.execute(sql, [list(dspace_object_ids)])
+
+
+# How many items LastModifiedBatch collects before updating them
+last_modified_batch_size = 1000
+
+
+class LastModifiedBatch:
+    """Items whose last_modified timestamps need to be updated.
+
+    Collects the dspace_object_ids of items that were changed and updates their
+    last_modified timestamps in batches with update_items_last_modified(). Each
+    item is only updated once, even if it is changed many times. Remember to
+    call flush() before committing!
+    """
+
+    def __init__(self):
+        """Create an empty batch."""
+
+        # Items waiting to be updated
+        self.pending = set()
+        # Items we have already updated
+        self.updated = set()
+
+    def add(self, cursor, dspace_object_ids):
+        """Add items to the batch, updating them if the batch is full.
+
+        :param cursor: a psycopg cursor with an active database session.
+        :param dspace_object_ids: an iterable of dspace_object_ids.
+        """
+
+        for dspace_object_id in dspace_object_ids:
+            if dspace_object_id not in self.updated:
+                self.pending.add(dspace_object_id)
+
+        if len(self.pending) >= last_modified_batch_size:
+            self.flush(cursor)
+
+    def flush(self, cursor):
+        """Update all items in the batch.
+
+        :param cursor: a psycopg cursor with an active database session.
+        """
+
+        if not self.pending:
+            return
+
+        # Use a cursor of our own so we don't throw away any results the
+        # caller hasn't read yet, for example from execute_pipelined()
+        with cursor.connection.cursor() as last_modified_cursor:
+            update_items_last_modified(last_modified_cursor, self.pending)
+
+        self.updated.update(self.pending)
+        self.pending.clear()
+
+
+def execute_pipelined(cursor, sql: str, params_seq, flush_size: int = 100):
+    """Execute a statement for many sets of parameters using pipeline mode.
+
+    Statements are sent to the server without waiting for the results of the
+    previous ones, and the results are read every flush_size statements. This
+    is much faster than executing them one by one when the database is not on
+    localhost, but the statements must not depend on each other's results.
+
+    See: https://www.psycopg.org/psycopg3/docs/advanced/pipeline.html
+
+    :param cursor: a psycopg cursor with an active database session.
+    :param sql: the statement to execute. Should return rows, for example with
+    RETURNING, if you need the results.
+    :param params_seq: an iterable of parameters for the statement.
+    :param flush_size: how many statements to queue before reading results.
+    :returns generator of (params, rows) tuples in the same order as params_seq
+    """
+
+    batch = []
+
+    for params in params_seq:
+        batch.append(params)
+
+        if len(batch) >= flush_size:
+            yield from execute_pipelined_batch(cursor, sql, batch)
+
+            batch = []
+
+    if batch:
+        yield from execute_pipelined_batch(cursor, sql, batch)
+
+
+def execute_pipelined_batch(cursor, sql: str, batch: list):
+    """Execute one batch of statements for execute_pipelined().
+
+    :param cursor: a psycopg cursor with an active database session.
+    :param sql: the statement to execute.
+    :param batch: a list of parameters for the statement.
+    :returns generator of (params, rows) tuples
+    """
+
+    with cursor.connection.pipeline():
+        cursor.executemany(sql, batch, returning=True)
+
+    # With returning=True there is one result per set of parameters. Read all
+    # of them before yielding any, because the caller may execute something
+    # else on this cursor, which would throw away the results we haven't read.
+    results = []
+
+    for params in batch:
+        if cursor.description is None:
+            rows = []
+        else:
+            rows = cursor.fetchall()
+
+        results.append((params, rows))
+
+        cursor.nextset()
+
+    yield from results
+
+
+class ProgressJournal:
+    """Progress of a long run over an input file, saved to disk.
+
+    Records a hash of the input file and the number of rows that have been
+    committed so that a run that was interrupted can skip those rows when it
+    is started again with the same input file.
+    """
+
+    def __init__(self, filename: str, input_filename: str):
+        """Load the journal, if there is one for this input file.
+
+        :param filename: path to the journal file.
+        :param input_filename: path to the input file.
+        """
+
+        self.filename = filename
+
+        # Read the file in chunks so we don't need to keep it all in memory
+        input_hash = hashlib.sha256()
+
+        with open(input_filename, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                input_hash.update(chunk)
+
+        self.input_hash = input_hash.hexdigest()
+
+        # Number of rows of the input file that have been committed
+        self.rows = 0
+
+        try:
+            with open(self.filename, "r") as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return
+
+        if journal["input_hash"] == self.input_hash:
+            self.rows = journal["rows"]
+        else:
+            sys.stderr.write(
+                Fore.YELLOW
+                + f"Ignoring journal {self.filename} because the input file has changed.\n"
+                + Fore.RESET
+            )
+
+    def save(self, rows: int):
+        """Save the number of rows that have been committed.
+
+        :param rows: number of rows of the input file that have been committed.
+        """
+
+        self.rows = rows
+
+        # Write to a temporary file first so the journal is never left half
+        # written if we are interrupted.
+        with open(f"{self.filename}.tmp", "w") as f:
+            json.dump({"input_hash": self.input_hash, "rows": self.rows}, f)
+
+        os.replace(f"{self.filename}.tmp", self.filename)
+
+    def remove(self):
+        """Remove the journal after the whole input file has been committed."""
+
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+class ChangeJournal:
+    """Items that have been changed directly in the database.
+
+    A text file with one item UUID per line that is shared by all the scripts
+    that write to the database. Changes made in SQL are not seen by Discovery,
+    so the items in the journal need to be reindexed with `dspace index-discovery
+    -i`, which is much faster than rebuilding the whole index. Each item is only
+    written to the journal once.
+
+    See: reindex_changed_items.py
+    """
+
+    def __init__(self, filename: str):
+        """Load the items that are already in the journal.
+
+        :param filename: path to the journal file.
+        """
+
+        self.filename = filename
+        # Items in the journal, in the order they were added
+        self.items = dict()
+
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    if line.strip():
+                        self.items[line.strip()] = None
+        except FileNotFoundError:
+            pass
+
+    def add(self, dspace_object_ids):
+        """Append items to the journal if they are not already in it.
+
+        Call this after committing so that the journal only has items that
+        were actually changed.
+
+        :param dspace_object_ids: an iterable of dspace_object_ids.
+        """
+
+        # psycopg returns UUIDs as uuid.UUID, but psycopg2 returns strings
+        new_items = [
+            str(dspace_object_id)
+            for dspace_object_id in dspace_object_ids
+            if str(dspace_object_id) not in self.items
+        ]
+
+        if not new_items:
+            return
+
+        # Write all the lines at once in append mode so that several scripts
+        # can use the same journal.
+        with open(self.filename, "a") as f:
+            f.write("".join(f"{item}\n" for item in dict.fromkeys(new_items)))
+
+        self.items.update(dict.fromkeys(new_items))
+
+    def clear(self):
+        """Remove all items from the journal after they have been reindexed."""
+
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+        self.items.clear()
+
+
 def db_connect(
     database_name: str, database_user: str, database_pass: str, database_host: str
 ):
@@ -134,7 +556,200 @@ def read_dois_from_file(input_file) -> list:
     return dois
 
 
+class DbmDict(BaseStorage):
+    """A dictionary-like interface to a dbm database for requests-cache.
+
+    The dbm modules are not thread safe, so all access goes through a lock.
+    """
+
+    def __init__(self, filename: str, serializer=pickle_serializer, **kwargs):
+        super().__init__(serializer=serializer, **kwargs)
+
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.db = dbm.open(filename, "c")
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.db[key]
+
+        return self.deserialize(key, value)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.db[key] = self.serialize(value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.db[key]
+
+    def __iter__(self):
+        with self.lock:
+            keys = self.db.keys()
+
+        for key in keys:
+            yield key.decode()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.db)
+
+    def clear(self):
+        with self.lock:
+            self.db.close()
+            self.db = dbm.open(self.filename, "n")
+
+    def reorganize(self):
+        """Give the space used by deleted responses back to the filesystem.
+
+        Only dbm.gnu can do this, the other dbm modules ignore it.
+        """
+
+        with self.lock:
+            if hasattr(self.db, "reorganize"):
+                self.db.reorganize()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class DbmCache(BaseCache):
+    """requests-cache backend that stores responses in dbm databases."""
+
+    def __init__(self, cache_name: str, serializer=None, **kwargs):
+        super().__init__(cache_name=cache_name, **kwargs)
+
+        self.responses = DbmDict(
+            f"{cache_name}.dbm", serializer=serializer or pickle_serializer
+        )
+        self.redirects = DbmDict(
+            f"{cache_name}-redirects.dbm", serializer=utf8_serializer
+        )
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+
+        self.responses.reorganize()
+        self.redirects.reorganize()
+
+
+def requests_cache_backend(
+    cache_name: str = "requests-cache", backend: str = None, compress: bool = None
+) -> BaseCache:
+    """Return the storage for a requests cache.
+
+    Responses are always pickled, and optionally compressed with zlib. The
+    name of a compressed cache ends in "-zlib" so it doesn't get mixed up with
+    an uncompressed one.
+
+    :param cache_name: path to the cache, without an extension.
+    :param backend: "sqlite", "filesystem", or "dbm" (default cache_backend).
+    :param compress: compress responses (default cache_compress).
+    :returns BaseCache
+    """
+
+    if backend is None:
+        backend = cache_backend
+
+    if compress is None:
+        compress = cache_compress
+
+    if compress:
+        cache_name = f"{cache_name}-zlib"
+        serializer = SerializerPipeline(
+            [
+                *pickle_serializer.stages,
+                Stage(dumps=zlib.compress, loads=zlib.decompress),
+            ],
+            name="pickle-zlib",
+            is_binary=True,
+        )
+    else:
+        serializer = pickle_serializer
+
+    if backend == "sqlite":
+        cache = SQLiteCache(cache_name, serializer=serializer, wal=True)
+
+        # The responses and redirects tables have their own connections
+        for table in (cache.responses, cache.redirects):
+            with table.connection() as connection:
+                connection.execute(f"PRAGMA mmap_size={cache_sqlite_mmap_size}")
+    elif backend == "filesystem":
+        cache = FileCache(cache_name, serializer=serializer)
+    elif backend == "dbm":
+        cache = DbmCache(cache_name, serializer=serializer)
+    else:
+        raise ValueError(f"Unknown requests cache backend: {backend}")
+
+    return cache
+
+
+def cache_response_filter(response) -> bool:
+    """Decide whether to save a response in the requests cache.
+
+    Only HTTP 404 responses from the APIs in cache_not_found are saved, other
+    responses are filtered by the session's allowable codes.
+
+    :param response: the response.
+    :returns bool
+    """
+
+    if response.status_code != 404:
+        return True
+
+    url = response.url.split("://", 1)[-1]
+
+    return any(url.startswith(pattern) for pattern in cache_not_found)
+
+
+def requests_session() -> CachedSession:
+    """Return the requests session with our transparent requests cache.
+
+    The session is created the first time it is needed, so scripts that don't
+    make any HTTP requests don't open the cache at all. HTTP 404 responses are
+    cached too for the APIs in cache_not_found.
+
+    Expired responses are not pruned automatically because it gets slow when
+    the cache is large. Run prune_requests_cache.py once in a while instead.
+
+    See cache_backend and cache_compress for where the cache is stored.
+
+    :returns CachedSession
+    """
+
+    global cached_session
+
+    with cached_session_lock:
+        if cached_session is None:
+            cached_session = new_requests_session(requests_cache_backend())
+
+        return cached_session
+
+
+def new_requests_session(cache: BaseCache) -> CachedSession:
+    """Return a new requests session using an existing requests cache.
+
+    Use this for a session with its own connection pool or headers that still
+    shares the cache of requests_session(), which is returned by its cache
+    attribute.
+
+    :param cache: the requests cache backend.
+    :returns CachedSession
+    """
+
+    return CachedSession(
+        backend=cache,
+        expire_after=timedelta(days=30),
+        urls_expire_after=cache_expire_after,
+        allowable_codes=(200, 404),
+        filter_fn=cache_response_filter,
+    )
+
+
 def download_file(url, filename) -> bool:
+    session = requests_session()
+
     # Disable cache for streaming downloads
     # See: https://github.com/requests-cache/requests-cache/issues/75
     with session.cache_disabled():
@@ -163,3 +778,253 @@ def download_file(url, filename) -> bool:
         return True
     else:
         return False
+
+
+class HostLimiter:
+    """Limits on the requests we make to one host.
+
+    Limits the number of concurrent requests, and spreads requests evenly over
+    the host's rate limit. The rate limit is updated from the X-Rate-Limit-Limit
+    and X-Rate-Limit-Interval headers if the host sends them, like Crossref.
+    """
+
+    def __init__(self, concurrency: int, rate: float = None):
+        """Create a limiter.
+
+        :param concurrency: maximum number of concurrent requests.
+        :param rate: maximum number of requests per second, or None.
+        """
+
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        # Seconds between requests
+        self.delay = 1 / rate if rate else 0
+        # Time at which the next request may be made
+        self.next_request = time.monotonic()
+
+    def wait(self):
+        """Wait until we are allowed to make the next request."""
+
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request)
+            self.next_request = request_time + self.delay
+
+        time.sleep(request_time - now)
+
+    def update(self, headers):
+        """Update the rate limit from the headers of a response.
+
+        :param headers: the headers of a response.
+        """
+
+        try:
+            limit = int(headers["X-Rate-Limit-Limit"])
+            interval = float(headers["X-Rate-Limit-Interval"].rstrip("s"))
+        except (KeyError, ValueError):
+            return
+
+        if limit > 0:
+            with self.lock:
+                self.delay = interval / limit
+
+    def pause(self, seconds: float):
+        """Don't make any more requests for a while, for example after HTTP 429.
+
+        :param seconds: number of seconds to pause.
+        """
+
+        with self.lock:
+            self.next_request = max(self.next_request, time.monotonic() + seconds)
+
+
+class HttpClient:
+    """HTTP client for the scripts that look things up in external APIs.
+
+    Uses one session with a pool of keep-alive connections, so we don't need a
+    new TCP connection and TLS handshake for every request. Responses in the
+    requests cache are returned straight away. Otherwise requests wait for
+    their turn according to the limits of each host, and are retried with
+    exponential backoff on HTTP 429, HTTP 5xx, and connection errors.
+
+    All requests are sent with the same User-Agent, including a contact email
+    if we have one. Hosts that ask for it in a query parameter get the email
+    as mailto too.
+
+    Safe to use from several threads.
+    """
+
+    user_agent = "ILRI DSpace scripts (https://github.com/ilri/DSpace)"
+
+    # Hosts that want a contact email in the mailto parameter
+    mailto_hosts = {"api.crossref.org"}
+
+    def __init__(
+        self,
+        session: CachedSession = None,
+        mailto: str = None,
+        concurrency: int = 10,
+        retries: int = 5,
+    ):
+        """Create a client.
+
+        :param session: the requests-cache session to use (default a new
+        session sharing the cache of requests_session()).
+        :param mailto: contact email to send with requests, or None.
+        :param concurrency: maximum number of concurrent requests per host.
+        :param retries: number of times to retry a failed request.
+        """
+
+        # Our own session, so the connection pool and User-Agent of one client
+        # don't replace those of another
+        self.session = session or new_requests_session(requests_session().cache)
+        self.mailto = mailto
+        self.concurrency = concurrency
+        self.retries = retries
+
+        # Enough connections in the pool for all the threads
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=concurrency, pool_maxsize=concurrency
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        if mailto:
+            self.session.headers["User-Agent"] = f"{self.user_agent} mailto:{mailto}"
+        else:
+            self.session.headers["User-Agent"] = self.user_agent
+
+        self.lock = threading.Lock()
+        # Host name → HostLimiter
+        self.hosts = {}
+
+    def limit_host(self, host: str, concurrency: int = None, rate: float = None):
+        """Set the limits for a host.
+
+        :param host: the host name, for example "api.crossref.org".
+        :param concurrency: maximum number of concurrent requests (default
+        the client's concurrency).
+        :param rate: maximum number of requests per second, or None.
+        """
+
+        with self.lock:
+            self.hosts[host] = HostLimiter(concurrency or self.concurrency, rate)
+
+    def host_limiter(self, host: str) -> HostLimiter:
+        """Return the limiter for a host, creating one if needed.
+
+        :param host: the host name.
+        :returns HostLimiter
+        """
+
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(self.concurrency)
+
+            return self.hosts[host]
+
+    def get(self, url: str, params: dict = None, **kwargs):
+        """Send a GET request.
+
+        Raises requests.exceptions.ConnectionError if the last attempt fails
+        with a connection error. If the last attempt gets HTTP 429 or 5xx then
+        that response is returned.
+
+        :param url: the URL.
+        :param params: query parameters, if any.
+        :param kwargs: other arguments for requests, for example headers or
+        expire_after.
+        :returns requests.Response
+        """
+
+        host = urlparse(url).hostname
+        params = dict(params or {})
+
+        if self.mailto and host in self.mailto_hosts:
+            params.setdefault("mailto", self.mailto)
+
+        # Cached responses don't count against any limits. requests-cache
+        # returns HTTP 504 if the response is not in the cache.
+        response = self.session.get(url, params=params, only_if_cached=True, **kwargs)
+        if response.status_code != 504:
+            return response
+
+        limiter = self.host_limiter(host)
+
+        for attempt in range(self.retries + 1):
+            limiter.wait()
+
+            try:
+                with limiter.semaphore:
+                    response = self.session.get(url, params=params, **kwargs)
+            except requests.exceptions.ConnectionError:
+                if attempt == self.retries:
+                    raise
+
+                retry_after = None
+            else:
+                limiter.update(response.headers)
+
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+
+                if attempt == self.retries:
+                    return response
+
+                retry_after = response.headers.get("Retry-After")
+
+            # Respect Retry-After if the host sends it, otherwise back off a
+            # bit more each time. Pause all requests to the host, since they
+            # would fail too.
+            try:
+                backoff = float(retry_after)
+            except (TypeError, ValueError):
+                backoff = 2**attempt
+
+            limiter.pause(backoff)
+
+
+def solr_documents(
+    solr_url: str, core: str, query: str, fields: list, rows: int = 1000
+):
+    """Yield all the documents matching a Solr query.
+
+    Pages through the results with a cursor instead of start and rows, so it
+    doesn't get slower as we go deeper and doesn't hold more than one page in
+    memory. Solr requires the sort to include the unique key of the core, so
+    this only works for cores where that is "id", like authority.
+
+    See: https://solr.apache.org/guide/solr/latest/query-guide/pagination-of-results.html
+
+    :param solr_url: URL of Solr, for example "http://localhost:8080/solr".
+    :param core: name of the core, for example "authority".
+    :param query: the query, for example "orcid_id:*".
+    :param fields: list of fields to return for each document.
+    :param rows: number of documents to fetch per request.
+    :returns iterator of dicts
+    """
+
+    params = {
+        "q": query,
+        "fl": ",".join(fields),
+        "sort": "id asc",
+        "rows": rows,
+        "wt": "json",
+        "cursorMark": "*",
+    }
+
+    with requests.Session() as session:
+        while True:
+            res = session.get(f"{solr_url}/{core}/select", params=params)
+            res.raise_for_status()
+
+            data = res.json()
+
+            yield from data["response"]["docs"]
+
+            # Solr returns the same cursor mark again when there are no more
+            # results
+            if data["nextCursorMark"] == params["cursorMark"]:
+                break
+
+            params["cursorMark"] = data["nextCursorMark"]
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+#
+# validate-metadata.py 0.0.1
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Validate metadata values against controlled vocabularies (see validation.py)
+# and save the results to a CSV including the column, the value, how many times
+# it appears, whether it matched or not, the type of match, and the identifier
+# of the match (ISO code, ROR ID, AGROVOC concept, or Crossref funder ID).
+#
+# Validate a text file with one value per line against one vocabulary:
+#
+#   $ validate-metadata.py -i /tmp/countries.txt -b iso3166 -o /tmp/countries.csv
+#
+# Or validate several columns of a DSpace metadata export CSV in one pass. The
+# columns are given as field=backend, and columns with a language like
+# dcterms.subject[en_US] are included. Without --column, all the CGSpace fields
+# that use a controlled vocabulary are validated. Multiple values in a column
+# are separated by "||".
+#
+#   $ validate-metadata.py -i /tmp/export.csv -c dcterms.subject=agrovoc -c cg.coverage.country=iso3166 -o /tmp/validation.csv
+#
+# Each value is only looked up once, even if it appears in several rows or
+# columns. Values for backends that use the network (Crossref, and AGROVOC if
+# there is no local index) are looked up concurrently.
+#
+# This script is written for Python 3.6+ and requires several modules that you
+# can install with pip (I recommend using a Python virtual environment):
+#
+#   $ pip install colorama pycountry requests requests-cache
+#
+
+import argparse
+import csv
+import logging
+import os
+import signal
+import sys
+
+import requests
+import util
+import validation
+from agrovoc_index import AgrovocIndex
+from colorama import Fore
+from iso3166_index import Iso3166Index
+from ror_index import RorIndex
+
+# Create a local logger instance
+logger = logging.getLogger(__name__)
+# Set the global log format
+logging.basicConfig(format="[%(levelname)s] %(message)s")
+
+backend_names = [
+    "agrovoc",
+    "crossref-funders",
+    "iso3166",
+    "iso3166-2",
+    "iso639",
+    "ror",
+]
+
+
+def create_backends(names: set) -> dict:
+    """Create the backends we need, and only those.
+
+    :param names: set of backend names.
+    :returns dict of name → validation.Backend
+    """
+
+    backends = {}
+
+    if "iso3166" in names or "iso3166-2" in names:
+        iso3166_index = Iso3166Index()
+
+        backends["iso3166"] = validation.Iso3166Backend(iso3166_index)
+        backends["iso3166-2"] = validation.Iso3166SubdivisionBackend(iso3166_index)
+
+    if "iso639" in names:
+        backends["iso639"] = validation.Iso639Backend()
+
+    if "ror" in names:
+        ror_index = RorIndex(args.ror_index)
+
+        if ror_index.version is None:
+            sys.stderr.write(
+                f"{Fore.RED}No ROR data in {args.ror_index}, index it with ror_lookup.py first.{Fore.RESET}\n"
+            )
+
+            sys.exit(1)
+
+        backends["ror"] = validation.RorBackend(ror_index)
+
+    if "agrovoc" in names:
+        # Use the local AGROVOC index if agrovoc_lookup.py has created one
+        if os.path.exists(args.agrovoc_index):
+            agrovoc_index = AgrovocIndex(args.agrovoc_index)
+        else:
+            logger.info(
+                f"{Fore.YELLOW}No AGROVOC index in {args.agrovoc_index}, using the REST API.{Fore.RESET}"
+            )
+
+            agrovoc_index = None
+
+        backends["agrovoc"] = validation.AgrovocBackend(
+            http, agrovoc_index, args.language
+        )
+
+    if "crossref-funders" in names:
+        backends["crossref-funders"] = validation.CrossrefFundersBackend(http)
+
+    return backends
+
+
+def parse_columns(columns: list) -> dict:
+    """Parse the --column arguments.
+
+    :param columns: list of strings like "dcterms.subject=agrovoc".
+    :returns dict of field → backend name
+    """
+
+    fields = {}
+
+    for column in columns:
+        field, sep, backend = column.partition("=")
+
+        if not sep or backend not in backend_names:
+            sys.stderr.write(
+                f"{Fore.RED}Invalid column {column!r}, expected field=backend with one of: {', '.join(backend_names)}.{Fore.RESET}\n"
+            )
+
+            sys.exit(1)
+
+        fields[field] = backend
+
+    return fields
+
+
+def read_values_from_file(validator, backend):
+    # one value per line, in a column named after the backend
+    validator.add_column(backend.name, backend)
+
+    for line in args.input_file:
+        validator.add_value(backend.name, line)
+
+
+def read_values_from_csv(validator, fields):
+    reader = csv.DictReader(args.input_file)
+
+    # Columns in the CSV for each field, with or without a language
+    columns = {}
+
+    for column in reader.fieldnames:
+        field = column.split("[")[0]
+
+        if field in fields:
+            columns[column] = fields[field]
+
+    if not columns:
+        sys.stderr.write(
+            f"{Fore.RED}No columns to validate in {args.input_file.name}.{Fore.RESET}\n"
+        )
+
+        sys.exit(1)
+
+    backends = create_backends(set(columns.values()))
+
+    for column, backend in columns.items():
+        validator.add_column(column, backends[backend])
+
+    for row in reader:
+        for column in columns:
+            if row[column]:
+                for value in row[column].split("||"):
+                    validator.add_value(column, value)
+
+
+def signal_handler(signal, frame):
+    # close output file before we exit
+    args.output_file.close()
+
+    sys.exit(1)
+
+
+parser = argparse.ArgumentParser(
+    description="Validate metadata values from a text file or a DSpace CSV against controlled vocabularies and save results in a CSV."
+)
+parser.add_argument(
+    "--agrovoc-index",
+    help="Path to the index of the AGROVOC dump created by agrovoc_lookup.py (default agrovoc-index.sqlite). The AGROVOC REST API is used if it doesn't exist.",
+    default="agrovoc-index.sqlite",
+)
+parser.add_argument(
+    "-b",
+    "--backend",
+    help="Vocabulary to validate a text file with one value per line against.",
+    choices=backend_names,
+)
+parser.add_argument(
+    "-c",
+    "--column",
+    help="Column of a DSpace CSV to validate and its vocabulary, for example dcterms.subject=agrovoc. Can be given several times (default all CGSpace fields with a vocabulary).",
+    action="append",
+)
+parser.add_argument(
+    "--concurrency",
+    help="Number of values to look up at the same time in network APIs (default 10).",
+    type=int,
+    default=10,
+)
+parser.add_argument(
+    "-d",
+    "--debug",
+    help="Set log level to DEBUG.",
+    action="store_true",
+)
+parser.add_argument(
+    "-e",
+    "--email",
+    help="Contact email to use in API requests so Crossref is more lenient with our request rate.",
+)
+parser.add_argument(
+    "-i",
+    "--input-file",
+    help="File name containing values to validate, one per line with --backend, otherwise a DSpace CSV.",
+    required=True,
+    type=argparse.FileType("r"),
+)
+parser.add_argument(
+    "-l", "--language", help="Language of AGROVOC terms (example en, default any)."
+)
+parser.add_argument(
+    "-o",
+    "--output-file",
+    help="Name of output file to write results to (CSV).",
+    required=True,
+    type=argparse.FileType("w", encoding="UTF-8"),
+)
+parser.add_argument(
+    "--ror-index",
+    help="Path to the index of the ROR data dump created by ror_lookup.py (default ror-index.sqlite).",
+    default="ror-index.sqlite",
+)
+parser.add_argument(
+    "-u",
+    "--unmatched",
+    help="Only save values that did not match.",
+    action="store_true",
+)
+args = parser.parse_args()
+
+# set the signal handler for SIGINT (^C) so we can exit cleanly
+signal.signal(signal.SIGINT, signal_handler)
+
+# The default log level is WARNING, but we want to set it to DEBUG or INFO
+if args.debug:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+
+# Shared HTTP client so we reuse connections between requests
+http = util.HttpClient(mailto=args.email, concurrency=args.concurrency)
+
+validator = validation.Validator(args.concurrency)
+
+if args.backend:
+    read_values_from_file(validator, create_backends({args.backend})[args.backend])
+else:
+    read_values_from_csv(
+        validator,
+        parse_columns(args.column) if args.column else validation.cgspace_fields,
+    )
+
+# close input file before we look things up
+args.input_file.close()
+
+for column, (backend, values) in validator.columns.items():
+    logger.debug(f"Validating {len(values)} values in {column} against {backend.name}")
+
+try:
+    results = validator.validate()
+except requests.exceptions.RequestException as e:
+    sys.stderr.write(f"{Fore.RED}Lookup failed: {e}{Fore.RESET}\n")
+
+    sys.exit(1)
+
+writer = csv.DictWriter(args.output_file, fieldnames=validation.fieldnames)
+writer.writeheader()
+
+matched = 0
+unmatched = 0
+
+for row in validator.rows(results):
+    if row["matched"] == "true":
+        matched += 1
+
+        if args.unmatched:
+            continue
+    else:
+        unmatched += 1
+
+        logger.debug(
+            f"{Fore.YELLOW}No match for {row['value']!r} in {row['backend']} ({row['column']}){Fore.RESET}"
+        )
+
+    writer.writerow(row)
+
+# close output file before we exit
+args.output_file.close()
+
+logger.info(
+    f"{Fore.GREEN}{matched} values matched and {unmatched} did not match.{Fore.RESET}"
+)
@@ -0,0 +1,391 @@
+# validation.py v0.1.0
+#
+# Copyright Alan Orth.
+#
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# ---
+#
+# Helper classes for validating metadata values against controlled vocabularies,
+# used by validate_metadata.py and the lookup scripts for each vocabulary, so
+# the matching logic lives in one place. Each vocabulary has a backend with a lookup()
+# method that returns the match type and identifier of a value, or None if it
+# doesn't match:
+#
+#   - iso3166: country names from ISO 3166-1 and ISO 3166-3 (see iso3166_index.py)
+#   - iso3166-2: subdivision names from ISO 3166-2
+#   - iso639: the values stored by our dc.language.iso value pairs, which are
+#     ISO 639-1 codes or "other" (see iso_639_value_pairs.py)
+#   - ror: organizations in a local ROR index (see ror_index.py)
+#   - agrovoc: subjects in a local AGROVOC index (see agrovoc_index.py), or
+#     the AGROVOC REST API if there is no index
+#   - crossref-funders: funders in the Crossref REST API
+#
+# The Validator collects the unique values for each backend first, so that every
+# value is only looked up once no matter how many times or in how many columns
+# it appears. The values for backends that use the network are looked up in a
+# thread pool, while the local backends are looked up in the meantime.
+#
+# The modules that only some backends need, like pycountry and requests, are
+# imported when they are used, so each lookup script only needs the modules of
+# its own backend.
+#
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from agrovoc_index import AgrovocIndex
+from ror_index import RorIndex
+
+# Fields in the CSV written by validate_metadata.py
+fieldnames = [
+    "column",
+    "value",
+    "count",
+    "backend",
+    "matched",
+    "match type",
+    "identifier",
+]
+
+# The backend for each CGSpace field that uses a controlled vocabulary
+cgspace_fields = {
+    "cg.contributor.affiliation": "ror",
+    "cg.contributor.donor": "crossref-funders",
+    "cg.coverage.country": "iso3166",
+    "cg.coverage.subregion": "iso3166-2",
+    "dcterms.language": "iso639",
+    "dcterms.subject": "agrovoc",
+}
+
+
+class Backend(ABC):
+    """A controlled vocabulary to validate values against."""
+
+    # Name of the backend in the CSV and on the command line
+    name = None
+    # Backends that use the network are looked up concurrently
+    network = False
+
+    @abstractmethod
+    def lookup(self, value: str) -> tuple | None:
+        """Look up a value.
+
+        :param value: the value, for example "Kenya".
+        :returns (match type, identifier) tuple, or None
+        """
+
+
+class Iso3166Backend(Backend):
+    name = "iso3166"
+
+    def __init__(self, index):
+        """Create an ISO 3166-1 backend.
+
+        :param index: iso3166_index.Iso3166Index to look up countries in.
+        """
+
+        self.index = index
+
+    def lookup(self, value: str) -> tuple | None:
+        result = self.index.country(value)
+
+        if result is None:
+            return None
+
+        alpha2, match_type, country_name = result
+
+        return match_type, alpha2
+
+
+class Iso3166SubdivisionBackend(Backend):
+    name = "iso3166-2"
+
+    def __init__(self, index):
+        """Create an ISO 3166-2 backend.
+
+        :param index: iso3166_index.Iso3166Index to look up subdivisions in.
+        """
+
+        self.index = index
+
+    def lookup(self, value: str) -> tuple | None:
+        results = self.index.subdivision(value)
+
+        if not results:
+            return None
+
+        # Names used in several countries match all of them
+        return "name", "||".join(code for code, name, country in results)
+
+
+class Iso639Backend(Backend):
+    name = "iso639"
+
+    def __init__(self):
+        import pycountry
+
+        # Only languages with an alpha-2 code are in our value pairs, plus
+        # "other" for anything else. Language names are displayed in the form,
+        # but they are not valid stored values.
+        self.codes = {
+            language.alpha_2
+            for language in pycountry.languages
+            if hasattr(language, "alpha_2")
+        }
+        self.codes.add("other")
+
+    def lookup(self, value: str) -> tuple | None:
+        if value in self.codes:
+            return "alpha_2", value
+
+        return None
+
+
+class RorBackend(Backend):
+    name = "ror"
+
+    def __init__(self, index: RorIndex):
+        self.index = index
+
+    def lookup(self, value: str) -> tuple | None:
+        match = self.index.search(value)
+
+        if match is None:
+            return None
+
+        ror_id, match_type = match
+
+        return match_type, ror_id
+
+
+class AgrovocBackend(Backend):
+    name = "agrovoc"
+
+    def __init__(self, http, index: AgrovocIndex = None, language: str = None):
+        """Create an AGROVOC backend.
+
+        :param http: util.HttpClient for the REST API.
+        :param index: AgrovocIndex to use instead of the REST API, or None.
+        :param language: only match labels in this language, for example "en".
+        """
+
+        self.http = http
+        self.index = index
+        self.language = language
+
+        # The index is an SQLite database, which we only use from one thread
+        self.network = index is None
+
+    def lookup(self, value: str) -> tuple | None:
+        match_type, concept, language, number_of_matches = self.search(value)
+
+        if match_type is None:
+            return None
+
+        return match_type, concept
+
+    def search(self, value: str) -> tuple:
+        """Look up a subject, with the details agrovoc_lookup.py reports.
+
+        Raises requests.exceptions.RequestException if the REST API fails.
+
+        :param value: the subject, for example "livestock".
+        :returns (match type, concept, language, number of matches) tuple. The
+        match type, concept, and language are None if there is no match.
+        """
+
+        if self.index is not None:
+            # preferred labels come first, then alternative labels
+            results = self.index.search(value, self.language)
+
+            # the REST API returns one result per concept
+            number_of_matches = len(
+                {concept for concept, language, match_type in results}
+            )
+
+            if not results:
+                return None, None, None, number_of_matches
+
+            concept, language, match_type = results[0]
+
+            return match_type, concept, language, number_of_matches
+
+        request_params = {"query": value}
+
+        if self.language:
+            request_params.update(lang=self.language)
+
+        response = self.http.get(
+            "https://agrovoc.uniroma2.it/agrovoc/rest/v1/agrovoc/search",
+            params=request_params,
+        )
+        response.raise_for_status()
+
+        results = response.json()["results"]
+
+        # Check all the results for a preferred label before alternative labels.
+        # matchedPrefLabel is not a property in SKOS, it is a hint from the
+        # server that the query matched the prefLabel in some language. AGROVOC
+        # returns title case like "Iran" whatever the case of the query, so we
+        # compare in upper case.
+        for result in results:
+            for label in (result.get("prefLabel"), result.get("matchedPrefLabel")):
+                if label and value.upper() == label.upper():
+                    return "prefLabel", result["uri"], result["lang"], len(results)
+
+        for result in results:
+            label = result.get("altLabel")
+
+            if label and value.upper() == label.upper():
+                return "altLabel", result["uri"], result["lang"], len(results)
+
+        return None, None, None, len(results)
+
+
+class CrossrefFundersBackend(Backend):
+    name = "crossref-funders"
+    network = True
+
+    def __init__(self, http):
+        """Create a Crossref funders backend.
+
+        :param http: util.HttpClient for the REST API.
+        """
+
+        self.http = http
+
+    def lookup(self, value: str) -> tuple | None:
+        response = self.http.get(
+            "https://api.crossref.org/funders", params={"query": value}
+        )
+        response.raise_for_status()
+
+        for item in response.json()["message"]["items"]:
+            if item["name"].lower() == value.lower():
+                return "name", item["id"]
+
+            for altname in item["alt-names"]:
+                if altname.lower() == value.lower():
+                    return "alt-name", item["id"]
+
+        return None
+
+
+class Validator:
+    """Validates the values of several columns against their backends."""
+
+    def __init__(self, concurrency: int = 10):
+        """Create a validator.
+
+        :param concurrency: number of values to look up at the same time in
+        backends that use the network.
+        """
+
+        self.concurrency = concurrency
+        # Column → (backend, dict of value → number of times we saw it)
+        self.columns = {}
+
+    def add_column(self, column: str, backend: Backend):
+        """Add a column to validate.
+
+        :param column: the name of the column, for example "dcterms.subject".
+        :param backend: the backend to validate its values against.
+        """
+
+        self.columns[column] = (backend, {})
+
+    def add_value(self, column: str, value: str):
+        """Add a value of a column to validate.
+
+        :param column: the name of the column, which must have been added.
+        :param value: the value. Leading and trailing whitespace is removed,
+        and empty values are ignored.
+        """
+
+        value = value.strip()
+
+        if not value:
+            return
+
+        values = self.columns[column][1]
+        values[value] = values.get(value, 0) + 1
+
+    def validate(self) -> dict:
+        """Look up the unique values of each backend.
+
+        Raises requests.exceptions.RequestException if a backend that uses the
+        network fails.
+
+        :returns dict of backend name → dict of value → (match type, identifier)
+        tuple or None
+        """
+
+        import requests
+
+        # Backend name → (backend, set of values)
+        batches = {}
+
+        for backend, values in self.columns.values():
+            batches.setdefault(backend.name, (backend, set()))[1].update(values)
+
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # Start the network requests first so they run while we look up the
+            # local backends
+            futures = {
+                backend.name: {
+                    value: executor.submit(backend.lookup, value) for value in values
+                }
+                for backend, values in batches.values()
+                if backend.network
+            }
+
+            try:
+                for backend, values in batches.values():
+                    if not backend.network:
+                        results[backend.name] = {
+                            value: backend.lookup(value) for value in values
+                        }
+
+                for name, value_futures in futures.items():
+                    results[name] = {
+                        value: future.result()
+                        for value, future in value_futures.items()
+                    }
+            except requests.exceptions.RequestException:
+                # Don't wait for the requests that haven't started yet
+                executor.shutdown(wait=False, cancel_futures=True)
+
+                raise
+
+        return results
+
+    def rows(self, results: dict):
+        """Yield the rows of the CSV for the results of validate().
+
+        The values of each column are in the order we first saw them.
+
+        :param results: the results of validate().
+        :returns iterator of dicts
+        """
+
+        for column, (backend, values) in self.columns.items():
+            for value, count in values.items():
+                result = results[backend.name][value]
+
+                if result is None:
+                    match_type, identifier = "", ""
+                else:
+                    match_type, identifier = result
+
+                yield {
+                    "column": column,
+                    "value": value,
+                    "count": count,
+                    "backend": backend.name,
+                    "matched": "false" if result is None else "true",
+                    "match type": match_type,
+                    "identifier": identifier,
+                }